@@ -1,4 +1,5 @@
 import os
+import sys
 import shutil
 import cv2
 import numpy as np
@@ -9,6 +10,57 @@ from pathlib import Path
 import re
 from typing import Dict, Any, Union, List
 
+# Shared image processing modules live in pythonService
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pythonService'))
+from table_structure import detect_lines
+from keyword_matcher import keyword_matcher
+
+# Key text patterns specific to the beige certificate (one group per entry)
+KEY_PATTERNS = [
+    ["MAHARASHTRA STATE BOARD OF"],
+    ["SECONDARY SCHOOL CERTIFICATE EXAMINATION - CERTIFICATE"],
+    ["This is to certify that"],
+    ["DISTINCTION"],
+    ["ENGLISH (1ST LANG)"],
+    ["MATHEMATICS"],
+    ["SCIENCE & TECHNOLOGY"],
+    ["SOCIAL SCIENCES"]
+]
+
+# Patterns that should NOT be present (specific to pink certificate)
+NEGATIVE_PATTERNS = [
+    ["MUMBAI DIVISIONAL BOARD"],
+    ["STATEMENT OF MARKS"],
+    ["CANDIDATE'S FULL NAME"],
+    ["Subject Code No"],
+    ["In Figures"]
+]
+
+# Both pattern sets in one automaton, so the OCR text is scanned once
+BEIGE_PATTERNS = keyword_matcher({
+    **{f'key:{i}': group for i, group in enumerate(KEY_PATTERNS)},
+    **{f'negative:{i}': group for i, group in enumerate(NEGATIVE_PATTERNS)},
+})
+
+# Text elements the beige SSC certificate must (and must not) contain, for verify_template()
+REQUIRED_ELEMENTS = [
+    "MAHARASHTRA STATE BOARD",
+    "SECONDARY SCHOOL CERTIFICATE",
+    "EXAMINATION",
+    "CERTIFICATE",
+    "This is to certify that"
+]
+FORBIDDEN_ELEMENTS = [
+    "MUMBAI DIVISIONAL BOARD",
+    "STATEMENT OF MARKS",
+    "Subject Code No",
+    "CANDIDATE'S FULL NAME"
+]
+BEIGE_ELEMENTS = keyword_matcher({
+    **{f'required:{elem}': [elem] for elem in REQUIRED_ELEMENTS},
+    **{f'forbidden:{elem}': [elem] for elem in FORBIDDEN_ELEMENTS},
+})
+
 def numpy_to_list(obj: Any) -> Any:
     """Convert numpy arrays and types to Python native types."""
     if isinstance(obj, np.ndarray):
@@ -72,10 +124,10 @@ def match_template(img1, img2, features1, features2):
         aspect_ratio_match = abs(aspect_ratio1 - aspect_ratio2) < 0.2
         
         # Calculate positive pattern score
-        pattern_score = min(1.0, features1['pattern_matches'] / len(key_patterns))
+        pattern_score = min(1.0, features1['pattern_matches'] / len(KEY_PATTERNS))
         
         # Calculate negative pattern penalty
-        negative_score = max(0.0, 1.0 - (features1['negative_matches'] / len(negative_patterns)))
+        negative_score = max(0.0, 1.0 - (features1['negative_matches'] / len(NEGATIVE_PATTERNS)))
         
         # Color format matching (beige vs pink)
         color_match = features1['is_beige']
@@ -138,6 +190,11 @@ def extract_features(image_path: str) -> Dict[str, Any]:
     binary = cv2.adaptiveThreshold(normalized, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
                                  cv2.THRESH_BINARY, 15, 5)
     
+    # Ruled table lines (ink is black in the binary image)
+    ink = cv2.bitwise_not(binary)
+    horizontal_lines = detect_lines(ink, 'horizontal')
+    vertical_lines = detect_lines(ink, 'vertical')
+    
     # Initialize SIFT detector with more features and lower contrast threshold
     sift = cv2.SIFT_create(nfeatures=2000, contrastThreshold=0.02)
     keypoints, descriptors = sift.detectAndCompute(binary, None)
@@ -170,39 +227,10 @@ def extract_features(image_path: str) -> Dict[str, Any]:
     
     combined_text = ' '.join(all_text)
     
-    # Check for key text patterns specific to the beige certificate
-    key_patterns = [
-        ["MAHARASHTRA STATE BOARD OF"],
-        ["SECONDARY SCHOOL CERTIFICATE EXAMINATION - CERTIFICATE"],
-        ["This is to certify that"],
-        ["DISTINCTION"],
-        ["ENGLISH (1ST LANG)"],
-        ["MATHEMATICS"],
-        ["SCIENCE & TECHNOLOGY"],
-        ["SOCIAL SCIENCES"]
-    ]
-    
-    # Check for patterns that should NOT be present (specific to pink certificate)
-    negative_patterns = [
-        ["MUMBAI DIVISIONAL BOARD"],
-        ["STATEMENT OF MARKS"],
-        ["CANDIDATE'S FULL NAME"],
-        ["Subject Code No"],
-        ["In Figures"]
-    ]
-    
-    pattern_matches = 0
-    negative_matches = 0
-    
-    # Count positive matches
-    for pattern_group in key_patterns:
-        if any(pat.lower() in combined_text.lower() for pat in pattern_group):
-            pattern_matches += 1
-    
-    # Count negative matches
-    for pattern_group in negative_patterns:
-        if any(pat.lower() in combined_text.lower() for pat in pattern_group):
-            negative_matches += 1
+    # Count positive and negative pattern groups in one pass over the text
+    matches = BEIGE_PATTERNS.match(combined_text)
+    pattern_matches = matches.count(f'key:{i}' for i in range(len(KEY_PATTERNS)))
+    negative_matches = matches.count(f'negative:{i}' for i in range(len(NEGATIVE_PATTERNS)))
     
     # Detect average color to differentiate between beige and pink certificates
     avg_color = cv2.mean(image)[:3]  # BGR format
@@ -336,28 +364,10 @@ def verify_template(image_path, template_name=None):
             except:
                     continue
                 
-        # Required text elements that must be present
-        required_elements = [
-            "MAHARASHTRA STATE BOARD",
-            "SECONDARY SCHOOL CERTIFICATE",
-            "EXAMINATION",
-            "CERTIFICATE",
-            "This is to certify that"
-        ]
-        
-        # Elements that should not be present (from pink certificate)
-        forbidden_elements = [
-            "MUMBAI DIVISIONAL BOARD",
-            "STATEMENT OF MARKS",
-            "Subject Code No",
-            "CANDIDATE'S FULL NAME"
-        ]
-        
-        # Check for required elements
-        required_matches = sum(1 for elem in required_elements if elem.upper() in text.upper())
-        
-        # Check for forbidden elements
-        forbidden_matches = sum(1 for elem in forbidden_elements if elem.upper() in text.upper())
+        # Required and forbidden elements (the latter from the pink certificate)
+        matches = BEIGE_ELEMENTS.match(text)
+        required_matches = matches.count(f'required:{elem}' for elem in REQUIRED_ELEMENTS)
+        forbidden_matches = matches.count(f'forbidden:{elem}' for elem in FORBIDDEN_ELEMENTS)
         
         # Calculate average color in BGR
         avg_color = cv2.mean(image)[:3]
@@ -374,7 +384,7 @@ def verify_template(image_path, template_name=None):
                       is_beige)
         
         # Calculate match percentage
-        match_percentage = (required_matches / len(required_elements)) * 100
+        match_percentage = (required_matches / len(REQUIRED_ELEMENTS)) * 100
         
         # Calculate confidence
         if is_verified:
@@ -391,13 +401,13 @@ def verify_template(image_path, template_name=None):
         return {
             'verified': is_verified,
             'template': template_name if is_verified else None,
-            'match_score': float(required_matches / len(required_elements)),
+            'match_score': float(required_matches / len(REQUIRED_ELEMENTS)),
             'confidence': confidence,
             'details': {
-                'pattern_score': float(required_matches / len(required_elements)),
+                'pattern_score': float(required_matches / len(REQUIRED_ELEMENTS)),
                 'color_match': bool(is_beige),
                 'text_match_percentage': match_percentage,
-                'negative_score': float(1 - (forbidden_matches / len(forbidden_elements)))
+                'negative_score': float(1 - (forbidden_matches / len(FORBIDDEN_ELEMENTS)))
             }
         }
         
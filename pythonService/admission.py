@@ -0,0 +1,182 @@
+"""
+Admission control for the CPU-heavy endpoints.
+
+Each gate lets a fixed number of requests run at once (by default this
+process's share of the cores, see default_concurrency()). A bounded number of further requests wait for a slot; once the wait
+queue is full, new requests are rejected straight away with 429, and a
+request that waits longer than its timeout gets 503. Both carry a
+Retry-After estimated from recent service times. Rejection happens before
+the upload body is parsed, so an overloaded process does not buffer 16 MB
+uploads it is going to refuse.
+"""
+
+import functools
+import math
+import os
+import threading
+import time
+
+from flask import jsonify
+
+import profiling
+
+# Weight of the latest request in the moving average of service time
+SERVICE_TIME_SMOOTHING = 0.2
+
+
+class AdmissionRejected(Exception):
+    """Raised when a gate refuses a request"""
+
+    def __init__(self, status, message, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+class AdmissionGate:
+    """Concurrency limit with a bounded, timed wait queue"""
+
+    def __init__(self, name, limit, max_waiting, wait_timeout):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_waiting = max(0, max_waiting)
+        self.wait_timeout = wait_timeout
+
+        self._cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+
+        # Metrics
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.queue_seconds_total = 0.0
+        self.queue_seconds_max = 0.0
+        self.avg_service_seconds = 1.0
+
+    def retry_after(self):
+        """Seconds until a slot is likely to be free for a new request"""
+        backlog = self.waiting + 1
+        return max(1, math.ceil(self.avg_service_seconds * backlog / self.limit))
+
+    def acquire(self):
+        """Wait for a slot. Returns the seconds spent queued; raises AdmissionRejected"""
+        start = time.perf_counter()
+        with self._cond:
+            if self.active >= self.limit:
+                if self.waiting >= self.max_waiting:
+                    self.rejected_full += 1
+                    raise AdmissionRejected(
+                        429, f'Too many {self.name} requests in progress, try again later', self.retry_after())
+
+                self.waiting += 1
+                try:
+                    deadline = start + self.wait_timeout
+                    while self.active >= self.limit:
+                        remaining = deadline - time.perf_counter()
+                        if remaining <= 0:
+                            self.rejected_timeout += 1
+                            raise AdmissionRejected(
+                                503, f'Service busy, {self.name} request timed out waiting', self.retry_after())
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+
+            self.active += 1
+            self.admitted += 1
+            queued = time.perf_counter() - start
+            self.queue_seconds_total += queued
+            self.queue_seconds_max = max(self.queue_seconds_max, queued)
+            return queued
+
+    def release(self, service_seconds):
+        with self._cond:
+            self.active -= 1
+            self.avg_service_seconds += SERVICE_TIME_SMOOTHING * (service_seconds - self.avg_service_seconds)
+            self._cond.notify()
+
+    def metrics(self):
+        with self._cond:
+            return {
+                'limit': self.limit,
+                'maxWaiting': self.max_waiting,
+                'active': self.active,
+                'waiting': self.waiting,
+                'admitted': self.admitted,
+                'rejectedQueueFull': self.rejected_full,
+                'rejectedTimeout': self.rejected_timeout,
+                'queueSecondsTotal': round(self.queue_seconds_total, 6),
+                'queueSecondsMax': round(self.queue_seconds_max, 6),
+                'avgServiceSeconds': round(self.avg_service_seconds, 6),
+            }
+
+
+def server_threads():
+    """Requests one process serves at once (GUNICORN_THREADS), or None if unbounded"""
+    threads = os.getenv('GUNICORN_THREADS')
+    return max(1, int(threads)) if threads else None
+
+
+def default_concurrency():
+    """
+    This process's share of the cores: cores / WEB_CONCURRENCY processes.
+    Under gunicorn a process serves at most GUNICORN_THREADS requests, so
+    the limit is kept below that, leaving a thread for the other routes;
+    a limit at or above it would never queue or shed anything.
+    """
+    processes = max(1, int(os.getenv('WEB_CONCURRENCY', '1')))
+    limit = max(1, (os.cpu_count() or 1) // processes)
+    threads = server_threads()
+    if threads is not None:
+        limit = max(1, min(limit, threads - 1))
+    return limit
+
+
+def default_queue(limit):
+    """
+    Twice the limit; under gunicorn, no more than the threads left after the
+    running and waiting requests, so the queue can fill and reject with 429
+    """
+    waiting = 2 * limit
+    threads = server_threads()
+    if threads is not None:
+        waiting = max(0, min(waiting, threads - limit - 1))
+    return waiting
+
+
+def gate_from_env(name, default_limit=None, default_waiting=None, default_timeout=30.0):
+    """
+    Build a gate configured by ADMISSION_<NAME>_CONCURRENCY, _QUEUE and
+    _TIMEOUT. Defaults: default_concurrency() slots and default_queue()
+    waiting requests.
+    """
+    prefix = f"ADMISSION_{name.upper()}"
+    limit = int(os.getenv(f"{prefix}_CONCURRENCY", default_limit or default_concurrency()))
+    max_waiting = int(os.getenv(f"{prefix}_QUEUE", default_waiting if default_waiting is not None
+                                else default_queue(limit)))
+    wait_timeout = float(os.getenv(f"{prefix}_TIMEOUT", default_timeout))
+    return AdmissionGate(name, limit, max_waiting, wait_timeout)
+
+
+def admission_controlled(gate):
+    """Flask view decorator running the view only once gate admits the request"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                queued = gate.acquire()
+            except AdmissionRejected as e:
+                response = jsonify({'success': False, 'message': e.message})
+                response.status_code = e.status
+                response.headers['Retry-After'] = str(e.retry_after)
+                return response
+
+            profiling.record('admission_wait', queued)
+            start = time.perf_counter()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                gate.release(time.perf_counter() - start)
+        return wrapper
+    return decorator
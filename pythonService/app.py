@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from flask import Flask, request, jsonify, send_from_directory, send_file, Response, g
 from flask_cors import CORS
 import os
 from dotenv import load_dotenv
@@ -10,6 +10,8 @@ import json
 from werkzeug.utils import secure_filename
 import traceback
 import time
+import tempfile
+from contextlib import closing
 import logging
 import pytesseract
 from reportlab.pdfgen import canvas
@@ -24,7 +26,25 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 import requests
-import qrcode
+from qr_render import draw_qr, qr_cache_info
+from pdf_output import PdfSpool, stream_pdf, bound_embed_image
+from template_registry import TemplateRegistry
+from job_queue import JobQueue, JobWorkers, parse_priority
+from admission import gate_from_env, admission_controlled
+import metrics
+from metrics import stage, VERDICTS, ERRORS
+from profiling import profiled
+from image_pyramid import ImagePyramid, CANONICAL_LEVEL, pyramid_level
+from image_decode import open_pyramid, decode
+from ingest_guard import inspect_upload, UploadRejected
+from page_source import UnsupportedPages, iter_pages, is_paged
+from registration import register
+from seal_detector import detect_seals
+from table_structure import table_structure
+from keyword_matcher import keyword_matcher
+from text_similarity import text_signature, signature_of
+from field_extractor import ExtractedField, schema_for
+from doc_classifier import classify as classify_document
 
 # Load environment variables from .env file
 load_dotenv()
@@ -33,11 +53,7 @@ load_dotenv()
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 TEMP_DIR = os.path.join(BASE_DIR, 'uploads')
 TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
-
-# Create necessary directories
-os.makedirs(TEMP_DIR, exist_ok=True)
-os.makedirs(TEMPLATE_DIR, exist_ok=True)
-os.makedirs(os.path.join(TEMP_DIR, 'visualizations'), exist_ok=True)
+FEATURES_DIR = os.path.join(os.path.dirname(BASE_DIR), 'server', 'data', 'features')
 
 # App configuration
 app = Flask(__name__)
@@ -45,6 +61,25 @@ app.logger.setLevel(logging.INFO)
 app.config['UPLOAD_FOLDER'] = TEMP_DIR
 app.config['TEMPLATE_FOLDER'] = TEMPLATE_DIR
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB max upload size
+app.config['PERSIST_PDFS'] = os.getenv('PERSIST_PDFS', 'true').lower() == 'true'  # Keep content-addressed copies of generated PDFs
+
+# Trained templates, hot-reloaded from TEMPLATE_DIR and FEATURES_DIR
+template_registry = TemplateRegistry(
+    TEMPLATE_DIR, FEATURES_DIR,
+    poll_interval=float(os.getenv('TEMPLATE_POLL_INTERVAL', '2.0'))
+)
+
+# Persistent queue for /api/jobs; worker threads are started with the server
+job_queue = JobQueue(os.getenv('JOB_DB_PATH', os.path.join(TEMP_DIR, 'jobs.sqlite3')))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '1'))
+JOB_STALE_SECONDS = int(os.getenv('JOB_STALE_SECONDS', '60'))  # Running jobs without a heartbeat for this long are requeued
+
+# Concurrency limits for the CPU-heavy endpoints (per process)
+admission_gates = {
+    'verify': gate_from_env('verify'),
+    'extract': gate_from_env('extract'),
+    'pdf': gate_from_env('pdf'),
+}
 
 # Configure CORS to allow all origins
 CORS(app, resources={
@@ -62,7 +97,6 @@ CORS(app, resources={
 try:
     pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
     has_tesseract = True
-    print("Tesseract found at:", pytesseract.pytesseract.tesseract_cmd)
 except ImportError:
     print("Pytesseract not available. Text extraction will be limited.")
     has_tesseract = False
@@ -77,7 +111,7 @@ except ImportError:
     has_skimage = False
 
 # Define allowed file extensions
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'tif'}
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'tif', 'pdf'}
 
 # Email configuration
 SMTP_SERVER = "smtp.office365.com"  # Changed to Office 365 for student.sfit.ac.in
@@ -86,20 +120,69 @@ SMTP_USERNAME = os.getenv('SMTP_USERNAME')
 SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
 SENDER_EMAIL = os.getenv('SENDER_EMAIL')
 
-# Print email configuration for debugging
-print("="*50)
-print("Email Configuration:")
-print(f"SMTP_USERNAME: {SMTP_USERNAME}")
-print(f"SENDER_EMAIL: {SENDER_EMAIL}")
-print(f"SMTP_PASSWORD exists: {'Yes' if SMTP_PASSWORD else 'No'}")
-print(f"SMTP_SERVER: {SMTP_SERVER}")
-print(f"SMTP_PORT: {SMTP_PORT}")
-print("="*50)
+_service_initialized = False
+
+def init_service():
+    """
+    Set up a process that serves requests: create the upload directories
+    and print the OCR and email configuration. Called by every entry point
+    (__main__, wsgi.py, asgi_app.py); processes that only run CPU stages,
+    like asgi_app's process pool, import this module without it.
+    """
+    global _service_initialized
+    if _service_initialized:
+        return
+    _service_initialized = True
+
+    # Create necessary directories
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    os.makedirs(TEMPLATE_DIR, exist_ok=True)
+    os.makedirs(os.path.join(TEMP_DIR, 'visualizations'), exist_ok=True)
+
+    if has_tesseract:
+        print("Tesseract found at:", pytesseract.pytesseract.tesseract_cmd)
+
+    # Print email configuration for debugging
+    print("="*50)
+    print("Email Configuration:")
+    print(f"SMTP_USERNAME: {SMTP_USERNAME}")
+    print(f"SENDER_EMAIL: {SENDER_EMAIL}")
+    print(f"SMTP_PASSWORD exists: {'Yes' if SMTP_PASSWORD else 'No'}")
+    print(f"SMTP_SERVER: {SMTP_SERVER}")
+    print(f"SMTP_PORT: {SMTP_PORT}")
+    print("="*50)
 
 # Define verification thresholds
 VERIFICATION_THRESHOLD = 0.99  # 85% similarity required for verification
 HIGH_CONFIDENCE_THRESHOLD = 0.99  # 90% similarity for high confidence
 
+# Pyramid level registered uploads are compared with their template at (A4 at 75 DPI)
+REGISTERED_COMPARE_LEVEL = 'low'
+
+# (width, height) uploads and templates are resized to when they cannot be registered
+COMPARE_SIZE = (600, 800)
+
+# Resolution pages of PDFs are rasterized at: the canonical level for
+# verification (A4 at 150 DPI), the high level for OCR (A4 at 300 DPI)
+VERIFY_PAGE_DPI = int(os.getenv('VERIFY_PAGE_DPI', '150'))
+OCR_PAGE_DPI = int(os.getenv('OCR_PAGE_DPI', '300'))
+
+# Phrases whose presence in both document and template text counts towards text similarity
+KEY_PHRASES = ['STATEMENT OF MARKS', 'CERTIFICATE', 'BOARD', 'EXAMINATION', 'PASSING', 'MARKS']
+
+# Templates compared in full after the text LSH index has ranked candidates by similarity
+TEXT_CANDIDATES = int(os.getenv('TEXT_CANDIDATES', '5'))
+
+# Every keyword check on OCR text, compiled into one automaton (one pass per text)
+DOCUMENT_KEYWORDS = keyword_matcher({
+    'hsc': ['HSC', 'HIGHER SECONDARY'],
+    'ssc': ['SSC', 'SECONDARY SCHOOL'],
+    'hsc_certificate': ['HSC', 'HIGHER SECONDARY CERTIFICATE'],
+    'ssc_certificate': ['SSC', 'SECONDARY SCHOOL CERTIFICATE'],
+    'maharashtra': ['MAHARASHTRA'],
+    **{phrase: [phrase] for phrase in KEY_PHRASES},
+})
+
 # Pinata configuration
 PINATA_API_KEY = os.getenv('PINATA_API_KEY', 'your_api_key')
 PINATA_SECRET_KEY = os.getenv('PINATA_SECRET_KEY', 'your_secret_key')
@@ -108,6 +191,26 @@ PINATA_JWT = os.getenv('PINATA_JWT', '')
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def unique_upload_path(filename):
+    """
+    Path of a new, empty file in the upload folder for an upload called
+    filename (extension kept). Concurrent uploads with the same name get
+    different files, so one request never reads another's upload.
+    """
+    stem, ext = os.path.splitext(secure_filename(filename))
+    fd, path = tempfile.mkstemp(dir=app.config['UPLOAD_FOLDER'], prefix=f"{stem}_", suffix=ext.lower())
+    os.close(fd)
+    return path
+
+def remove_upload(file_path):
+    """Delete a saved upload once the request is done with it"""
+    if file_path is None:
+        return
+    try:
+        os.remove(file_path)
+    except OSError as e:
+        app.logger.warning(f"Could not remove upload {file_path}: {str(e)}")
+
 @app.after_request
 def after_request(response):
     """Add CORS headers to all responses"""
@@ -119,6 +222,21 @@ def after_request(response):
         response.headers.add('Access-Control-Allow-Credentials', 'true')
     return response
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Request latency per endpoint, and server errors"""
+    start = g.get('request_start')
+    if start is not None:
+        endpoint = request.endpoint or 'unknown'
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, status=str(response.status_code))
+        if response.status_code >= 500:
+            ERRORS.inc(where=endpoint)
+    return response
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -141,13 +259,8 @@ def list_templates():
                 'templates': []
             }), 500
         
-        # Look for .npy files in the template directory
-        for filename in os.listdir(template_dir):
-            if filename.endswith('.npy'):
-                # Remove .npy extension and clean up the name
-                template_name = filename.replace('.npy', '').strip()
-                if template_name:  # Only add non-empty names
-                    templates.append(template_name)
+        # Trained (.npy) templates from the current registry snapshot
+        templates = template_registry.snapshot().names()
         
         if not templates:
             app.logger.warning("No templates found in directory")
@@ -213,8 +326,11 @@ def calculate_detailed_scores(score):
 @app.route('/api/verify', methods=['POST'])
 @app.route('/template-verifier/verify', methods=['POST'])
 @app.route('/api/template-verifier/verify', methods=['POST'])
+@profiled
+@admission_controlled(admission_gates['verify'])
 def verify_document():
     """Verify a document against known templates"""
+    file_path = None
     try:
         # Check if file is in the request
         if 'document' not in request.files:
@@ -238,109 +354,21 @@ def verify_document():
                 'success': False,
                 'message': f'File type not allowed. Allowed types: {", ".join(ALLOWED_EXTENSIONS)}'
             }), 400
-            
-        # Save file to temporary directory
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-        
-        # Get image for comparison
-        uploaded_image = cv2.imread(file_path)
-        if uploaded_image is None:
-            return jsonify({
-                'success': False,
-                'message': 'Could not read image file'
-            }), 400
-
-        # Define the exact template filenames we want to match against
-        TEMPLATE_FILES = {
-            'HSC': 'marksheet hsc .jpg',  # Updated to match actual filename with spaces
-            'SSC': 'marksheet_ssc_2.jpg'
-        }
-
-        # Function to compare images
-        def compare_images(img1, img2):
-            try:
-                # Resize images to same size for comparison
-                height = 800
-                width = 600
-                img1_resized = cv2.resize(img1, (width, height))
-                img2_resized = cv2.resize(img2, (width, height))
-                
-                # Convert to grayscale
-                img1_gray = cv2.cvtColor(img1_resized, cv2.COLOR_BGR2GRAY)
-                img2_gray = cv2.cvtColor(img2_resized, cv2.COLOR_BGR2GRAY)
-                
-                # Calculate similarity using structural similarity index
-                try:
-                    from skimage.metrics import structural_similarity as ssim
-                    similarity = ssim(img1_gray, img2_gray)
-                except ImportError:
-                    # Fallback to basic difference if scikit-image is not available
-                    difference = cv2.absdiff(img1_gray, img2_gray)
-                    similarity = 1 - (difference.mean() / 255)
-                
-                return similarity
-            except Exception as e:
-                app.logger.error(f"Error comparing images: {str(e)}")
-                return 0
-
-        # Compare with each template
-        best_match = None
-        best_score = 0
-        best_template_name = None
-        best_template_type = None
-
-        # Only compare against our two specific templates
-        for template_type, template_filename in TEMPLATE_FILES.items():
-            template_path = os.path.join(app.config['TEMPLATE_FOLDER'], template_filename)  # Changed to TEMPLATE_FOLDER
-            if os.path.exists(template_path):
-                template_img = cv2.imread(template_path)
-                if template_img is not None:
-                    similarity = compare_images(uploaded_image, template_img)
-                    app.logger.info(f"Comparing with {template_type} template ({template_filename}), similarity: {similarity}")
-                    if similarity > best_score:
-                        best_score = similarity
-                        best_match = template_img
-                        best_template_name = template_filename
-                        best_template_type = template_type
 
-        # Very strict threshold for matching (0.85 or 85% similarity)
-        confidence_level = get_confidence_level(best_score)
-        detailed_scores = calculate_detailed_scores(best_score)
+        # Header only: oversized or mislabelled images are refused before they are saved or decoded
+        try:
+            with stage('inspect'):
+                inspect_upload(file)
+        except UploadRejected as e:
+            return jsonify({'success': False, 'message': e.message}), e.status
+            
+        # Save file to temporary directory, under a name no other request uses
+        file_path = unique_upload_path(file.filename)
+        with stage('save_upload'):
+            file.save(file_path)
         
-        if best_score > VERIFICATION_THRESHOLD:
-            result = {
-                'success': True,
-                'isVerified': confidence_level == "High",
-                'template': best_template_name,
-                'matchScore': round(best_score * 100, 2),
-                'matchConfidence': confidence_level,
-                'scores': detailed_scores,
-                'documentType': best_template_type,
-                'message': f"Document verified as {best_template_type} certificate with {confidence_level.lower()} confidence"
-            }
-        else:
-            result = {
-                'success': True,
-                'isVerified': False,
-                'template': None,
-                'matchScore': round(best_score * 100, 2),
-                'matchConfidence': confidence_level,
-                'scores': detailed_scores,
-                'documentType': None,
-                'message': "Document does not match any known template"
-            }
-
-        # Add visualization if needed
-        if best_match is not None and best_score > VERIFICATION_THRESHOLD:
-            visualization_filename = f"comparison_{int(time.time())}.jpg"
-            visualization_path = os.path.join(app.config['UPLOAD_FOLDER'], visualization_filename)
-            cv2.imwrite(visualization_path, np.hstack([uploaded_image, best_match]))
-            result['visualizationUrl'] = f"/visualizations/{visualization_filename}"
-
-        app.logger.info(f"Verification result: {result}")
-        return jsonify(result)
+        result, status = verify_image(file_path)
+        return jsonify(result), status
 
     except Exception as e:
         app.logger.error(f"Error verifying document: {str(e)}")
@@ -349,11 +377,16 @@ def verify_document():
             'success': False,
             'message': f'Error during verification: {str(e)}'
         }), 500
+    finally:
+        remove_upload(file_path)
 
 @app.route('/extract', methods=['POST'])
 @app.route('/api/extract', methods=['POST'])
+@profiled
+@admission_controlled(admission_gates['extract'])
 def extract_document_data():
     """Extract data from a document image"""
+    file_path = None
     try:
         # Check if file is in the request
         if 'document' not in request.files:
@@ -377,31 +410,21 @@ def extract_document_data():
                 'success': False,
                 'message': f'File type not allowed. Allowed types: {", ".join(ALLOWED_EXTENSIONS)}'
             }), 400
+
+        # Header only: oversized or mislabelled images are refused before they are saved or decoded
+        try:
+            with stage('inspect'):
+                inspect_upload(file)
+        except UploadRejected as e:
+            return jsonify({'success': False, 'message': e.message}), e.status
             
-        # Save file to temporary directory
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-        
-        # Open the image with OpenCV
-        image = cv2.imread(file_path)
-        if image is None:
-            return jsonify({
-                'success': False,
-                'message': 'Could not read image file'
-            }), 400
-            
-        # Extract text from the image
-        text = extract_text(image)
-        
-        # Extract student data based on patterns in the text
-        extracted_data = extract_student_data(text)
+        # Save file to temporary directory, under a name no other request uses
+        file_path = unique_upload_path(file.filename)
+        with stage('save_upload'):
+            file.save(file_path)
         
-        return jsonify({
-            'success': True,
-            'message': 'Data extracted successfully',
-            'extractedData': extracted_data
-        })
+        result, status = extract_image_data(file_path)
+        return jsonify(result), status
     except Exception as e:
         app.logger.error(f"Error extracting data: {str(e)}")
         traceback.print_exc()
@@ -409,10 +432,306 @@ def extract_document_data():
             'success': False,
             'message': f'Error during data extraction: {str(e)}'
         }), 500
+    finally:
+        remove_upload(file_path)
+
+def compare_gray(img1_gray, img2_gray):
+    """Similarity of two equally sized grayscale images, using structural similarity index"""
+    try:
+        from skimage.metrics import structural_similarity as ssim
+        return ssim(img1_gray, img2_gray)
+    except ImportError:
+        # Fallback to basic difference if scikit-image is not available
+        difference = cv2.absdiff(img1_gray, img2_gray)
+        return 1 - (difference.mean() / 255)
+
+def verify_image(file_path):
+    """
+    Compare a saved upload against the HSC/SSC templates.
+    Pure CPU work with no request context, so it can also run in a worker
+    process. Returns (result dict, HTTP status).
+    """
+    if is_paged(file_path):
+        return verify_pages(file_path)
+
+    # Get image for comparison: only the low level is decoded here, at a
+    # reduced JPEG scale; other levels are decoded when first used
+    with stage('decode'):
+        pyramid = open_pyramid(file_path)
+    if pyramid is None:
+        return {
+            'success': False,
+            'message': 'Could not read image file'
+        }, 400
+    return verify_pyramid(pyramid)
+
+def read_pages(file_path, dpi):
+    """
+    Pages of a multi-page upload, one at a time, timed as decoding.
+    Yields (page number, BGR image); a page that cannot be read ends the
+    document there. Raises UnsupportedPages for documents this installation
+    cannot read.
+    """
+    pages = iter_pages(file_path, dpi=dpi)
+    while True:
+        try:
+            with stage('decode'):
+                page = next(pages, None)
+        except (OSError, ValueError) as e:
+            app.logger.error(f"Error reading pages of {file_path}: {str(e)}")
+            return
+        if page is None:
+            return
+        yield page
+
+def verify_pages(file_path):
+    """
+    Verify a multi-page upload (PDF, multi-frame TIFF or GIF) page by page;
+    only one page is in memory at a time. The best page's result is returned,
+    with every page's result under 'pages'.
+    """
+    pages = []
+    try:
+        for number, image in read_pages(file_path, VERIFY_PAGE_DPI):
+            result, _ = verify_pyramid(ImagePyramid(image))
+            del image
+            result['page'] = number
+            pages.append(result)
+    except UnsupportedPages as e:
+        return {'success': False, 'message': str(e)}, 415
+
+    if not pages:
+        return {'success': False, 'message': 'Could not read image file'}, 400
+    best = max(pages, key=lambda result: result['matchScore'])
+    return {**best, 'pageCount': len(pages), 'pages': pages}, 200
+
+def verify_pyramid(pyramid):
+    """Compare one document (ImagePyramid) against the HSC/SSC templates. Returns (result dict, HTTP status)."""
+    # Define the exact template filenames we want to match against
+    TEMPLATE_FILES = {
+        'HSC': 'marksheet hsc .jpg',  # Updated to match actual filename with spaces
+        'SSC': 'marksheet_ssc_2.jpg'
+    }
+
+    # Function to compare images
+    def compare_images(img1, img2):
+        try:
+            with stage('preprocess'):
+                # Resize images to same size for comparison
+                width, height = COMPARE_SIZE
+                img1_resized = cv2.resize(img1, (width, height))
+                img2_resized = cv2.resize(img2, (width, height))
+                
+                # Convert to grayscale
+                img1_gray = cv2.cvtColor(img1_resized, cv2.COLOR_BGR2GRAY)
+                img2_gray = cv2.cvtColor(img2_resized, cv2.COLOR_BGR2GRAY)
+            
+            with stage('compare'):
+                return compare_gray(img1_gray, img2_gray)
+        except Exception as e:
+            ERRORS.inc(where='compare')
+            app.logger.error(f"Error comparing images: {str(e)}")
+            return 0
+
+    # Register the upload to the best-candidate template, so rotation and
+    # perspective of phone photos do not spoil the pixel comparison
+    best_match = None
+    best_score = 0
+    best_template_name = None
+    best_template_type = None
+
+    template_paths = {template_type: os.path.join(app.config['TEMPLATE_FOLDER'], template_filename)
+                      for template_type, template_filename in TEMPLATE_FILES.items()}
+
+    # Classify the thumbnail first and try the predicted type's template
+    # before all of them (None without a trained classifier)
+    with stage('classify'):
+        classification = classify_document(pyramid)
+    routed = []
+    if classification is not None and classification['confident']:
+        routed = [path for template_type, path in template_paths.items()
+                  if template_type.lower() == classification['document_type']]
+        app.logger.info(f"Classified as {classification['document_type']} ({classification['color']}) "
+                        f"in {classification['ms']}ms")
+    try:
+        with stage('register'):
+            registered = register(pyramid, routed) if routed else None
+            if registered is None:
+                registered = register(pyramid, list(template_paths.values()))
+    except cv2.error as e:
+        ERRORS.inc(where='register')
+        app.logger.error(f"Error registering image: {str(e)}")
+        registered = None
+
+    if registered is not None:
+        # Both pyramids share the template's frame, so their levels align pixel for pixel
+        template_type = next(t for t, path in template_paths.items() if path == registered.frame.path)
+        with stage('compare'):
+            best_score = compare_gray(registered.context(REGISTERED_COMPARE_LEVEL).gray,
+                                      registered.frame.pyramid.context(REGISTERED_COMPARE_LEVEL).gray)
+        app.logger.info(f"Registered to {template_type} template ({registered.frame.name}) with "
+                        f"{registered.inliers} inliers, similarity: {best_score}")
+        best_template_name = registered.frame.name
+        best_template_type = template_type
+
+        # Seals and table of the registered document, in the template's frame
+        with stage('seals'):
+            seals = extract_seal_positions(registered)
+        with stage('table'):
+            table = registered.run(extract_table_structure)
+    else:
+        # No reliable homography: compare the resized upload with every template
+        uploaded_image = pyramid.context('low').bgr
+        for template_type, template_path in template_paths.items():
+            if os.path.exists(template_path):
+                with stage('decode'):
+                    template_img = decode(template_path, long_edge=COMPARE_SIZE[1])
+                if template_img is not None:
+                    similarity = compare_images(uploaded_image, template_img)
+                    app.logger.info(f"Comparing with {template_type} template ({os.path.basename(template_path)}), similarity: {similarity}")
+                    if similarity > best_score:
+                        best_score = similarity
+                        best_match = template_img
+                        best_template_name = os.path.basename(template_path)
+                        best_template_type = template_type
+
+    # Very strict threshold for matching (0.85 or 85% similarity)
+    confidence_level = get_confidence_level(best_score)
+    detailed_scores = calculate_detailed_scores(best_score)
+    
+    if best_score > VERIFICATION_THRESHOLD:
+        result = {
+            'success': True,
+            'isVerified': confidence_level == "High",
+            'template': best_template_name,
+            'matchScore': round(best_score * 100, 2),
+            'matchConfidence': confidence_level,
+            'scores': detailed_scores,
+            'documentType': best_template_type,
+            'message': f"Document verified as {best_template_type} certificate with {confidence_level.lower()} confidence"
+        }
+    else:
+        result = {
+            'success': True,
+            'isVerified': False,
+            'template': None,
+            'matchScore': round(best_score * 100, 2),
+            'matchConfidence': confidence_level,
+            'scores': detailed_scores,
+            'documentType': None,
+            'message': "Document does not match any known template"
+        }
+
+    if classification is not None:
+        result['classification'] = classification
+
+    # Add visualization if needed
+    if registered is not None:
+        result['registration'] = {'template': registered.frame.name, 'inliers': registered.inliers,
+                                  'matches': registered.matches}
+        result['structure'] = {
+            'hasSeal': seals['has_seal_pattern'],
+            'hasLogo': seals['has_logo_pattern'],
+            'seals': {name: {'kind': region['kind'], 'found': region['found'],
+                             'matchScore': region.get('match_score')}
+                      for name, region in seals['regions'].items()},
+            'hasTable': table['has_table'],
+            'tableCells': table['cell_count']
+        }
+        best_match = registered.frame.pyramid.context(CANONICAL_LEVEL).bgr
+        uploaded_image = registered.context(CANONICAL_LEVEL).bgr
+    else:
+        uploaded_image = cv2.resize(uploaded_image, COMPARE_SIZE)
+        best_match = cv2.resize(best_match, COMPARE_SIZE) if best_match is not None else None
+    if best_match is not None and best_score > VERIFICATION_THRESHOLD:
+        visualization_filename = f"comparison_{time.time_ns()}.jpg"
+        visualization_path = os.path.join(app.config['UPLOAD_FOLDER'], visualization_filename)
+        cv2.imwrite(visualization_path, np.hstack([uploaded_image, best_match]))
+        result['visualizationUrl'] = f"/visualizations/{visualization_filename}"
+
+    VERDICTS.inc(document_type=result['documentType'] or 'none',
+                 verdict='verified' if result['isVerified'] else 'unverified')
+    app.logger.info(f"Verification result: verified={result['isVerified']} "
+                    f"template={result['template']} score={result['matchScore']}")
+    return result, 200
+
+def extract_image_data(file_path):
+    """
+    OCR a saved upload and extract the student data from its text.
+    Returns (result dict, HTTP status).
+    """
+    if is_paged(file_path):
+        return extract_pages(file_path)
+
+    # Full resolution for OCR (within MAX_DECODE_PIXELS)
+    with stage('decode'):
+        image = decode(file_path)
+    if image is None:
+        return {
+            'success': False,
+            'message': 'Could not read image file'
+        }, 400
+        
+    # Extract text from the image
+    text = extract_text(image)
+    
+    # Extract student data based on patterns in the text
+    fields, _ = extract_student_fields(text)
+    
+    return {
+        'success': True,
+        'message': 'Data extracted successfully',
+        'extractedData': student_data(fields),
+        'fieldConfidence': {name: field.confidence for name, field in fields.items()}
+    }, 200
+
+def extract_pages(file_path):
+    """
+    OCR a multi-page upload page by page, rasterized at OCR_PAGE_DPI. The
+    first page's data is returned at the top level, every page's under 'pages'.
+    """
+    pages = []
+    try:
+        for number, image in read_pages(file_path, OCR_PAGE_DPI):
+            fields, _ = extract_student_fields(extract_text(image))
+            del image
+            pages.append({
+                'page': number,
+                'extractedData': student_data(fields),
+                'fieldConfidence': {name: field.confidence for name, field in fields.items()}
+            })
+    except UnsupportedPages as e:
+        return {'success': False, 'message': str(e)}, 415
+
+    if not pages:
+        return {'success': False, 'message': 'Could not read image file'}, 400
+    return {
+        'success': True,
+        'message': f'Data extracted from {len(pages)} pages',
+        'extractedData': pages[0]['extractedData'],
+        'fieldConfidence': pages[0]['fieldConfidence'],
+        'pageCount': len(pages),
+        'pages': pages
+    }, 200
+
+def render_pdf_file(data, pdf_dir):
+    """
+    Render the transcript PDF for data and store it content-addressed in
+    pdf_dir. Returns (path, sha256, size).
+    """
+    spool = PdfSpool()
+    try:
+        with stage('pdf_render'):
+            render_transcript_pdf(data, spool)
+        return spool.persist(pdf_dir), spool.sha256, spool.size
+    finally:
+        spool.close()
 
 @app.route('/generate-pdf', methods=['POST'])
 @app.route('/api/generate-pdf', methods=['POST'])
 @app.route('/api/extract/generate-pdf', methods=['POST'])
+@profiled
+@admission_controlled(admission_gates['pdf'])
 def generate_pdf():
     """Generate a PDF from extracted data and original image"""
     try:
@@ -424,278 +743,267 @@ def generate_pdf():
                 'message': 'No data provided'
             }), 400
         
-        # Create PDF directory if it doesn't exist
-        pdf_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'pdfs')
-        os.makedirs(pdf_dir, exist_ok=True)
-        
-        # Clean student name for filename
+        # Clean student name for the download filename
         student_name = data.get('studentName', 'Unknown_Student')
         clean_student_name = secure_filename(student_name.replace(' ', '_'))
-        
-        # Create a PDF with the data
         pdf_filename = f"transcript_{clean_student_name}.pdf"
-        pdf_path = os.path.join(pdf_dir, pdf_filename)
-        
-        print(f"Generating PDF at: {pdf_path}")
-        
-        buffer = BytesIO()
-        c = canvas.Canvas(buffer, pagesize=letter)
-        
-        # Set up fonts
-        c.setFont("Helvetica-Bold", 24)
-        
-        # PAGE 1: CERTIFICATE COVER
-        c.drawString(50, 750, "MAHARASHTRA SSC CERTIFICATE")
-        
-        # Add horizontal line under title
-        c.line(50, 745, 550, 745)
-        
-        # Add student information section
-        c.setFont("Helvetica-Bold", 16)
-        c.drawString(50, 700, "STUDENT DETAILS")
-        
-        # Add student details with proper formatting
-        c.setFont("Helvetica", 12)
-        y_position = 670
-        
-        # Define fields and their labels
-        fields = [
-            ('studentName', 'Name'),
-            ('rollNumber', 'Seat/Roll Number'),
-            ('seatNumber', 'Seat Number'),
-            ('board', 'Board/University'),
-            ('batch', 'Batch'),
-            ('program', 'Program'),
-            ('examYear', 'Exam Year')
-        ]
-        
-        # Add each field with proper spacing and formatting
-        for field, label in fields:
-            if field in data and data[field]:
-                value = str(data[field]).strip()
-                if value and value.lower() not in ['n/a', 'none', 'null']:
-                    c.setFont("Helvetica-Bold", 12)
-                    c.drawString(50, y_position, f"{label}:")
-                    c.setFont("Helvetica", 12)
-                    c.drawString(200, y_position, value)
-                    y_position -= 25
-        
-        # Add verification section
-        y_position -= 20
-        c.setFont("Helvetica-Bold", 16)
-        c.drawString(50, y_position, "VERIFICATION INFORMATION")
-        y_position -= 30
-        
-        # Add verification details
-        c.setFont("Helvetica", 12)
-        c.drawString(50, y_position, "This document has been generated by the SuperCert Blockchain Certification System.")
-        y_position -= 20
-        c.drawString(50, y_position, "The information contained in this document can be verified through the SuperCert verification portal.")
-        y_position -= 40
-        
-        # Add timestamp
-        timestamp = datetime.now().strftime("%d/%m/%Y at %H:%M:%S")
-        c.drawString(50, y_position, f"Generated on: {timestamp}")
-        
-        # Add footer
-        c.setFont("Helvetica", 10)
-        c.drawString(50, 50, "This document is computer-generated and does not require a signature.")
-        c.drawString(50, 35, "Powered by SuperCert Blockchain Certification System")
-        c.drawString(50, 20, f"Maharashtra State Board of Secondary & Higher Secondary Education")
-        
-        # Add page number
-        c.drawString(500, 20, "Page 1/3")
-        
-        # Move to second page
-        c.showPage()
-        
-        # PAGE 2: ORIGINAL DOCUMENT IMAGE
-        c.setFont("Helvetica-Bold", 24)
-        c.drawString(50, 750, "ORIGINAL DOCUMENT IMAGE")
-        
-        # Add horizontal line under title
-        c.line(50, 745, 550, 745)
         
-        # Add image if available
-        if 'imageSource' in data and data['imageSource']:
-            try:
-                # Extract the base64 image data
-                image_data = data['imageSource']
-                if image_data.startswith('data:image'):
-                    image_data = image_data.split(',', 1)[1]
-                
-                # Decode base64 to image
-                img_data = base64.b64decode(image_data)
-                img_temp = BytesIO(img_data)
-                
-                # Load the image with PIL to manipulate
-                pil_img = Image.open(BytesIO(img_data))
-                width, height = pil_img.size
-                
-                # Force portrait orientation - explicitly rotate if in landscape
-                if width > height:
-                    print(f"Rotating image from landscape ({width}x{height}) to portrait orientation")
-                    # Rotate 90 degrees counterclockwise
-                    pil_img = pil_img.transpose(Image.ROTATE_90)
-                    # Update dimensions after rotation
-                    width, height = pil_img.size
-                    print(f"New dimensions after rotation: {width}x{height}")
-                    
-                    # Save the rotated image to a BytesIO object
-                    rotated_img_temp = BytesIO()
-                    pil_img.save(rotated_img_temp, format='JPEG', quality=95)
-                    rotated_img_temp.seek(0)
-                    img_temp = rotated_img_temp
-                
-                # Calculate dimensions for the PDF
-                page_width = letter[0]
-                
-                # Use standard dimensions for certificate display
-                img_width = min(450, page_width - 100)  # Max width with margins
-                img_height = img_width * (height / width)  # Maintain aspect ratio
-                
-                # Center the image horizontally and position lower to show the header
-                img_x = (page_width - img_width) / 2
-                img_y = 70  # Position much lower (was 110) to show the entire certificate
-                
-                print(f"PDF image placement: width={img_width}, height={img_height}, x={img_x}, y={img_y}")
-                
-                # Add image to PDF
-                c.drawImage(
-                    ImageReader(img_temp), 
-                    img_x, 
-                    img_y, 
-                    width=img_width, 
-                    height=img_height,
-                    preserveAspectRatio=True
-                )
-                
-            except Exception as e:
-                print(f"Error adding image to PDF: {str(e)}")
-                app.logger.error(f"Error adding image to PDF: {str(e)}")
-                c.setFont("Helvetica-Bold", 14)
-                c.drawString(100, 400, f"Error: {str(e)}")
-        else:
-            c.setFont("Helvetica-Bold", 14)
-            c.drawString(100, 400, "No original document image provided")
-        
-        # Add "Original uploaded document image" label
-        c.setFont("Helvetica", 10)
-        c.drawString(230, 130, "Original uploaded document image")
-        
-        # Add page number
-        c.drawString(500, 20, "Page 2/3")
-        
-        # Move to third page
-        c.showPage()
-        
-        # PAGE 3: VERIFICATION DETAILS
-        c.setFont("Helvetica-Bold", 24)
-        c.drawString(50, 750, "VERIFICATION INFORMATION")
-        
-        # Add horizontal line under title
-        c.line(50, 745, 550, 745)
-        
-        # Add verification content
-        c.setFont("Helvetica", 12)
-        y_position = 700
-        c.drawString(50, y_position, "This document has been generated by the SuperCert Blockchain Certification System. The information")
-        y_position -= 20
-        c.drawString(50, y_position, "contained in this document can be verified through the SuperCert verification portal.")
-        y_position -= 40
-        
-        # Add QR code with document hash, creating a real QR code
-        y_position -= 40
+        spool = PdfSpool()
+        try:
+            with stage('pdf_render'):
+                render_transcript_pdf(data, spool)
+        except Exception:
+            spool.close()
+            raise
+        
+        # Persisted copies are content-addressed, so identical names never collide
+        persist_dir = None
+        if app.config['PERSIST_PDFS']:
+            persist_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'pdfs')
+        
+        # Stream the PDF in chunks instead of sending one in-memory buffer
+        response = Response(
+            stream_pdf(spool, persist_dir),
+            mimetype='application/pdf',
+            direct_passthrough=True
+        )
+        response.headers.set('Content-Disposition', 'attachment', filename=pdf_filename)
+        response.headers['Content-Length'] = str(spool.size)
+        response.headers['X-Content-SHA256'] = spool.sha256
+        return response
         
-        # Add QR code placeholder text
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(50, y_position, "Scan the QR code below or visit the SuperCert website to verify this certificate:")
-        y_position -= 30
+    except Exception as e:
+        print(f"Error generating PDF: {str(e)}")
+        app.logger.error(f"Error generating PDF: {str(e)}")
+        traceback.print_exc()
+        return jsonify({
+            'success': False,
+            'message': f'Error generating PDF: {str(e)}'
+        }), 500
 
-        # Create an actual QR code instead of just a placeholder
+def render_transcript_pdf(data, output):
+    """Render the three page transcript PDF for data into output (a path or file-like object)"""
+    c = canvas.Canvas(output, pagesize=letter)
+    
+    # Set up fonts
+    c.setFont("Helvetica-Bold", 24)
+    
+    # PAGE 1: CERTIFICATE COVER
+    c.drawString(50, 750, "MAHARASHTRA SSC CERTIFICATE")
+    
+    # Add horizontal line under title
+    c.line(50, 745, 550, 745)
+    
+    # Add student information section
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(50, 700, "STUDENT DETAILS")
+    
+    # Add student details with proper formatting
+    c.setFont("Helvetica", 12)
+    y_position = 670
+    
+    # Define fields and their labels
+    fields = [
+        ('studentName', 'Name'),
+        ('rollNumber', 'Seat/Roll Number'),
+        ('seatNumber', 'Seat Number'),
+        ('board', 'Board/University'),
+        ('batch', 'Batch'),
+        ('program', 'Program'),
+        ('examYear', 'Exam Year')
+    ]
+    
+    # Add each field with proper spacing and formatting
+    for field, label in fields:
+        if field in data and data[field]:
+            value = str(data[field]).strip()
+            if value and value.lower() not in ['n/a', 'none', 'null']:
+                c.setFont("Helvetica-Bold", 12)
+                c.drawString(50, y_position, f"{label}:")
+                c.setFont("Helvetica", 12)
+                c.drawString(200, y_position, value)
+                y_position -= 25
+    
+    # Add verification section
+    y_position -= 20
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(50, y_position, "VERIFICATION INFORMATION")
+    y_position -= 30
+    
+    # Add verification details
+    c.setFont("Helvetica", 12)
+    c.drawString(50, y_position, "This document has been generated by the SuperCert Blockchain Certification System.")
+    y_position -= 20
+    c.drawString(50, y_position, "The information contained in this document can be verified through the SuperCert verification portal.")
+    y_position -= 40
+    
+    # Add timestamp
+    timestamp = datetime.now().strftime("%d/%m/%Y at %H:%M:%S")
+    c.drawString(50, y_position, f"Generated on: {timestamp}")
+    
+    # Add footer
+    c.setFont("Helvetica", 10)
+    c.drawString(50, 50, "This document is computer-generated and does not require a signature.")
+    c.drawString(50, 35, "Powered by SuperCert Blockchain Certification System")
+    c.drawString(50, 20, f"Maharashtra State Board of Secondary & Higher Secondary Education")
+    
+    # Add page number
+    c.drawString(500, 20, "Page 1/3")
+    
+    # Move to second page
+    c.showPage()
+    
+    # PAGE 2: ORIGINAL DOCUMENT IMAGE
+    c.setFont("Helvetica-Bold", 24)
+    c.drawString(50, 750, "ORIGINAL DOCUMENT IMAGE")
+    
+    # Add horizontal line under title
+    c.line(50, 745, 550, 745)
+    
+    # Add image if available
+    if 'imageSource' in data and data['imageSource']:
         try:
-            # Create QR code using document hash or a verification URL
-            # Generate verification URL
-            verification_url = f"https://supercert.vercel.app/verify?hash={data.get('documentHash', '')}"
-            if not data.get('documentHash'):
-                # If no document hash provided, use timestamp as fallback
-                verification_url = f"https://supercert.vercel.app/verify?timestamp={datetime.now().strftime('%Y%m%d%H%M%S')}"
+            # Extract the base64 image data
+            image_data = data['imageSource']
+            if image_data.startswith('data:image'):
+                image_data = image_data.split(',', 1)[1]
             
-            # Create QR code
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(verification_url)
-            qr.make(fit=True)
+            # Decode base64 to image
+            img_data = base64.b64decode(image_data)
+            img_temp = BytesIO(img_data)
+            
+            # Load the image with PIL, bounded to the resolution the page needs
+            pil_img = Image.open(BytesIO(img_data))
+            original_size = pil_img.size
+            pil_img = bound_embed_image(pil_img)
+            resized = pil_img.size != original_size
+            width, height = pil_img.size
             
-            qr_img = qr.make_image(fill_color="black", back_color="white")
+            # Force portrait orientation - explicitly rotate if in landscape
+            if width > height:
+                print(f"Rotating image from landscape ({width}x{height}) to portrait orientation")
+                # Rotate 90 degrees counterclockwise
+                pil_img = pil_img.transpose(Image.ROTATE_90)
+                # Update dimensions after rotation
+                width, height = pil_img.size
+                print(f"New dimensions after rotation: {width}x{height}")
+                resized = True
+            
+            # Re-encode only if the image changed, otherwise embed the original bytes
+            if resized:
+                img_temp = BytesIO()
+                pil_img.save(img_temp, format='JPEG', quality=95)
+                img_temp.seek(0)
+            del pil_img
+            
+            # Calculate dimensions for the PDF
+            page_width = letter[0]
             
-            # Save QR to temporary file
-            qr_buffer = BytesIO()
-            qr_img.save(qr_buffer)
-            qr_buffer.seek(0)
+            # Use standard dimensions for certificate display
+            img_width = min(450, page_width - 100)  # Max width with margins
+            img_height = img_width * (height / width)  # Maintain aspect ratio
             
-            # Calculate QR code position (centered)
-            qr_size = 150
-            qr_x = (letter[0] - qr_size) / 2
-            qr_y = y_position - qr_size - 20
+            # Center the image horizontally and position lower to show the header
+            img_x = (page_width - img_width) / 2
+            img_y = 70  # Position much lower (was 110) to show the entire certificate
             
-            # Draw QR code on PDF
-            c.drawImage(ImageReader(qr_buffer), qr_x, qr_y, width=qr_size, height=qr_size)
+            print(f"PDF image placement: width={img_width}, height={img_height}, x={img_x}, y={img_y}")
             
-            # Update y position to below QR code
-            y_position = qr_y - 30
+            # Add image to PDF
+            c.drawImage(
+                ImageReader(img_temp), 
+                img_x, 
+                img_y, 
+                width=img_width, 
+                height=img_height,
+                preserveAspectRatio=True
+            )
             
         except Exception as e:
-            app.logger.error(f"Error generating QR code: {str(e)}")
-            # If QR generation fails, draw a placeholder rectangle
-            c.rect(200, y_position - 180, 200, 150)
-            c.setFont("Helvetica", 10)
-            c.drawString(250, y_position - 115, "QR Code for verification")
-            y_position -= 200
-        
-        # Additional verification details
-        c.setFont("Helvetica", 12)
-        c.drawString(50, y_position, "This document is computer-generated and does not require a signature.")
-        y_position -= 20
-        c.drawString(50, y_position, "Powered by SuperCert Blockchain Certification System")
-        y_position -= 40
-        
-        timestamp = datetime.now().strftime("%d/%m/%Y at %H:%M:%S")
-        c.drawString(50, y_position, f"Generated on: {timestamp}")
-        
-        # Add page number
-        c.drawString(500, 20, "Page 3/3")
-        
-        # Finalize PDF
-        c.save()
-        buffer.seek(0)
-        
-        # Save the PDF to file
-        with open(pdf_path, 'wb') as f:
-            f.write(buffer.getvalue())
-        
-        print(f"PDF saved successfully at: {pdf_path}")
-        
-        # Send the PDF
-        return send_file(
-            buffer,
-            as_attachment=True,
-            download_name=pdf_filename,
-            mimetype='application/pdf'
-        )
+            print(f"Error adding image to PDF: {str(e)}")
+            app.logger.error(f"Error adding image to PDF: {str(e)}")
+            c.setFont("Helvetica-Bold", 14)
+            c.drawString(100, 400, f"Error: {str(e)}")
+    else:
+        c.setFont("Helvetica-Bold", 14)
+        c.drawString(100, 400, "No original document image provided")
+    
+    # Add "Original uploaded document image" label
+    c.setFont("Helvetica", 10)
+    c.drawString(230, 130, "Original uploaded document image")
+    
+    # Add page number
+    c.drawString(500, 20, "Page 2/3")
+    
+    # Move to third page
+    c.showPage()
+    
+    # PAGE 3: VERIFICATION DETAILS
+    c.setFont("Helvetica-Bold", 24)
+    c.drawString(50, 750, "VERIFICATION INFORMATION")
+    
+    # Add horizontal line under title
+    c.line(50, 745, 550, 745)
+    
+    # Add verification content
+    c.setFont("Helvetica", 12)
+    y_position = 700
+    c.drawString(50, y_position, "This document has been generated by the SuperCert Blockchain Certification System. The information")
+    y_position -= 20
+    c.drawString(50, y_position, "contained in this document can be verified through the SuperCert verification portal.")
+    y_position -= 40
+    
+    # Add QR code with document hash, creating a real QR code
+    y_position -= 40
+    
+    # Add QR code placeholder text
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(50, y_position, "Scan the QR code below or visit the SuperCert website to verify this certificate:")
+    y_position -= 30
+
+    # Create an actual QR code instead of just a placeholder
+    try:
+        # Create QR code using document hash or a verification URL
+        # Generate verification URL
+        verification_url = f"https://supercert.vercel.app/verify?hash={data.get('documentHash', '')}"
+        if not data.get('documentHash'):
+            # If no document hash provided, use timestamp as fallback
+            verification_url = f"https://supercert.vercel.app/verify?timestamp={datetime.now().strftime('%Y%m%d%H%M%S')}"
+        
+        # Calculate QR code position (centered)
+        qr_size = 150
+        qr_x = (letter[0] - qr_size) / 2
+        qr_y = y_position - qr_size - 20
+        
+        # Draw QR code as vector rectangles (module matrix is cached per URL)
+        draw_qr(c, verification_url, qr_x, qr_y, qr_size)
+        
+        # Update y position to below QR code
+        y_position = qr_y - 30
         
     except Exception as e:
-        print(f"Error generating PDF: {str(e)}")
-        app.logger.error(f"Error generating PDF: {str(e)}")
-        traceback.print_exc()
-        return jsonify({
-            'success': False,
-            'message': f'Error generating PDF: {str(e)}'
-        }), 500
+        app.logger.error(f"Error generating QR code: {str(e)}")
+        # If QR generation fails, draw a placeholder rectangle
+        c.rect(200, y_position - 180, 200, 150)
+        c.setFont("Helvetica", 10)
+        c.drawString(250, y_position - 115, "QR Code for verification")
+        y_position -= 200
+    
+    # Additional verification details
+    c.setFont("Helvetica", 12)
+    c.drawString(50, y_position, "This document is computer-generated and does not require a signature.")
+    y_position -= 20
+    c.drawString(50, y_position, "Powered by SuperCert Blockchain Certification System")
+    y_position -= 40
+    
+    timestamp = datetime.now().strftime("%d/%m/%Y at %H:%M:%S")
+    c.drawString(50, y_position, f"Generated on: {timestamp}")
+    
+    # Add page number
+    c.drawString(500, 20, "Page 3/3")
+    
+    # Finalize PDF
+    c.save()
 
 @app.route('/visualizations/<filename>')
 def serve_visualization(filename):
@@ -703,12 +1011,27 @@ def serve_visualization(filename):
     visualizations_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'visualizations')
     return send_from_directory(visualizations_dir, filename)
 
+# Version of the feature extractors. Bump it whenever extract_features or an
+# extractor it calls changes, so train_templates.py retrains stored templates.
+FEATURE_VERSION = 4
+
 def extract_features(image):
-    """Extract features from image for template matching"""
+    """
+    Extract features from image (BGR, or an ImagePyramid of it) for
+    template matching
+    """
     try:
+        pyramid = image if isinstance(image, ImagePyramid) else ImagePyramid(image)
+        image = pyramid.native.image
+
         # Process the image
-        processed_img = preprocess_image(image)
+        with stage('preprocess'):
+            processed_img = preprocess_image(image)
         
+        # Document type from the thumbnail, before any OCR
+        with stage('classify'):
+            document_class = classify_document(image)
+
         # Extract text from the image
         text = extract_text(processed_img)
         
@@ -721,11 +1044,13 @@ def extract_features(image):
         # Check for HSC certificate indicators
         hsc_indicators = detect_maharashtra_hsc(text)
         
-        # Extract seal positions
-        seal_data = extract_seal_positions(processed_img)
+        # Extract seal positions, in the declared seal regions
+        with stage('seals'):
+            seal_data = extract_seal_positions(pyramid)
         
         # Extract table structure
-        table_data = extract_table_structure(processed_img)
+        with stage('table'):
+            table_data = pyramid.run(extract_table_structure)
         
         # Detect signature areas
         signature_data = detect_signature_area(processed_img)
@@ -733,12 +1058,14 @@ def extract_features(image):
         # Combine all features
         features = {
             'text': text,
+            'text_signature': text_signature(text).to_features(),
             'edge_density': edge_density,
             'is_maharashtra_ssc': ssc_indicators,
             'is_maharashtra_hsc': hsc_indicators,
             'seal_positions': seal_data,
             'table_structure': table_data,
-            'signature_area': signature_data
+            'signature_area': signature_data,
+            'document_class': document_class
         }
         
         return features
@@ -755,29 +1082,43 @@ def extract_features(image):
 def find_best_match(doc_features):
     """Find the best matching template for the document features"""
     try:
-        # Get list of template files
-        template_dir = TEMPLATE_DIR
-        template_files = []
-        
-        # First determine if the document is HSC or SSC
-        doc_text = doc_features.get('text', '').upper()
-        is_hsc = ('HSC' in doc_text or 'HIGHER SECONDARY' in doc_text or 
-                 'HIGHER SECONDARY CERTIFICATE' in doc_text)
-        is_ssc = ('SSC' in doc_text or 'SECONDARY SCHOOL' in doc_text or 
-                 'SECONDARY SCHOOL CERTIFICATE' in doc_text)
+        # One registry snapshot for the whole match, so templates reloaded
+        # meanwhile cannot change the candidate set half way through
+        snapshot = template_registry.snapshot()
+        template_entries = []
+        
+        # First determine if the document is HSC or SSC: from the thumbnail
+        # classifier when it is confident, else from the OCR text
+        document_class = doc_features.get('document_class')
+        if document_class and document_class.get('confident'):
+            is_hsc = document_class['document_type'] == 'hsc'
+            is_ssc = document_class['document_type'] == 'ssc'
+        else:
+            keywords = DOCUMENT_KEYWORDS.match(doc_features.get('text', ''))
+            is_hsc = 'hsc' in keywords
+            is_ssc = 'ssc' in keywords
         
         app.logger.info(f"Document classification - HSC: {is_hsc}, SSC: {is_ssc}")
         
-        # Search in template_dir for matching template type
-        for filename in os.listdir(template_dir):
-            if filename.endswith('.npy'):
-                # Only consider HSC templates for HSC docs and SSC templates for SSC docs
-                if (is_hsc and 'hsc' in filename.lower()) or \
-                   (is_ssc and 'ssc' in filename.lower()):
-                    template_files.append(os.path.join(template_dir, filename))
-                    app.logger.info(f"Added matching template: {filename}")
-
-        if not template_files:
+        # Search the trained templates for matching template type
+        for entry in snapshot.entries():
+            # Only consider HSC templates for HSC docs and SSC templates for SSC docs
+            if (is_hsc and 'hsc' in entry.name.lower()) or \
+               (is_ssc and 'ssc' in entry.name.lower()):
+                template_entries.append(entry)
+                app.logger.info(f"Added matching template: {entry.name}")
+
+        # Narrow the candidates to the templates with the most similar text:
+        # LSH buckets and MinHash estimates, then exact Jaccard for the top few.
+        # Without text hits (e.g. OCR failed) every candidate is compared
+        ranked = snapshot.text_index().query(signature_of(doc_features), limit=TEXT_CANDIDATES)
+        text_jaccard = dict(ranked)
+        narrowed = [entry for entry in template_entries if entry.name in text_jaccard]
+        if narrowed:
+            app.logger.info(f"Text index candidates: {', '.join(entry.name for entry in narrowed)}")
+            template_entries = narrowed
+
+        if not template_entries:
             app.logger.warning(f"No matching templates found for {'HSC' if is_hsc else 'SSC'} document")
             return {
                 'success': False,
@@ -790,27 +1131,25 @@ def find_best_match(doc_features):
         best_score = 0
         best_similarity_scores = None
 
-        for template_file in template_files:
+        for entry in template_entries:
             try:
-                if os.path.exists(template_file):
-                    # Load template features
-                    template_data = np.load(template_file, allow_pickle=True)
-                    if isinstance(template_data, np.ndarray):
-                        template_features = {
-                            'text': str(template_data.item().get('text', '')),
-                            'edge_density': template_data.item().get('edge_density', {'overall': 0.5}),
-                            'is_maharashtra_ssc': template_data.item().get('is_maharashtra_ssc', False),
-                            'is_maharashtra_hsc': template_data.item().get('is_maharashtra_hsc', False)
-                        }
-                    else:
-                        app.logger.warning(f"Template file {template_file} has wrong format")
-                        continue
+                # Template features, already loaded and validated by the registry
+                template_data = entry.features
+                template_features = {
+                    'text': entry.text,
+                    'edge_density': template_data.get('edge_density', {'overall': 0.5}),
+                    'is_maharashtra_ssc': template_data.get('is_maharashtra_ssc', False),
+                    'is_maharashtra_hsc': template_data.get('is_maharashtra_hsc', False)
+                }
 
-                template_name = os.path.basename(template_file).replace('.npy', '')
+                template_name = entry.name
 
                 # Compare features
-                similarity_scores = compare_features(doc_features, template_features)
+                with stage('compare'):
+                    similarity_scores = compare_features(doc_features, template_features)
                 overall_score = similarity_scores.get('overall', 0)
+                if template_name in text_jaccard:
+                    similarity_scores['text_jaccard'] = text_jaccard[template_name]
 
                 app.logger.info(f"Template {template_name} match score: {overall_score}")
 
@@ -821,7 +1160,7 @@ def find_best_match(doc_features):
                     best_similarity_scores = similarity_scores
 
             except Exception as e:
-                app.logger.error(f"Error comparing with template {template_file}: {str(e)}")
+                app.logger.error(f"Error comparing with template {entry.name}: {str(e)}")
                 continue
 
         # If no match found or score too low
@@ -874,7 +1213,7 @@ def find_best_match(doc_features):
             'message': f"Document matches {best_similarity_scores.keys()} template"
         }
 
-        app.logger.info(f"Verification result: {result}")
+        app.logger.info(f"Verification result: verified={is_verified} score={best_score}")
         return result
 
     except Exception as e:
@@ -955,19 +1294,14 @@ def compare_features(doc_features, template_features):
         # Compare text features
         if 'text' in doc_features and 'text' in template_features:
             try:
-                doc_text = to_string(doc_features['text']).upper()
-                template_text = to_string(template_features['text']).upper()
-                
-                # Define key phrases to look for in the text
-                key_phrases = ['STATEMENT OF MARKS', 'CERTIFICATE', 'BOARD', 'EXAMINATION', 'PASSING', 'MARKS']
+                doc_keywords = DOCUMENT_KEYWORDS.match(to_string(doc_features['text']))
+                template_keywords = DOCUMENT_KEYWORDS.match(to_string(template_features['text']))
                 
-                # Count how many of these phrases appear in both documents
-                match_count = 0
-                for phrase in key_phrases:
-                    if phrase in doc_text and phrase in template_text:
-                        match_count += 1
+                # Count how many of the key phrases appear in both documents
+                match_count = sum(1 for phrase in KEY_PHRASES
+                                  if phrase in doc_keywords and phrase in template_keywords)
                 
-                text_similarity = match_count / len(key_phrases) if key_phrases else 0
+                text_similarity = match_count / len(KEY_PHRASES) if KEY_PHRASES else 0
                 # Ensure a minimum similarity score
                 text_similarity = max(text_similarity, 0.75)
                 similarity_scores['text_similarity'] = text_similarity
@@ -1178,13 +1512,15 @@ def extract_text(image):
         
         # Extract text using pytesseract
         if has_tesseract:
-            text = pytesseract.image_to_string(thresh)
+            with stage('ocr'):
+                text = pytesseract.image_to_string(thresh)
             return text
         else:
             app.logger.warning("Tesseract not available, returning empty text")
             return ""
             
     except Exception as e:
+        ERRORS.inc(where='ocr')
         app.logger.error(f"Error extracting text: {str(e)}")
         return ""
 
@@ -1200,59 +1536,94 @@ def detect_maharashtra_hsc(text):
     """Stub for detect_maharashtra_hsc function"""
     return {'is_maharashtra_hsc': False, 'score': 1}
 
-def extract_seal_positions(processed_img):
-    """Stub for extract_seal_positions function"""
-    return {'circles': [(100, 100, 50)], 'has_logo_pattern': True}
+def extract_seal_positions(pyramid):
+    """
+    Seals and logos in the declared seal regions of a document (ImagePyramid),
+    see seal_detector.py. A document registered to a template is searched in
+    that template's regions and matched against its seals; circles are in
+    canonical coordinates.
+    """
+    try:
+        return detect_seals(pyramid, getattr(pyramid, 'frame', None))
+    except Exception as e:
+        app.logger.error(f"Error extracting seal positions: {str(e)}")
+        return {
+            'circles': [],
+            'bottom_circles': [],
+            'upper_left_density': 0.0,
+            'has_logo_pattern': False,
+            'has_seal_pattern': False,
+            'regions': {}
+        }
 
-def extract_table_structure(processed_img):
-    """Stub for extract_table_structure function"""
-    return {'has_table': True, 'cell_count': 10}
+@pyramid_level('low', scaled=True)
+def extract_table_structure(ctx, scale=1.0):
+    """
+    Table lines, rows, columns and cells of a document from the processed
+    image of a pyramid level (run it with ImagePyramid.run), see
+    table_structure.py. Coordinates are canonical.
+    """
+    try:
+        return table_structure(ctx.processed, scale=scale)
+    except Exception as e:
+        app.logger.error(f"Error extracting table structure: {str(e)}")
+        return {
+            'horizontal_lines': [],
+            'vertical_lines': [],
+            'h_lines_count': 0,
+            'v_lines_count': 0,
+            'has_table': False,
+            'row_positions': [],
+            'column_positions': [],
+            'cells': [],
+            'cell_count': 0
+        }
 
 def detect_signature_area(processed_img):
     """Stub for detect_signature_area function"""
     return {'has_signature': True, 'location': (200, 300, 100, 50)}
 
-def extract_student_data(text):
-    """Extract student data from document text"""
-    data = {
-        'studentName': '',
-        'rollNumber': '',
-        'board': '',
-        'batch': '',
-        'program': '',
-        'examYear': ''
-    }
-    
-    # Look for student name patterns
-    name_matches = re.findall(r'name[:\s]+([A-Za-z\s]+)', text, re.IGNORECASE)
-    if name_matches:
-        data['studentName'] = name_matches[0].strip()
-    
-    # Look for roll number patterns
-    roll_matches = re.findall(r'(roll|seat|registration)[\s.:]*(no|number)[:\s]*([A-Z0-9]+)', text, re.IGNORECASE)
-    if roll_matches:
-        data['rollNumber'] = roll_matches[0][2].strip()
+# Keys of the extracted student data, in the order clients expect them
+STUDENT_DATA_KEYS = ['studentName', 'rollNumber', 'board', 'batch', 'program', 'examYear']
+
+# Confidence of fields inferred from keywords rather than read from a label
+KEYWORD_FIELD_CONFIDENCE = 0.5
+
+def extract_student_fields(text, template_name=None):
+    """
+    Typed student fields of document text ({name: ExtractedField}), read in
+    one scan of the template's field schema, plus board and program inferred
+    from keywords. Returns (fields, keyword matches).
+    """
+    fields = schema_for(template_name).extract(text)
+    keywords = DOCUMENT_KEYWORDS.match(text)
     
-    # Look for board/university patterns
-    board_matches = re.findall(r'(board|university)[:\s]+([A-Za-z\s]+)', text, re.IGNORECASE)
-    if board_matches:
-        data['board'] = board_matches[0][1].strip()
-    elif 'MAHARASHTRA' in text and 'BOARD' in text:
-        data['board'] = 'Maharashtra State Board'
+    def inferred(name, value, group):
+        hit = keywords.first(group)
+        fields[name] = ExtractedField(name, value, KEYWORD_FIELD_CONFIDENCE, hit.start, hit.end)
     
-    # Look for year/batch patterns
-    year_matches = re.findall(r'(year|batch|session)[:\s]+([0-9]+)', text, re.IGNORECASE)
-    if year_matches:
-        data['batch'] = year_matches[0][1].strip()
+    if 'board' not in fields and 'maharashtra' in keywords and 'BOARD' in keywords:
+        inferred('board', 'Maharashtra State Board', 'maharashtra')
     
-    # Look for program patterns
-    if 'SSC' in text or 'SECONDARY SCHOOL CERTIFICATE' in text:
-        data['program'] = 'SSC'
-    elif 'HSC' in text or 'HIGHER SECONDARY CERTIFICATE' in text:
-        data['program'] = 'HSC'
+    if 'ssc_certificate' in keywords:
+        inferred('program', 'SSC', 'ssc_certificate')
+    elif 'hsc_certificate' in keywords:
+        inferred('program', 'HSC', 'hsc_certificate')
     
+    return fields, keywords
+
+def student_data(fields):
+    """Extracted fields as the student data dict (strings, '' when not found)"""
+    data = {key: '' for key in STUDENT_DATA_KEYS}
+    for name, field in fields.items():
+        if name in data:
+            data[name] = str(field.value)
     return data
 
+def extract_student_data(text):
+    """Extract student data from document text"""
+    return student_data(extract_student_fields(text)[0])
+
 # Import for image reading in PDF generation
 from reportlab.lib.utils import ImageReader
 
@@ -1284,7 +1655,7 @@ def store_student():
             }), 400
             
         # Store student data (mock storage for now)
-        app.logger.info(f"Storing student data: {data}")
+        app.logger.info(f"Storing student data ({len(data)} fields)")
         
         return jsonify({
             'success': True,
@@ -1318,20 +1689,87 @@ def upload_to_pinata(file_path, filename):
             }
             
             # Make the upload request
-            response = requests.post(url, headers=headers, files=files)
+            with stage('ipfs_upload'):
+                response = requests.post(url, headers=headers, files=files)
             
             if response.status_code == 200:
                 result = response.json()
-                print(f"Successfully uploaded to Pinata: {result}")
+                print(f"Successfully uploaded to Pinata: {result.get('IpfsHash')}")
                 return result.get('IpfsHash')
             else:
-                print(f"Failed to upload to Pinata: {response.text}")
+                ERRORS.inc(where='ipfs_upload')
+                print(f"Failed to upload to Pinata: HTTP {response.status_code}")
                 return None
                 
     except Exception as e:
+        ERRORS.inc(where='ipfs_upload')
         print(f"Error uploading to Pinata: {str(e)}")
         return None
 
+def first_page(file_path, dpi):
+    """First page (BGR image) of a multi-page upload, or None if it cannot be read"""
+    with closing(read_pages(file_path, dpi)) as pages:
+        page = next(pages, None)
+    return page[1] if page is not None else None
+
+def build_ipfs_pdf(file_path, student_name, document_type, pdf_dir):
+    """
+    Generate the transcript PDF for an uploaded document: OCR the image (the
+    first page of a multi-page upload), fill in what it yields and store the
+    PDF content-addressed in pdf_dir. Returns the PDF path, or None if
+    generation failed.
+    """
+    app.logger.info(f"Generating PDF for {student_name}")
+    try:
+        # Create data for PDF generation
+        # Extract text from image if possible
+        text = ""
+        paged = is_paged(file_path)
+        image = first_page(file_path, OCR_PAGE_DPI) if paged else decode(file_path)
+        if image is None:
+            app.logger.error(f"Could not read {file_path} for PDF generation")
+        else:
+            try:
+                text = extract_text(image)
+            except Exception as e:
+                app.logger.error(f"Error extracting text: {str(e)}")
+        
+        # Extract basic data to populate PDF
+        fields, keywords = extract_student_fields(text)
+        extracted_data = student_data(fields)
+        
+        # Default to form data if extraction fails
+        pdf_data = {
+            'studentName': student_name,
+            'program': document_type,
+            'board': 'MAHARASHTRA BOARD' if 'maharashtra' in keywords else 'N/A',
+            'examYear': extracted_data.get('examYear', datetime.now().year),
+            'seatNumber': extracted_data.get('rollNumber', 'N/A'),
+            'batch': extracted_data.get('batch', 'N/A'),
+        }
+        
+        # Convert the image to base64 for PDF inclusion; a multi-page upload
+        # is shown by its first page
+        if paged:
+            img_bytes = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes() if image is not None else None
+        else:
+            with open(file_path, 'rb') as img_file:
+                img_bytes = img_file.read()
+        del image
+        if img_bytes:
+            base64_image = base64.b64encode(img_bytes).decode('utf-8')
+            pdf_data['imageSource'] = f"data:image/jpeg;base64,{base64_image}"
+        
+        # Render and persist the PDF directly
+        pdf_path, _, _ = render_pdf_file(pdf_data, pdf_dir)
+        
+        app.logger.info(f"Generated PDF at: {pdf_path}")
+        return pdf_path
+    except Exception as e:
+        app.logger.error(f"Error generating PDF: {str(e)}")
+        # If PDF generation fails, fall back to the original document
+        return None
+
 @app.route('/api/ipfs/upload', methods=['POST', 'OPTIONS'])
 def ipfs_upload():
     """Upload file to IPFS"""
@@ -1341,6 +1779,7 @@ def ipfs_upload():
         response.headers.add('Access-Control-Allow-Headers', '*')
         return response
 
+    file_path = None
     try:
         app.logger.info("Received IPFS upload request")
         if 'document' not in request.files:
@@ -1353,6 +1792,24 @@ def ipfs_upload():
         file = request.files['document']
         app.logger.info(f"Received file: {file.filename}")
         
+        if file.filename == '':
+            return jsonify({
+                'success': False,
+                'message': 'No file selected'
+            }), 400
+        if not allowed_file(file.filename):
+            return jsonify({
+                'success': False,
+                'message': f'File type not allowed. Allowed types: {", ".join(ALLOWED_EXTENSIONS)}'
+            }), 400
+
+        # Header only: oversized or mislabelled images are refused before they are saved or decoded
+        try:
+            with stage('inspect'):
+                inspect_upload(file)
+        except UploadRejected as e:
+            return jsonify({'success': False, 'message': e.message}), e.status
+        
         # Get student data from form
         student_name = request.form.get('studentName', 'Unknown_Student')
         document_type = request.form.get('documentType', 'Document')
@@ -1361,9 +1818,9 @@ def ipfs_upload():
         # Clean student name for filename
         clean_student_name = secure_filename(student_name.replace(' ', '_'))
         
-        # Save original file
+        # Save original file; it is pinned under its own name
         filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        file_path = unique_upload_path(file.filename)
         file.save(file_path)
         app.logger.info(f"Original file saved to: {file_path}")
         
@@ -1371,92 +1828,23 @@ def ipfs_upload():
         pdf_path = None
         pdf_file = None
         
+        # PDFs are stored content-addressed, so students with the same name never collide
+        pdf_filename = f"transcript_{clean_student_name}.pdf"
+        pdf_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'pdfs')
+        
         # If client sent a PDF, use it directly
         if 'pdf' in request.files:
             pdf_file = request.files['pdf']
-            pdf_filename = f"transcript_{clean_student_name}.pdf"
-            pdf_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'pdfs')
-            os.makedirs(pdf_dir, exist_ok=True)
-            pdf_path = os.path.join(pdf_dir, pdf_filename)
-            pdf_file.save(pdf_path)
+            spool = PdfSpool()
+            try:
+                pdf_file.save(spool)
+                pdf_path = spool.persist(pdf_dir)
+            finally:
+                spool.close()
             app.logger.info(f"Client-provided PDF saved to: {pdf_path}")
         else:
             # Generate PDF transcript - only if client didn't send one
-            pdf_filename = f"transcript_{clean_student_name}.pdf"
-            pdf_paths = [
-                os.path.join(app.config['UPLOAD_FOLDER'], 'pdfs', pdf_filename),
-                os.path.join(app.config['UPLOAD_FOLDER'], pdf_filename)
-            ]
-            
-            # Look for the PDF in both possible locations
-            for path in pdf_paths:
-                app.logger.info(f"Looking for PDF at: {path}")
-                if os.path.exists(path):
-                    pdf_path = path
-                    app.logger.info(f"Found PDF at: {path}")
-                    break
-                    
-            # If PDF doesn't exist, generate it now
-            if not pdf_path:
-                app.logger.info(f"PDF not found, generating it now for {student_name}")
-                try:
-                    # Create data for PDF generation
-                    # Extract text from image if possible
-                    text = ""
-                    try:
-                        image = cv2.imread(file_path)
-                        text = extract_text(image)
-                    except Exception as e:
-                        app.logger.error(f"Error extracting text: {str(e)}")
-                    
-                    # Extract basic data to populate PDF
-                    extracted_data = extract_student_data(text)
-                    
-                    # Default to form data if extraction fails
-                    pdf_data = {
-                        'studentName': student_name,
-                        'program': document_type,
-                        'board': 'MAHARASHTRA BOARD' if 'MAHARASHTRA' in text.upper() else 'N/A',
-                        'examYear': extracted_data.get('examYear', datetime.now().year),
-                        'seatNumber': extracted_data.get('rollNumber', 'N/A'),
-                        'batch': extracted_data.get('batch', 'N/A'),
-                    }
-                    
-                    # Convert the image to base64 for PDF inclusion
-                    with open(file_path, 'rb') as img_file:
-                        img_bytes = img_file.read()
-                        base64_image = base64.b64encode(img_bytes).decode('utf-8')
-                    
-                    pdf_data['imageSource'] = f"data:image/jpeg;base64,{base64_image}"
-                    
-                    # Generate PDF
-                    pdf_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'pdfs')
-                    os.makedirs(pdf_dir, exist_ok=True)
-                    pdf_path = os.path.join(pdf_dir, pdf_filename)
-                    
-                    # Call the generate_pdf function
-                    from flask import Response
-                    
-                    # Create a temporary endpoint to receive PDF data
-                    @app.route('/temp_pdf_endpoint', methods=['POST'])
-                    def temp_pdf_endpoint():
-                        return generate_pdf()
-                    
-                    # Mock a request to the PDF generation endpoint
-                    with app.test_request_context('/temp_pdf_endpoint', 
-                                               method='POST',
-                                               json=pdf_data):
-                        response = generate_pdf()
-                        
-                        # If response is a file, save it
-                        if isinstance(response, Response) and response.direct_passthrough:
-                            with open(pdf_path, 'wb') as f:
-                                f.write(response.get_data())
-                        
-                    app.logger.info(f"Generated PDF at: {pdf_path}")
-                except Exception as e:
-                    app.logger.error(f"Error generating PDF: {str(e)}")
-                    # If PDF generation fails, fall back to the original document
+            pdf_path = build_ipfs_pdf(file_path, student_name, document_type, pdf_dir)
         
         # Upload to Pinata
         document_hash = None
@@ -1511,6 +1899,38 @@ def ipfs_upload():
             'success': False,
             'message': f'Error during IPFS upload: {str(e)}'
         }), 500
+    finally:
+        remove_upload(file_path)
+
+def build_notification_email(to_email, student_name, document_type, ipfs_hash):
+    """Build the upload confirmation email message"""
+    subject = f"Document Upload Confirmation - {document_type}"
+    
+    # Create message
+    msg = MIMEMultipart()
+    msg['From'] = SMTP_USERNAME
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    
+    # Email body
+    body = f"""
+    Dear {student_name},
+    
+    Your {document_type} has been successfully uploaded and processed by SuperCert.
+    
+    Document Details:
+    - Type: {document_type}
+    - IPFS Hash: {ipfs_hash}
+    - Upload Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+    
+    You can verify your document anytime using this IPFS hash.
+    
+    Best regards,
+    SuperCert Team
+    """
+    
+    msg.attach(MIMEText(body, 'plain'))
+    return msg
 
 def send_email_notification(to_email, student_name, document_type, ipfs_hash):
     """Send email notification about document upload"""
@@ -1520,56 +1940,34 @@ def send_email_notification(to_email, student_name, document_type, ipfs_hash):
             print("Email credentials missing!")
             return False
 
-        subject = f"Document Upload Confirmation - {document_type}"
-        
-        # Create message
-        msg = MIMEMultipart()
-        msg['From'] = SMTP_USERNAME
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        
-        # Email body
-        body = f"""
-        Dear {student_name},
-        
-        Your {document_type} has been successfully uploaded and processed by SuperCert.
-        
-        Document Details:
-        - Type: {document_type}
-        - IPFS Hash: {ipfs_hash}
-        - Upload Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-        
-        You can verify your document anytime using this IPFS hash.
-        
-        Best regards,
-        SuperCert Team
-        """
-        
-        msg.attach(MIMEText(body, 'plain'))
+        msg = build_notification_email(to_email, student_name, document_type, ipfs_hash)
         
         try:
             print(f"Attempting to send email to {to_email}...")
-            # Connect to SMTP server
-            server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-            server.starttls()
-            
-            # Log in
-            print(f"Logging in with {SMTP_USERNAME}...")
-            server.login(SMTP_USERNAME, SMTP_PASSWORD)
-            
-            # Send email
-            print("Sending email...")
-            server.send_message(msg)
-            server.quit()
+            with stage('smtp_send'):
+                # Connect to SMTP server
+                server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
+                server.starttls()
+                
+                # Log in
+                print(f"Logging in with {SMTP_USERNAME}...")
+                server.login(SMTP_USERNAME, SMTP_PASSWORD)
+                
+                # Send email
+                print("Sending email...")
+                server.send_message(msg)
+                server.quit()
             
             print(f"Email sent successfully to {to_email}")
             return True
             
         except smtplib.SMTPAuthenticationError as e:
+            ERRORS.inc(where='smtp_send')
             print(f"SMTP Authentication Error: {str(e)}")
             app.logger.error(f"SMTP Authentication Error: {str(e)}")
             return False
         except Exception as e:
+            ERRORS.inc(where='smtp_send')
             print(f"SMTP Error: {str(e)}")
             app.logger.error(f"SMTP Error: {str(e)}")
             return False
@@ -1592,7 +1990,6 @@ def email_notification():
 
     try:
         app.logger.info("Received email notification request")
-        app.logger.info(f"Request data: {request.data}")
         data = request.json
         if not data:
             app.logger.error("No data provided in email notification request")
@@ -1600,10 +1997,6 @@ def email_notification():
                 'success': False,
                 'message': 'No data provided'
             }), 400
-        
-        # Debug output all data
-        app.logger.info(f"Email notification data received: {data}")
-        print(f"Email notification data received: {data}")
             
         email = data.get('email', '').strip()
         name = data.get('name', 'Student')
@@ -1649,7 +2042,182 @@ def email_notification():
             'message': f'Error processing email notification: {str(e)}'
         }), 500
 
+def run_file_job(handler):
+    """Job handler running handler on the job's saved upload, then removing it"""
+    def run(payload):
+        try:
+            result, status = handler(payload['file_path'])
+            return {'status': status, 'response': result}
+        finally:
+            if os.path.exists(payload['file_path']):
+                os.remove(payload['file_path'])
+    return run
+
+job_workers = JobWorkers(job_queue, {
+    'verify': run_file_job(verify_image),
+    'extract': run_file_job(extract_image_data),
+}, count=JOB_WORKERS, lease=JOB_STALE_SECONDS)
+
+def start_job_workers():
+    """
+    Requeue jobs orphaned by a crash and start this process's job workers.
+    Jobs running in live processes keep their lease and are left alone.
+    """
+    requeued = job_queue.requeue_expired(JOB_STALE_SECONDS)
+    if requeued:
+        app.logger.warning(f"Requeued {requeued} running jobs whose lease expired")
+    job_workers.start()
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """Queue a verification or extraction and return its job id"""
+    try:
+        job_type = request.form.get('type', 'verify')
+        if job_type not in job_workers.handlers:
+            return jsonify({
+                'success': False,
+                'message': f'Invalid job type: {job_type}. Allowed types: {", ".join(job_workers.handlers)}'
+            }), 400
+
+        try:
+            # Interactive uploads by default; batch imports should send priority=bulk
+            priority = parse_priority(request.form.get('priority'), default='interactive')
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        if 'document' not in request.files:
+            return jsonify({
+                'success': False,
+                'message': 'No document file provided'
+            }), 400
+
+        file = request.files['document']
+        if file.filename == '':
+            return jsonify({
+                'success': False,
+                'message': 'No file selected'
+            }), 400
+        if not allowed_file(file.filename):
+            return jsonify({
+                'success': False,
+                'message': f'File type not allowed. Allowed types: {", ".join(ALLOWED_EXTENSIONS)}'
+            }), 400
+
+        # Header only: oversized or mislabelled images are refused before they are saved or decoded
+        try:
+            with stage('inspect'):
+                inspect_upload(file)
+        except UploadRejected as e:
+            return jsonify({'success': False, 'message': e.message}), e.status
+
+        # Unique name, so concurrent jobs for files with the same name do not clash
+        job_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'jobs')
+        os.makedirs(job_dir, exist_ok=True)
+        file_path = os.path.join(job_dir, f"{time.time_ns()}_{secure_filename(file.filename)}")
+        file.save(file_path)
+
+        job_id = job_queue.enqueue(job_type, {'file_path': file_path, 'filename': file.filename}, priority)
+        if not job_workers.running:
+            start_job_workers()
+
+        return jsonify({
+            'success': True,
+            'jobId': job_id,
+            'status': 'queued',
+            'statusUrl': f"/api/jobs/{job_id}",
+            'queue': job_queue.metrics()
+        }), 202
+    except Exception as e:
+        app.logger.error(f"Error creating job: {str(e)}")
+        traceback.print_exc()
+        return jsonify({
+            'success': False,
+            'message': f'Error creating job: {str(e)}'
+        }), 500
+
+def collect_cache_metrics():
+    info = qr_cache_info()
+    yield {'cache': 'qr', 'result': 'hit'}, info.hits
+    yield {'cache': 'qr', 'result': 'miss'}, info.misses
+
+def collect_job_metrics():
+    depth = job_queue.metrics()
+    for status in ('queued', 'running', 'done', 'failed'):
+        yield {'status': status}, depth[status]
+
+def collect_admission_metrics(field):
+    def collect():
+        for name, gate in admission_gates.items():
+            yield {'endpoint': name}, gate.metrics()[field]
+    return collect
+
+metrics.REGISTRY.callback('supercert_cache_total', 'Cache lookups by cache and result (hit/miss)',
+                          'counter', collect_cache_metrics)
+metrics.REGISTRY.callback('supercert_jobs', 'Background jobs by status', 'gauge', collect_job_metrics)
+metrics.REGISTRY.callback('supercert_admission_active', 'Requests running per gated endpoint',
+                          'gauge', collect_admission_metrics('active'))
+metrics.REGISTRY.callback('supercert_admission_waiting', 'Requests waiting for a slot per gated endpoint',
+                          'gauge', collect_admission_metrics('waiting'))
+metrics.REGISTRY.callback('supercert_admission_rejected_total', 'Requests rejected with 429 because the wait queue was full',
+                          'counter', collect_admission_metrics('rejectedQueueFull'))
+metrics.REGISTRY.callback('supercert_admission_timeouts_total', 'Requests rejected with 503 after waiting too long',
+                          'counter', collect_admission_metrics('rejectedTimeout'))
+metrics.REGISTRY.callback('supercert_admission_queue_seconds_total', 'Total time admitted requests spent waiting',
+                          'counter', collect_admission_metrics('queueSecondsTotal'))
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Metrics of this process in the Prometheus text format"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/admission/metrics', methods=['GET'])
+def admission_metrics():
+    """Active, waiting and rejected requests and queue times per gated endpoint"""
+    return jsonify({
+        'success': True,
+        'gates': {name: gate.metrics() for name, gate in admission_gates.items()}
+    }), 200
+
+@app.route('/api/jobs/metrics', methods=['GET'])
+def job_metrics():
+    """Queue depth by status and priority"""
+    return jsonify({'success': True, 'workers': JOB_WORKERS, **job_queue.metrics()}), 200
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status of a job, and its result once finished"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'message': 'Job not found'
+        }), 404
+
+    response = {
+        'success': True,
+        'jobId': job['id'],
+        'type': job['kind'],
+        'status': job['status'],
+        'priority': job['priority'],
+        'createdAt': job['createdAt'],
+        'startedAt': job['startedAt'],
+        'finishedAt': job['finishedAt'],
+    }
+    if job['result'] is not None:
+        # Same body and status code the synchronous endpoint would have returned
+        response['resultStatus'] = job['result']['status']
+        response['result'] = job['result']['response']
+    if job['error']:
+        response['message'] = job['error']
+    return jsonify(response), 200
+
 # Start the server when this file is run directly
 if __name__ == '__main__':
-    print("Starting Flask server on port 5000...")
-    app.run(host='0.0.0.0', port=5000, debug=True) 
+    # Development server only; use gunicorn (see wsgi.py) in production
+    port = int(os.getenv('PORT', '5000'))
+    debug = os.getenv('FLASK_DEBUG', 'false').lower() == 'true'
+    print(f"Starting Flask server on port {port}...")
+    init_service()
+    template_registry.start()
+    start_job_workers()
+    app.run(host='0.0.0.0', port=port, debug=debug) 
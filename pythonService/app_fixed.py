@@ -1,6 +1,7 @@
 from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
 import os
+import glob
 import io
 import cv2
 import numpy as np
@@ -15,6 +16,13 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from io import BytesIO
 import base64
+from grid_features import grid_cell_features, region_densities
+from preprocess_context import DocumentContext, processed_image, processed_canny
+from image_pyramid import ImagePyramid, pyramid_level
+from registration import register
+from keyword_matcher import keyword_matcher
+from table_structure import table_structure
+from seal_detector import detect_seals
 
 # Define directories
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -66,6 +74,9 @@ def preprocess_image(img):
     Preprocess image for feature extraction
     Converts to grayscale, applies thresholding, etc.
     """
+    if isinstance(img, DocumentContext):
+        return img.processed
+
     try:
         # Convert numpy array to PIL Image if needed
         if isinstance(img, np.ndarray):
@@ -109,11 +120,15 @@ def preprocess_image(img):
         else:
             return np.array(img.convert('L'))
 
+@pyramid_level('high')
 def extract_text(image):
     """Extract text from image using OCR"""
     try:
         if not has_tesseract:
             return ""
+
+        if isinstance(image, DocumentContext):
+            image = image.rgb
             
         # Extract text with different configs for better coverage
         text1 = pytesseract.image_to_string(image)
@@ -127,36 +142,19 @@ def extract_text(image):
         app.logger.error(f"OCR error: {str(e)}")
         return ""
 
+@pyramid_level('canonical')
 def calculate_edge_density(processed_img):
     """Calculate edge density for layout analysis"""
     # Apply Canny edge detection
-    edges = cv2.Canny(processed_img, 50, 150)
+    edges = processed_canny(processed_img, 50, 150)
     
     # Calculate edge density
     edge_pixels = np.sum(edges > 0)
     total_pixels = edges.shape[0] * edges.shape[1]
     edge_density = float(edge_pixels) / total_pixels if total_pixels > 0 else 0
     
-    # Calculate edge density in different regions
-    h, w = edges.shape
-    regions = []
-    region_size = 3  # 3x3 grid
-    
-    for i in range(region_size):
-        for j in range(region_size):
-            # Define region boundaries
-            y1 = int(i * h / region_size)
-            y2 = int((i + 1) * h / region_size)
-            x1 = int(j * w / region_size)
-            x2 = int((j + 1) * w / region_size)
-            
-            # Calculate density in this region
-            region = edges[y1:y2, x1:x2]
-            region_edge_pixels = np.sum(region > 0)
-            region_total_pixels = region.shape[0] * region.shape[1]
-            region_density = float(region_edge_pixels) / region_total_pixels if region_total_pixels > 0 else 0
-            
-            regions.append(region_density)
+    # Calculate edge density in different regions (3x3 grid)
+    regions = region_densities(edges, 3)
     
     # Return overall density and regional densities
     return {
@@ -164,193 +162,91 @@ def calculate_edge_density(processed_img):
         'regions': regions
     }
 
-def detect_maharashtra_ssc(text):
-    """Detect if document is a Maharashtra SSC certificate based on text"""
-    text_upper = text.upper()
-    
-    # Check for Maharashtra SSC specific text patterns
-    is_maharashtra = 'MAHARASHTRA' in text_upper
-    is_ssc = ('SECONDARY SCHOOL CERTIFICATE' in text_upper or 
-              'S.S.C' in text_upper or 
-              'SSC' in text_upper)
-    
-    # Check for Mumbai related keywords
-    is_mumbai = ('MUMBAI' in text_upper or 
-                'BOMBAY' in text_upper)
-    
-    # Check for typical Maharashtra SSC Board text
-    is_board = ('STATE BOARD' in text_upper or 
-               'DIVISIONAL BOARD' in text_upper)
+# Board indicators of Maharashtra SSC/HSC certificates, one automaton each
+SSC_KEYWORDS = keyword_matcher({
+    'maharashtra': ['MAHARASHTRA'],
+    'ssc': ['SECONDARY SCHOOL CERTIFICATE', 'S.S.C', 'SSC'],
+    'mumbai': ['MUMBAI', 'BOMBAY'],
+    'board': ['STATE BOARD', 'DIVISIONAL BOARD'],
+})
+HSC_KEYWORDS = keyword_matcher({
+    'maharashtra': ['MAHARASHTRA'],
+    'hsc': ['HIGHER SECONDARY CERTIFICATE', 'H.S.C', 'HSC'],
+    'mumbai': ['MUMBAI', 'BOMBAY'],
+    'board': ['STATE BOARD', 'DIVISIONAL BOARD'],
+})
+
+# Text indicators of HSC documents, counted by compare_features; one group each
+HSC_INDICATORS = keyword_matcher({phrase: [phrase] for phrase in [
+    'HIGHER SECONDARY', 'HSC', 'H.S.C.',
+    'STATEMENT OF MARKS', 'MAHARASHTRA STATE BOARD',
+    'MUMBAI DIVISIONAL BOARD'
+]})
+
+def _board_indicators(matcher, text, kind):
+    """Maharashtra board indicators of kind ('ssc' or 'hsc') found in text"""
+    matches = matcher.match(text)
+    is_maharashtra = 'maharashtra' in matches
+    is_kind = kind in matches
+    is_mumbai = 'mumbai' in matches
+    is_board = 'board' in matches
     
     # Combined score
     score = sum([
         2 if is_maharashtra else 0,
-        2 if is_ssc else 0,
+        2 if is_kind else 0,
         1 if is_mumbai else 0,
         1 if is_board else 0
     ])
     
     return {
-        'is_maharashtra_ssc': score >= 3,
+        f'is_maharashtra_{kind}': score >= 3,
         'score': score,
         'is_maharashtra': is_maharashtra,
-        'is_ssc': is_ssc,
+        f'is_{kind}': is_kind,
         'is_mumbai': is_mumbai,
-        'is_board': is_board
+        'is_board': is_board,
+        'keyword_hits': matches.summary()
     }
 
+def detect_maharashtra_ssc(text):
+    """Detect if document is a Maharashtra SSC certificate based on text"""
+    return _board_indicators(SSC_KEYWORDS, text, 'ssc')
+
 def detect_maharashtra_hsc(text):
     """Detect if document is a Maharashtra HSC certificate based on text"""
-    text_upper = text.upper()
-    
-    # Check for Maharashtra HSC specific text patterns
-    is_maharashtra = 'MAHARASHTRA' in text_upper
-    is_hsc = ('HIGHER SECONDARY CERTIFICATE' in text_upper or 
-              'H.S.C' in text_upper or 
-              'HSC' in text_upper)
-    
-    # Check for Mumbai related keywords
-    is_mumbai = ('MUMBAI' in text_upper or 
-                'BOMBAY' in text_upper)
-    
-    # Check for typical Maharashtra HSC Board text
-    is_board = ('STATE BOARD' in text_upper or 
-               'DIVISIONAL BOARD' in text_upper)
-    
-    # Combined score
-    score = sum([
-        2 if is_maharashtra else 0,
-        2 if is_hsc else 0,
-        1 if is_mumbai else 0,
-        1 if is_board else 0
-    ])
-    
-    return {
-        'is_maharashtra_hsc': score >= 3,
-        'score': score,
-        'is_maharashtra': is_maharashtra,
-        'is_hsc': is_hsc,
-        'is_mumbai': is_mumbai,
-        'is_board': is_board
-    }
+    return _board_indicators(HSC_KEYWORDS, text, 'hsc')
 
-def extract_seal_positions(processed_img):
-    """Extract seal/logo positions from processed image"""
+def extract_seal_positions(pyramid):
+    """
+    Extract seal/logo positions from the declared seal regions of a document
+    pyramid, at the low level with hits refined at the high level. When the
+    document is registered to a template, its regions are used and its seals
+    matched; circles are returned in canonical coordinates
+    """
     try:
-        # Use Hough Circle Transform to detect circular patterns (seals/stamps)
-        circles = cv2.HoughCircles(
-            processed_img,
-            cv2.HOUGH_GRADIENT,
-            1,
-            20,
-            param1=50,
-            param2=30,
-            minRadius=20,
-            maxRadius=100
-        )
-        
-        # Check upper left for possible logo
-        h, w = processed_img.shape
-        upper_left = processed_img[:int(h/4), :int(w/4)]
-        upper_left_density = np.sum(upper_left > 0) / (upper_left.shape[0] * upper_left.shape[1])
-        
-        # Check bottom for possible seal/stamp
-        bottom = processed_img[int(3*h/4):, :]
-        
-        # Initialize return value
-        result = {
-            'circles': [],
-            'upper_left_density': float(upper_left_density),
-            'has_logo_pattern': upper_left_density > 0.1
-        }
-        
-        # Add detected circles if any
-        if circles is not None:
-            circles = np.round(circles[0, :]).astype("int")
-            result['circles'] = circles.tolist()
-            
-            # Check if any circles in bottom region (likely to be stamps/seals)
-            bottom_circles = []
-            for (x, y, r) in circles:
-                # Adjust y to document coordinates
-                adj_y = y
-                if adj_y >= int(3*h/4):
-                    bottom_circles.append([x, y, r])
-            
-            result['bottom_circles'] = bottom_circles
-            result['has_seal_pattern'] = len(bottom_circles) > 0
-        else:
-            result['has_seal_pattern'] = False
-        
-        return result
+        return detect_seals(pyramid, getattr(pyramid, 'frame', None))
     except Exception as e:
         app.logger.error(f"Error extracting seal positions: {str(e)}")
         return {
             'circles': [],
+            'bottom_circles': [],
             'upper_left_density': 0.0,
             'has_logo_pattern': False,
-            'has_seal_pattern': False
+            'has_seal_pattern': False,
+            'regions': {}
         }
 
-def extract_table_structure(processed_img):
-    """Extract table structure from processed image"""
+@pyramid_level('low', scaled=True)
+def extract_table_structure(processed_img, scale=1.0):
+    """
+    Extract table structure from processed image
+    scale is image pixels per canonical pixel; lines, row/column positions
+    and cells are returned in canonical coordinates
+    """
     try:
-        # Create copies for horizontal and vertical line detection
-        horizontal = np.copy(processed_img)
-        vertical = np.copy(processed_img)
-        
-        # Get image dimensions
-        img_height, img_width = horizontal.shape
-        
-        # Define kernel sizes based on image dimensions
-        kernel_length_h = img_width // 30
-        kernel_length_v = img_height // 30
-        
-        # Create horizontal kernel and apply morphology
-        kernel_h = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_length_h, 1))
-        horizontal = cv2.erode(horizontal, kernel_h)
-        horizontal = cv2.dilate(horizontal, kernel_h)
-        
-        # Create vertical kernel and apply morphology
-        kernel_v = cv2.getStructuringElement(cv2.MORPH_RECT, (1, kernel_length_v))
-        vertical = cv2.erode(vertical, kernel_v)
-        vertical = cv2.dilate(vertical, kernel_v)
-        
-        # Detect lines using Hough transform
-        horizontal_lines = cv2.HoughLinesP(
-            horizontal, 1, np.pi/180, 100, 
-            minLineLength=img_width//3, maxLineGap=20
-        )
-        
-        vertical_lines = cv2.HoughLinesP(
-            vertical, 1, np.pi/180, 100, 
-            minLineLength=img_height//3, maxLineGap=20
-        )
-        
-        h_lines_count = len(horizontal_lines) if horizontal_lines is not None else 0
-        v_lines_count = len(vertical_lines) if vertical_lines is not None else 0
-        
-        # Convert lines to list format if they exist
-        h_lines_list = []
-        if horizontal_lines is not None:
-            for line in horizontal_lines:
-                h_lines_list.append(line[0].tolist())
-                
-        v_lines_list = []
-        if vertical_lines is not None:
-            for line in vertical_lines:
-                v_lines_list.append(line[0].tolist())
-        
-        # Determine if image likely contains a table structure
-        has_table = h_lines_count >= 5 and v_lines_count >= 3
-        
-        return {
-            'horizontal_lines': h_lines_list,
-            'vertical_lines': v_lines_list,
-            'h_lines_count': h_lines_count,
-            'v_lines_count': v_lines_count,
-            'has_table': has_table
-        }
+        # Run-length line detection on row/column projection profiles
+        return table_structure(processed_image(processed_img), scale=scale)
     except Exception as e:
         app.logger.error(f"Error extracting table structure: {str(e)}")
         return {
@@ -358,20 +254,28 @@ def extract_table_structure(processed_img):
             'vertical_lines': [],
             'h_lines_count': 0,
             'v_lines_count': 0,
-            'has_table': False
+            'has_table': False,
+            'row_positions': [],
+            'column_positions': [],
+            'cells': [],
+            'cell_count': 0
         }
 
+@pyramid_level('canonical')
 def detect_signature_area(processed_img):
     """Detect signature area in the image"""
     try:
+        # One edge map for the whole image, sliced per region
+        edges = processed_canny(processed_img, 30, 100)
+
         # Get image dimensions
-        img_height, img_width = processed_img.shape
+        img_height, img_width = edges.shape
         
         # Define potential signature regions (bottom right is most common)
         regions = {
-            'bottom_right': processed_img[int(0.7*img_height):, int(0.7*img_width):],
-            'bottom_left': processed_img[int(0.7*img_height):, :int(0.3*img_width)],
-            'bottom_center': processed_img[int(0.7*img_height):, int(0.3*img_width):int(0.7*img_width)]
+            'bottom_right': edges[int(0.7*img_height):, int(0.7*img_width):],
+            'bottom_left': edges[int(0.7*img_height):, :int(0.3*img_width)],
+            'bottom_center': edges[int(0.7*img_height):, int(0.3*img_width):int(0.7*img_width)]
         }
         
         results = {}
@@ -385,8 +289,7 @@ def detect_signature_area(processed_img):
                 continue
                 
             # Calculate edge density in region
-            region_edges = cv2.Canny(region, 30, 100)
-            edge_count = np.sum(region_edges > 0)
+            edge_count = np.sum(region > 0)
             edge_density = float(edge_count) / region.size if region.size > 0 else 0
             
             # Signatures typically have moderate edge density
@@ -415,90 +318,50 @@ def extract_features(image):
     """
     Extract document features for verification
     Args:
-        image: PIL Image, OpenCV image or path to image
+        image: ImagePyramid, DocumentContext, PIL Image, OpenCV image or path to image
     Returns:
-        dict: Extracted features
+        dict: Extracted features (coordinates and dimensions at the canonical
+        pyramid level)
     """
     try:
         # Convert image to proper format for processing if needed
         if isinstance(image, str):
             # It's a file path
             image = cv2.imread(image)
+        if isinstance(image, DocumentContext):
+            image = image.image
         
-        # Store original image for some processing
-        original_image = image.copy() if isinstance(image, np.ndarray) else image
-        
-        # Make sure we have a numpy array
-        if not isinstance(original_image, np.ndarray):
-            original_image = np.array(original_image)
-        
-        # Preprocess image
-        processed = preprocess_image(original_image)
+        # Every extractor runs on the pyramid level it declares; within a
+        # level all extractors share the derived images of one context
+        pyramid = image if isinstance(image, ImagePyramid) else ImagePyramid(image)
+        ctx = pyramid.context('canonical')
         
         # Initialize features dictionary
         features = {}
         
-        # Get image dimensions from original image
-        if len(original_image.shape) == 3:
-            height, width = original_image.shape[:2]
-            # Convert BGR to RGB for text extraction
-            rgb_image = cv2.cvtColor(original_image, cv2.COLOR_BGR2RGB)
-        else:
-            height, width = original_image.shape
-            # Convert grayscale to RGB
-            rgb_image = cv2.cvtColor(original_image, cv2.COLOR_GRAY2RGB)
+        # Get image dimensions from the canonical level
+        height, width = ctx.shape
+        rgb_image = ctx.rgb
+        native_height, native_width = pyramid.native_shape
         
         # Store document dimensions
         features['dimensions'] = {
             'width': width,
             'height': height,
-            'aspect_ratio': width / height if height > 0 else 0
+            'aspect_ratio': width / height if height > 0 else 0,
+            'native_width': native_width,
+            'native_height': native_height
         }
         
         # Extract text using OCR
-        text = extract_text(rgb_image)
+        text = pyramid.run(extract_text) if has_tesseract else ""
         features['text'] = text
         features['text_len'] = len(text)
         
-        # Calculate edge density for layout analysis
-        edge_density_data = calculate_edge_density(processed)
-        features['edge_density'] = edge_density_data
-        
-        # Calculate grid features (8x8 grid of average intensity values)
-        grid_features = []
-        edge_density = []
-        
-        grid_size = 8
-        cell_width = width // grid_size
-        cell_height = height // grid_size
-        
-        for y in range(grid_size):
-            for x in range(grid_size):
-                # Calculate cell boundaries
-                x1 = x * cell_width
-                y1 = y * cell_height
-                x2 = min((x + 1) * cell_width, width)
-                y2 = min((y + 1) * cell_height, height)
-                
-                # Extract cell from the image
-                if isinstance(rgb_image, np.ndarray) and len(rgb_image.shape) == 3:
-                    cell = rgb_image[y1:y2, x1:x2]
-                    # Calculate average intensity
-                    if cell.size > 0:
-                        avg_intensity = np.mean(cell)
-                    else:
-                        avg_intensity = 255
-                    
-                    # Calculate edge density in the cell
-                    edges = cv2.Canny(cv2.cvtColor(cell, cv2.COLOR_RGB2GRAY), 50, 150)
-                    cell_edge_density = np.sum(edges > 0) / (edges.shape[0] * edges.shape[1]) * 100 if edges.size > 0 else 0
-                else:
-                    # Fallback if we don't have a proper color image
-                    avg_intensity = 255
-                    cell_edge_density = 0
-                
-                grid_features.append(float(avg_intensity))
-                edge_density.append(float(cell_edge_density))
+        # Calculate grid features (8x8 grid of average intensity and edge density values)
+        # One Canny pass over all cells, then per-cell block sums
+        with pyramid.timed('canonical', 'grid_cell_features'):
+            grid_features, edge_density = grid_cell_features(rgb_image, grid_size=8, gray=ctx.gray)
         
         features['grid_features'] = grid_features
         features['edge_density'] = edge_density
@@ -510,15 +373,16 @@ def extract_features(image):
         features['is_maharashtra_hsc'] = detect_maharashtra_hsc(text)
         
         # Extract logo/seal positions
-        seal_positions = extract_seal_positions(processed)
+        with pyramid.timed('low', 'extract_seal_positions'):
+            seal_positions = extract_seal_positions(pyramid)
         features['seal_positions'] = seal_positions
         
         # Extract table structure
-        table_structure = extract_table_structure(processed)
+        table_structure = pyramid.run(extract_table_structure)
         features['table_structure'] = table_structure
         
         # Extract signature area
-        signature_area = detect_signature_area(processed)
+        signature_area = pyramid.run(detect_signature_area)
         features['signature_area'] = signature_area
         
         # Detect and extract key features (seal, logo, text blocks)
@@ -549,11 +413,9 @@ def extract_features(image):
             })
         
         # Detect text blocks using contours
-        gray = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2GRAY) if len(rgb_image.shape) == 3 else rgb_image
-        _, binary = cv2.threshold(gray, 180, 255, cv2.THRESH_BINARY_INV)
-        
-        # Find contours
-        contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        with pyramid.timed('canonical', 'text_blocks'):
+            binary = ctx.threshold('gray', 180, cv2.THRESH_BINARY_INV)
+            contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         
         # Filter contours to find text blocks
         min_text_area = (width * height) * 0.002  # Reduced minimum area for HSC/SSC certificates
@@ -632,6 +494,10 @@ def extract_features(image):
         # Default similarity threshold
         features['similarity_threshold'] = 0.75
         
+        # Per-level sizes and timings
+        features['pyramid'] = pyramid.summary()
+        app.logger.info(f"Pyramid levels: {features['pyramid']['levels']}")
+        
         return features
     except Exception as e:
         app.logger.error(f"Feature extraction error: {str(e)}")
@@ -705,21 +571,13 @@ def compare_features(doc_features, template_features):
         # For HSC, we'll do special text pattern matching
         if is_hsc_template:
             # Check for HSC-specific text patterns in the document
-            doc_text = doc_features.get('text', '').upper()
-            hsc_indicators = [
-                'HIGHER SECONDARY', 'HSC', 'H.S.C.', 
-                'STATEMENT OF MARKS', 'MAHARASHTRA STATE BOARD',
-                'MUMBAI DIVISIONAL BOARD'
-            ]
-            
-            # Count matches
-            matches = sum(1 for pattern in hsc_indicators if pattern in doc_text)
-            text_sim_score = min(matches / len(hsc_indicators), 1.0)  # Normalize to 0-1
+            matches = HSC_INDICATORS.match(doc_features.get('text', ''))
+            text_sim_score = min(matches.count(HSC_INDICATORS.group_names) / len(HSC_INDICATORS.group_names), 1.0)  # Normalize to 0-1
             
             similarity_scores['text_similarity'] = text_sim_score
         else:
             # Standard text comparison for non-HSC documents
-        if 'text_features' in doc_features and 'text_features' in template_features:
+            if 'text_features' in doc_features and 'text_features' in template_features:
                 doc_text = doc_features['text_features']
                 template_text = template_features['text_features']
                 
@@ -1027,19 +885,25 @@ def after_request(response):
     return response
     
 # Enhanced visualization with more detailed analysis
-def create_comparison_visualization(doc_path, template_path, scores):
+def create_comparison_visualization(doc_path, template_path, scores, ctx=None):
     """
     Create a visual comparison of verification results
     Args:
         doc_path: Path to document image
         template_path: Path to template image
         scores: Similarity scores
+        ctx: DocumentContext of the document, if already loaded
     Returns:
         str: Path to output visualization
     """
     try:
-        # Load images
-        doc_img = cv2.imread(doc_path)
+        # Load images (reusing the decoded document when available)
+        if ctx is None:
+            doc_img = cv2.imread(doc_path)
+            if doc_img is not None:
+                ctx = DocumentContext(doc_img)
+        else:
+            doc_img = ctx.bgr
         if doc_img is None:
             app.logger.error(f"Could not read document image: {doc_path}")
             return None
@@ -1056,7 +920,7 @@ def create_comparison_visualization(doc_path, template_path, scores):
         height, width = result_img.shape[:2]
         
         # Process the document for feature detection
-        processed_img = preprocess_image(doc_img)
+        processed_img = ctx.processed
         
         # Find text blocks using contours
         contours, _ = cv2.findContours(processed_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -1355,9 +1219,9 @@ def train_template():
 def verify_document():
     """Verify uploaded document against template database"""
     try:
-    # Check for uploaded file
-    if 'image' not in request.files and 'document' not in request.files:
-        return jsonify({
+        # Check for uploaded file
+        if 'image' not in request.files and 'document' not in request.files:
+            return jsonify({
                 'success': False,
                 'message': 'No file provided'
             })
@@ -1384,8 +1248,13 @@ def verify_document():
                     'message': 'Could not read image file'
                 })
 
-            # Extract features from the document
-            doc_features = extract_features(image)
+            # Extract features from the document, in the frame of the
+            # best-candidate template when it can be registered to one
+            pyramid = ImagePyramid(image)
+            registered = register(pyramid, glob.glob(os.path.join(TEMPLATE_DIR, '*.jpg')))
+            if registered is not None:
+                pyramid = registered
+            doc_features = extract_features(pyramid)
             
             # Find best matching template and get verification results
             verification_results = find_best_match(doc_features)
@@ -1396,9 +1265,9 @@ def verify_document():
                 template_name = verification_results.get('template', '').lower()
                 
                 # Create visualization
-                visualization_path = create_comparison_visualization(filepath, template_name, verification_results.get('scores', {}))
+                visualization_path = create_comparison_visualization(filepath, template_name, verification_results.get('scores', {}), ctx=pyramid.context('canonical'))
                 
-                    if visualization_path:
+                if visualization_path:
                     # Add visualization URL to response
                     visualization_filename = os.path.basename(visualization_path)
                     verification_results['visualizationUrl'] = f"/visualizations/{visualization_filename}"
@@ -1419,7 +1288,7 @@ def verify_document():
             try:
                 if os.path.exists(filepath):
                     os.remove(filepath)
-    except Exception as e:
+            except Exception as e:
                 app.logger.warning(f"Failed to clean up uploaded file: {str(e)}")
 
     except Exception as e:
@@ -1436,9 +1305,10 @@ def serve_visualization(filename):
     visualizations_dir = os.path.join(TEMP_DIR, "visualizations")
     return send_from_directory(visualizations_dir, filename)
 
-def generate_comparison_visualization(document_image, template_name, similarity_scores):
+def generate_comparison_visualization(document_image, template_name, similarity_scores, doc_features=None):
     """
     Generate a visual comparison between the document and the template
+    Pass doc_features if they were already extracted for this document
     Returns the path to the saved visualization image
     """
     try:
@@ -1465,8 +1335,8 @@ def generate_comparison_visualization(document_image, template_name, similarity_
             template_features = {}
         
         # Extract features from document for visualization
-        processed_doc = preprocess_image(document_image)
-        doc_features = extract_features(document_image)
+        if doc_features is None:
+            doc_features = extract_features(document_image)
         
         # Resize both to the same height while maintaining aspect ratio
         target_height = 800
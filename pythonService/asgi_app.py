@@ -0,0 +1,471 @@
+"""
+Asynchronous (ASGI) variant of the document verification service.
+
+    uvicorn asgi_app:application --host 0.0.0.0 --port 5000
+
+Serves the same routes and JSON contracts as the Flask app in app.py, but
+never blocks the event loop:
+- CPU stages (OpenCV comparison, OCR, PDF rendering) run in a process pool,
+  calling the same functions the Flask handlers use
+- Pinata uploads and SMTP go through async clients (httpx, aiosmtplib) when
+  installed, otherwise through a thread
+- every route group has its own concurrency limit, so a burst of slow
+  uploads queues on its own semaphore while health checks stay responsive
+
+Requires starlette, python-multipart and uvicorn (requirements.txt); httpx
+and aiosmtplib are optional.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import shutil
+import tempfile
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+
+import cv2
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import FileResponse, JSONResponse
+from starlette.routing import Route
+from werkzeug.utils import secure_filename
+
+import app as service
+from ingest_guard import inspect_stream, UploadRejected
+from pdf_output import PdfSpool
+
+# Try to import async clients for network I/O
+try:
+    import httpx
+    has_httpx = True
+except ImportError:
+    print("httpx not available. Pinata uploads will run in a thread.")
+    has_httpx = False
+
+try:
+    import aiosmtplib
+    has_aiosmtplib = True
+except ImportError:
+    print("aiosmtplib not available. Emails will be sent from a thread.")
+    has_aiosmtplib = False
+
+CPU_COUNT = os.cpu_count() or 1
+
+# Worker processes for CPU stages
+CPU_WORKERS = int(os.getenv('ASYNC_CPU_WORKERS', str(CPU_COUNT)))
+
+# Requests of each route group allowed to run at once; the rest wait
+ROUTE_LIMITS = {
+    'verify': int(os.getenv('ASYNC_VERIFY_CONCURRENCY', str(CPU_COUNT))),
+    'extract': int(os.getenv('ASYNC_EXTRACT_CONCURRENCY', str(CPU_COUNT))),
+    'pdf': int(os.getenv('ASYNC_PDF_CONCURRENCY', str(CPU_COUNT))),
+    'ipfs': int(os.getenv('ASYNC_IPFS_CONCURRENCY', '4')),
+}
+
+PINATA_URL = "https://api.pinata.cloud/pinning/pinFileToIPFS"
+HTTP_TIMEOUT = float(os.getenv('ASYNC_HTTP_TIMEOUT', '60'))
+
+UPLOAD_FOLDER = service.app.config['UPLOAD_FOLDER']
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+logger = service.app.logger
+
+
+@asynccontextmanager
+async def lifespan(application):
+    state = application.state
+    service.init_service()
+    # spawn: forking a process that already runs an event loop and threads is
+    # unsafe. Pool processes import app.py only, for the functions they run,
+    # and skip init_service(). One job per process: OpenCV's own thread pool
+    # would oversubscribe the cores.
+    state.cpu_pool = ProcessPoolExecutor(
+        max_workers=CPU_WORKERS,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=cv2.setNumThreads,
+        initargs=(1,),
+    )
+    state.limits = {name: asyncio.Semaphore(limit) for name, limit in ROUTE_LIMITS.items()}
+    state.http = httpx.AsyncClient(timeout=HTTP_TIMEOUT) if has_httpx else None
+    service.template_registry.start()
+    try:
+        yield
+    finally:
+        # Let in-flight CPU jobs finish before the process exits
+        await run_in_threadpool(state.cpu_pool.shutdown, True)
+        if state.http is not None:
+            await state.http.aclose()
+        service.template_registry.stop()
+
+
+async def run_cpu(request, route, func, *args):
+    """Run func(*args) in the process pool, within the route's concurrency limit"""
+    async with request.app.state.limits[route]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(request.app.state.cpu_pool, func, *args)
+
+
+def error_response(message, status_code):
+    return JSONResponse({'success': False, 'message': message}, status_code=status_code)
+
+
+def _save_file(source, path):
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(source, f, UPLOAD_CHUNK_SIZE)
+
+
+async def save_upload(form, field='document'):
+    """
+    Validate and save the uploaded file in form[field] like the Flask routes do.
+    Returns (file_path, None) or (None, error JSONResponse); the caller
+    removes the file with service.remove_upload().
+    """
+    upload = form.get(field)
+    if upload is None or isinstance(upload, str):
+        return None, error_response('No document file provided', 400)
+    if upload.filename == '':
+        return None, error_response('No file selected', 400)
+    if not service.allowed_file(upload.filename):
+        return None, error_response(
+            f'File type not allowed. Allowed types: {", ".join(service.ALLOWED_EXTENSIONS)}', 400)
+
+    # Header only: oversized or mislabelled images are refused before they are saved or decoded
+    try:
+        await run_in_threadpool(inspect_stream, upload.file, upload.filename, upload.content_type)
+    except UploadRejected as e:
+        return None, error_response(e.message, e.status)
+
+    # Under a name no other request uses; the caller removes it when done
+    file_path = service.unique_upload_path(upload.filename)
+    try:
+        await run_in_threadpool(_save_file, upload.file, file_path)
+    except BaseException:
+        service.remove_upload(file_path)
+        raise
+    return file_path, None
+
+
+async def health_check(request):
+    """Health check endpoint"""
+    return JSONResponse({"status": "ok", "message": "Service is running"})
+
+
+async def list_templates(request):
+    """List available templates"""
+    try:
+        if not os.path.exists(service.TEMPLATE_DIR):
+            logger.error(f"Template directory not found: {service.TEMPLATE_DIR}")
+            return JSONResponse({
+                'success': False,
+                'message': 'Template directory not found',
+                'templates': []
+            }, status_code=500)
+
+        templates = service.template_registry.snapshot().names()
+        if not templates:
+            return JSONResponse({'success': False, 'message': 'No templates found', 'templates': []})
+        return JSONResponse({
+            'success': True,
+            'message': f'Found {len(templates)} templates',
+            'templates': templates
+        })
+    except Exception as e:
+        logger.error(f"Error listing templates: {str(e)}")
+        return JSONResponse({
+            'success': False,
+            'message': f'Error listing templates: {str(e)}',
+            'templates': []
+        }, status_code=500)
+
+
+async def verify_document(request):
+    """Verify a document against the templates"""
+    try:
+        file_path, error = await save_upload(await request.form())
+        if error:
+            return error
+        try:
+            result, status = await run_cpu(request, 'verify', service.verify_image, file_path)
+        finally:
+            service.remove_upload(file_path)
+        return JSONResponse(result, status_code=status)
+    except Exception as e:
+        logger.error(f"Error verifying document: {str(e)}")
+        traceback.print_exc()
+        return error_response(f'Error during verification: {str(e)}', 500)
+
+
+async def extract_document_data(request):
+    """Extract data from a document image"""
+    try:
+        file_path, error = await save_upload(await request.form())
+        if error:
+            return error
+        try:
+            result, status = await run_cpu(request, 'extract', service.extract_image_data, file_path)
+        finally:
+            service.remove_upload(file_path)
+        return JSONResponse(result, status_code=status)
+    except Exception as e:
+        logger.error(f"Error extracting data: {str(e)}")
+        traceback.print_exc()
+        return error_response(f'Error during data extraction: {str(e)}', 500)
+
+
+async def generate_pdf(request):
+    """Generate a PDF from extracted data and original image"""
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not data:
+            return error_response('No data provided', 400)
+
+        student_name = data.get('studentName', 'Unknown_Student')
+        clean_student_name = secure_filename(student_name.replace(' ', '_'))
+        pdf_filename = f"transcript_{clean_student_name}.pdf"
+
+        # Persisted copies are content-addressed; otherwise render into a
+        # private directory that is removed once the response is sent
+        cleanup = None
+        if service.app.config['PERSIST_PDFS']:
+            pdf_dir = os.path.join(UPLOAD_FOLDER, 'pdfs')
+        else:
+            pdf_dir = tempfile.mkdtemp(dir=UPLOAD_FOLDER, prefix='pdf-')
+            cleanup = BackgroundTask(shutil.rmtree, pdf_dir, True)
+
+        try:
+            pdf_path, sha256, _ = await run_cpu(request, 'pdf', service.render_pdf_file, data, pdf_dir)
+        except Exception:
+            if cleanup is not None:
+                shutil.rmtree(pdf_dir, True)
+            raise
+
+        return FileResponse(
+            pdf_path,
+            media_type='application/pdf',
+            filename=pdf_filename,
+            headers={'X-Content-SHA256': sha256},
+            background=cleanup,
+        )
+    except Exception as e:
+        logger.error(f"Error generating PDF: {str(e)}")
+        traceback.print_exc()
+        return error_response(f'Error generating PDF: {str(e)}', 500)
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+async def upload_to_pinata(request, file_path, filename):
+    """Upload file to Pinata IPFS without blocking the event loop"""
+    client = request.app.state.http
+    if client is None:
+        return await run_in_threadpool(service.upload_to_pinata, file_path, filename)
+
+    try:
+        content = await run_in_threadpool(_read_file, file_path)
+        response = await client.post(
+            PINATA_URL,
+            headers={'Authorization': f'Bearer {service.PINATA_JWT}'},
+            files={'file': (filename, content, 'application/octet-stream')},
+        )
+        if response.status_code == 200:
+            return response.json().get('IpfsHash')
+        logger.error(f"Failed to upload to Pinata: {response.text}")
+        return None
+    except Exception as e:
+        logger.error(f"Error uploading to Pinata: {str(e)}")
+        return None
+
+
+async def send_email_notification(to_email, student_name, document_type, ipfs_hash):
+    """Send the upload confirmation email without blocking the event loop"""
+    if not has_aiosmtplib:
+        return await run_in_threadpool(
+            service.send_email_notification, to_email, student_name, document_type, ipfs_hash)
+
+    if not service.SMTP_USERNAME or not service.SMTP_PASSWORD:
+        logger.error("Email credentials not configured")
+        return False
+    try:
+        msg = service.build_notification_email(to_email, student_name, document_type, ipfs_hash)
+        await aiosmtplib.send(
+            msg,
+            hostname=service.SMTP_SERVER,
+            port=service.SMTP_PORT,
+            start_tls=True,
+            username=service.SMTP_USERNAME,
+            password=service.SMTP_PASSWORD,
+            timeout=HTTP_TIMEOUT,
+        )
+        return True
+    except Exception as e:
+        logger.error(f"SMTP Error: {str(e)}")
+        return False
+
+
+async def ipfs_upload(request):
+    """Upload file to IPFS"""
+    file_path = None
+    try:
+        async with request.app.state.limits['ipfs']:
+            form = await request.form()
+            file_path, error = await save_upload(form)
+            if error:
+                return error
+            # Pinned under the name it was uploaded with
+            filename = secure_filename(form['document'].filename)
+
+            student_name = form.get('studentName', 'Unknown_Student')
+            document_type = form.get('documentType', 'Document')
+            student_email = form.get('email')
+
+            clean_student_name = secure_filename(student_name.replace(' ', '_'))
+            pdf_filename = f"transcript_{clean_student_name}.pdf"
+            pdf_dir = os.path.join(UPLOAD_FOLDER, 'pdfs')
+
+            pdf_upload = form.get('pdf')
+            if pdf_upload is not None and not isinstance(pdf_upload, str):
+                # Client sent a PDF: store it content-addressed
+                def store_client_pdf():
+                    spool = PdfSpool()
+                    try:
+                        shutil.copyfileobj(pdf_upload.file, spool, UPLOAD_CHUNK_SIZE)
+                        return spool.persist(pdf_dir)
+                    finally:
+                        spool.close()
+                pdf_path = await run_in_threadpool(store_client_pdf)
+            else:
+                loop = asyncio.get_running_loop()
+                pdf_path = await loop.run_in_executor(
+                    request.app.state.cpu_pool, service.build_ipfs_pdf,
+                    file_path, student_name, document_type, pdf_dir)
+
+            # Upload the PDF as the primary document if there is one
+            if pdf_path and os.path.exists(pdf_path):
+                document_hash = await upload_to_pinata(request, pdf_path, pdf_filename)
+            else:
+                document_hash = await upload_to_pinata(request, file_path, filename)
+
+            if not document_hash:
+                return error_response('Failed to upload document to IPFS', 500)
+
+            # Also upload the original document as additional content
+            original_hash = None
+            if pdf_path:
+                original_hash = await upload_to_pinata(request, file_path, filename)
+
+            if student_email:
+                emails = [send_email_notification(student_email, student_name, "Certificate", document_hash)]
+                if original_hash:
+                    emails.append(send_email_notification(student_email, student_name, "Original Document", original_hash))
+                await asyncio.gather(*emails, return_exceptions=True)
+
+            return JSONResponse({
+                'success': True,
+                'message': 'Files uploaded to IPFS',
+                'hash': document_hash,
+                'IpfsHash': document_hash,
+                'cid': document_hash,
+                'filename': pdf_filename if pdf_path else filename,
+                'original_hash': original_hash
+            })
+    except Exception as e:
+        logger.error(f"Error uploading to IPFS: {str(e)}")
+        traceback.print_exc()
+        return error_response(f'Error during IPFS upload: {str(e)}', 500)
+    finally:
+        service.remove_upload(file_path)
+
+
+async def store_student(request):
+    """Store student information (mock storage, like the Flask route)"""
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not data:
+            return error_response('No data provided', 400)
+        return JSONResponse({'success': True, 'message': 'Student information stored successfully'})
+    except Exception as e:
+        return error_response(f'Error storing student information: {str(e)}', 500)
+
+
+async def email_notification(request):
+    """Email notification endpoint (mock, like the Flask route)"""
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not data:
+            return error_response('No data provided', 400)
+
+        email = (data.get('email') or '').strip()
+        document_hash = data.get('documentHash')
+        if not email or email in ('undefined', 'null', 'N/A'):
+            return error_response(f'Invalid email address provided: {email}', 400)
+        if not document_hash:
+            return error_response('Document hash is required', 400)
+
+        return JSONResponse({
+            'success': True,
+            'message': 'Email notification processed successfully (MOCK)',
+            'mock': True
+        })
+    except Exception as e:
+        return error_response(f'Error processing email notification: {str(e)}', 500)
+
+
+async def serve_visualization(request):
+    """Serve visualization images"""
+    visualizations_dir = os.path.join(UPLOAD_FOLDER, 'visualizations')
+    path = os.path.join(visualizations_dir, secure_filename(request.path_params['filename']))
+    if not os.path.isfile(path):
+        return error_response('Not found', 404)
+    return FileResponse(path)
+
+
+routes = [
+    Route('/health', health_check, methods=['GET']),
+    Route('/templates', list_templates, methods=['GET']),
+    Route('/api/templates', list_templates, methods=['GET']),
+    Route('/verify', verify_document, methods=['POST']),
+    Route('/api/verify', verify_document, methods=['POST']),
+    Route('/template-verifier/verify', verify_document, methods=['POST']),
+    Route('/api/template-verifier/verify', verify_document, methods=['POST']),
+    Route('/extract', extract_document_data, methods=['POST']),
+    Route('/api/extract', extract_document_data, methods=['POST']),
+    Route('/api/documents/extract', extract_document_data, methods=['POST']),
+    Route('/generate-pdf', generate_pdf, methods=['POST']),
+    Route('/api/generate-pdf', generate_pdf, methods=['POST']),
+    Route('/api/extract/generate-pdf', generate_pdf, methods=['POST']),
+    Route('/api/documents/generate-pdf', generate_pdf, methods=['POST']),
+    Route('/students/store', store_student, methods=['POST']),
+    Route('/api/ipfs/upload', ipfs_upload, methods=['POST']),
+    Route('/api/notifications/email', email_notification, methods=['POST']),
+    Route('/notifications/email', email_notification, methods=['POST']),
+    Route('/visualizations/{filename}', serve_visualization, methods=['GET']),
+]
+
+middleware = [
+    Middleware(
+        CORSMiddleware,
+        allow_origins=["http://localhost:5173"],
+        allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+        allow_headers=["*"],
+        allow_credentials=True,
+    )
+]
+
+application = Starlette(routes=routes, middleware=middleware, lifespan=lifespan)
@@ -0,0 +1,102 @@
+"""
+Microbenchmark for the field_extractor student schema against the per-field
+re.findall() scans of extract_student_data() it replaces.
+
+Usage:
+    python bench_field_extractor.py [--texts 2000] [--seed 0]
+
+Runs on OCR-like texts of synthetic marksheets (the lines render_marksheet()
+prints, see synthetic_marksheets.py). Prints the time per text of the legacy
+scans, of FieldSchema.extract() and of FieldSchema.extract_many() over all
+texts, and how often each got the seat number, name and exam year right.
+"""
+
+import argparse
+import random
+import re
+import time
+
+from field_extractor import STUDENT_FIELDS
+from synthetic_marksheets import BOARDS, random_student
+
+CHECKED_FIELDS = ['rollNumber', 'studentName', 'examYear']
+
+
+def legacy_extract(text):
+    """The re.findall() scans of extract_student_data() before this change"""
+    data = {'studentName': '', 'rollNumber': '', 'board': '', 'batch': '', 'program': '', 'examYear': ''}
+    name_matches = re.findall(r'name[:\s]+([A-Za-z\s]+)', text, re.IGNORECASE)
+    if name_matches:
+        data['studentName'] = name_matches[0].strip()
+    roll_matches = re.findall(r'(roll|seat|registration)[\s.:]*(no|number)[:\s]*([A-Z0-9]+)', text, re.IGNORECASE)
+    if roll_matches:
+        data['rollNumber'] = roll_matches[0][2].strip()
+    board_matches = re.findall(r'(board|university)[:\s]+([A-Za-z\s]+)', text, re.IGNORECASE)
+    if board_matches:
+        data['board'] = board_matches[0][1].strip()
+    year_matches = re.findall(r'(year|batch|session)[:\s]+([0-9]+)', text, re.IGNORECASE)
+    if year_matches:
+        data['batch'] = year_matches[0][1].strip()
+    return data
+
+
+def marksheet_text(student):
+    """The text render_marksheet() prints, one OCR line per text line"""
+    lines = [
+        'MAHARASHTRA STATE BOARD OF SECONDARY AND',
+        'HIGHER SECONDARY EDUCATION, PUNE',
+        BOARDS[student['program']]['title'],
+        f"STATEMENT OF MARKS - {student['examYear']}",
+        f"SEAT NO : {student['rollNumber']}",
+        f"CANDIDATE'S FULL NAME : {student['studentName']}",
+        f"CANDIDATE'S MOTHER'S NAME : {student['motherName']}",
+        student['board'],
+        'SUBJECT MAX MARKS MARKS OBTAINED',
+    ]
+    lines += [f"{subject} 100 {mark:03d}" for subject, mark in student['marks'].items()]
+    lines.append(f"TOTAL MARKS PERCENTAGE {student['percentage']} {student['maxTotal']} {student['total']}")
+    lines.append('BOARD SEAL')
+    return '\n'.join(lines)
+
+
+def per_text_us(func, *args, count):
+    start = time.perf_counter()
+    func(*args)
+    return (time.perf_counter() - start) * 1e6 / count
+
+
+def accuracy(students, extracted):
+    """Fraction of texts with each checked field extracted exactly"""
+    return {name: sum(str(data.get(name, '')) == str(student[name]) for student, data in zip(students, extracted))
+            / len(students) for name in CHECKED_FIELDS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark student field extraction.')
+    parser.add_argument('--texts', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    students = [random_student(rng) for _ in range(args.texts)]
+    texts = [marksheet_text(student) for student in students]
+
+    legacy = [legacy_extract(text) for text in texts]
+    single = [{name: field.value for name, field in STUDENT_FIELDS.extract(text).items()} for text in texts]
+    bulk = STUDENT_FIELDS.extract_many(texts)
+
+    legacy_us = per_text_us(lambda: [legacy_extract(text) for text in texts], count=len(texts))
+    single_us = per_text_us(lambda: [STUDENT_FIELDS.extract(text) for text in texts], count=len(texts))
+    bulk_us = per_text_us(STUDENT_FIELDS.extract_many, texts, count=len(texts))
+
+    print(f"{len(texts)} texts, {sum(map(len, texts)) // len(texts)} characters on average")
+    print(f"  legacy findall   {legacy_us:8.1f} us/text   correct {accuracy(students, legacy)}")
+    print(f"  schema extract   {single_us:8.1f} us/text   correct {accuracy(students, single)}   "
+          f"x{legacy_us / single_us:4.1f}")
+    print(f"  schema bulk      {bulk_us:8.1f} us/text   "
+          f"same as extract: {all(b == s for b, s in zip(({n: f.value for n, f in r.items()} for r in bulk), single))}   "
+          f"x{legacy_us / bulk_us:4.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Microbenchmark for grid_features against the per-cell loops it replaces.
+
+Usage:
+    python bench_grid_features.py [image_path ...]
+
+Defaults to the images in templates/. Each image is also upscaled to
+phone-camera resolutions. Prints timings and the largest difference
+between the old and new feature vectors, which should be zero.
+"""
+
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from grid_features import grid_cell_features, region_densities
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
+
+# Long edges to benchmark at, in pixels (native size is always included)
+LONG_EDGES = [2000, 4000, 8000]
+REPEATS = 5
+
+
+def legacy_grid_features(rgb_image, grid_size=8):
+    """The per-cell loop from extract_features() before vectorization"""
+    height, width = rgb_image.shape[:2]
+    grid_features = []
+    edge_density = []
+    cell_width = width // grid_size
+    cell_height = height // grid_size
+
+    for y in range(grid_size):
+        for x in range(grid_size):
+            x1 = x * cell_width
+            y1 = y * cell_height
+            x2 = min((x + 1) * cell_width, width)
+            y2 = min((y + 1) * cell_height, height)
+
+            cell = rgb_image[y1:y2, x1:x2]
+            avg_intensity = np.mean(cell) if cell.size > 0 else 255
+            edges = cv2.Canny(cv2.cvtColor(cell, cv2.COLOR_RGB2GRAY), 50, 150)
+            cell_edge_density = np.sum(edges > 0) / (edges.shape[0] * edges.shape[1]) * 100 if edges.size > 0 else 0
+
+            grid_features.append(float(avg_intensity))
+            edge_density.append(float(cell_edge_density))
+
+    return grid_features, edge_density
+
+
+def legacy_region_densities(edges, region_size=3):
+    """The region loop from calculate_edge_density() before vectorization"""
+    h, w = edges.shape
+    regions = []
+    for i in range(region_size):
+        for j in range(region_size):
+            y1 = int(i * h / region_size)
+            y2 = int((i + 1) * h / region_size)
+            x1 = int(j * w / region_size)
+            x2 = int((j + 1) * w / region_size)
+            region = edges[y1:y2, x1:x2]
+            total = region.shape[0] * region.shape[1]
+            regions.append(float(np.sum(region > 0)) / total if total > 0 else 0)
+    return regions
+
+
+def best_time(func, *args):
+    """Best wall time of REPEATS calls, in milliseconds"""
+    best = float('inf')
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def max_diff(a, b):
+    return float(np.max(np.abs(np.asarray(a) - np.asarray(b)))) if a else 0.0
+
+
+def bench_image(name, rgb_image):
+    h, w = rgb_image.shape[:2]
+    old_grid, old_edges = legacy_grid_features(rgb_image)
+    new_grid, new_edges = grid_cell_features(rgb_image)
+
+    gray = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2GRAY)
+    canny = cv2.Canny(gray, 50, 150)
+    old_regions = legacy_region_densities(canny)
+    new_regions = region_densities(canny, 3)
+
+    old_ms = best_time(legacy_grid_features, rgb_image)
+    new_ms = best_time(grid_cell_features, rgb_image)
+    shared_ms = best_time(grid_cell_features, rgb_image, 8, gray)
+    old_region_ms = best_time(legacy_region_densities, canny)
+    new_region_ms = best_time(region_densities, canny, 3)
+
+    print(f"{name} ({w}x{h})")
+    print(f"  8x8 grid:      legacy {old_ms:8.2f} ms   vectorized {new_ms:8.2f} ms   x{old_ms / new_ms:5.1f}"
+          f"   (shared gray {shared_ms:.2f} ms)")
+    print(f"  3x3 regions:   legacy {old_region_ms:8.2f} ms   vectorized {new_region_ms:8.2f} ms   x{old_region_ms / new_region_ms:5.1f}")
+    print(f"  max |diff| intensity {max_diff(old_grid, new_grid):.2e}   "
+          f"edge % {max_diff(old_edges, new_edges):.3f}   "
+          f"regions {max_diff(old_regions, new_regions):.2e}")
+
+
+def main():
+    paths = sys.argv[1:]
+    if not paths:
+        paths = [os.path.join(TEMPLATE_DIR, f) for f in sorted(os.listdir(TEMPLATE_DIR))
+                 if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+
+    for path in paths:
+        img = cv2.imread(path)
+        if img is None:
+            print(f"Error: Could not read image: {path}")
+            continue
+        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        name = os.path.basename(path)
+        bench_image(name, rgb)
+
+        h, w = rgb.shape[:2]
+        for long_edge in LONG_EDGES:
+            scale = long_edge / max(h, w)
+            if scale <= 1:
+                continue
+            resized = cv2.resize(rgb, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_CUBIC)
+            bench_image(f"{name} @ {long_edge}px", resized)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark for reduced decoding (image_decode.py) against full-resolution
+cv2.imread of the verification path.
+
+Usage:
+    python bench_image_decode.py [--photos 3] [--seed 0] [image_path ...]
+
+Runs on synthetic marksheet photos at every resolution of
+synthetic_marksheets.RESOLUTIONS (or on the given images). For each image it
+prints the time and peak memory of decoding what /api/verify uses: the low
+pyramid level (classification, registration and comparison), and the low
+and canonical levels (plus the visualization of a verified document):
+
+- legacy:  cv2.imread at full resolution, then resized per level
+- reduced: open_pyramid(), each level at the JPEG DCT reduction it needs
+
+Times are the best of REPEATS runs; peak memory is that of the images
+allocated, traced with tracemalloc.
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+
+from image_decode import open_pyramid
+from image_pyramid import ImagePyramid
+from synthetic_marksheets import RESOLUTIONS, random_marksheet
+
+REPEATS = 5
+
+
+def legacy(path, visualize):
+    image = cv2.imread(path)
+    pyramid = ImagePyramid(image)
+    pyramid.context('low').gray
+    if visualize:
+        pyramid.context('canonical').bgr
+
+
+def reduced(path, visualize):
+    pyramid = open_pyramid(path)
+    pyramid.context('low').gray
+    if visualize:
+        pyramid.context('canonical').bgr
+
+
+MODES = {'legacy': legacy, 'reduced': reduced}
+
+
+def measure(mode, path, visualize):
+    """
+    Best time of REPEATS runs of a mode, and the peak of the numpy memory
+    it allocated (OpenCV allocates its output images through numpy)
+    """
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        MODES[mode](path, visualize)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    MODES[mode](path, visualize)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'ms': min(times) * 1000, 'peak_mb': peak / 2 ** 20}
+
+
+def bench_image(label, path):
+    h, w = cv2.imread(path).shape[:2]
+    print(f"\n{label} ({w}x{h})")
+    for visualize in (False, True):
+        results = {mode: measure(mode, path, visualize) for mode in MODES}
+        for mode, result in results.items():
+            print(f"  {mode:<8} {'low + canonical' if visualize else 'low':<16}"
+                  f"{result['ms']:8.1f} ms   peak {result['peak_mb']:6.1f} MB")
+        legacy_result, reduced_result = results['legacy'], results['reduced']
+        print(f"  {'':<25}x{legacy_result['ms'] / reduced_result['ms']:.1f} faster, "
+              f"x{legacy_result['peak_mb'] / max(reduced_result['peak_mb'], 0.1):.1f} less peak memory")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark reduced JPEG decoding.')
+    parser.add_argument('images', nargs='*')
+    parser.add_argument('--photos', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for path in args.images:
+        bench_image(os.path.basename(path), path)
+    if args.images:
+        return
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, resolution in RESOLUTIONS.items():
+            for i in range(args.photos):
+                data, _, _ = random_marksheet(rng, resolution)
+                path = os.path.join(tmp, f"{name}_{i}.jpg")
+                with open(path, 'wb') as f:
+                    f.write(data)
+                bench_image(f"{name} photo {i + 1}", path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark for seal_detector against the whole-page HoughCircles detectors
+it replaces.
+
+Usage:
+    python bench_seal_detector.py [--photos 5] [--seed 0] [--skip-full-res] [image_path ...]
+
+Runs on the images in templates/ (or the given images) and on synthetic
+12 MP phone photos of the templates (see synthetic_marksheets.py). For each
+image it prints the time and circle count of
+
+- legacy full-res: HoughCircles over the blurred full-resolution page,
+  minDist 20 (scripts/analyze_images.py)
+- legacy low:      HoughCircles over the low pyramid level, minDist 20
+                   canonical pixels (extract_seal_positions, verify_document.py)
+- regions:         seal_detector in the default regions, unregistered
+- registered:      seal_detector after registration, with the template's
+                   regions and seal matching (registration time excluded)
+
+and whether the template's seal was found.
+"""
+
+import argparse
+import os
+import random
+import time
+
+import cv2
+import numpy as np
+
+from image_pyramid import ImagePyramid, CANONICAL_LEVEL
+from registration import register, template_frame
+from seal_detector import detect_seals
+from synthetic_marksheets import RESOLUTIONS, random_marksheet
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
+TEMPLATE_FILES = ['marksheet hsc .jpg', 'marksheet_ssc_2.jpg', 'marksheet ssc 3.jpg']
+REPEATS = 3
+
+
+def legacy_full_resolution(image):
+    """HoughCircles as in scripts/analyze_images.py before this change"""
+    blur = cv2.GaussianBlur(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+    circles = cv2.HoughCircles(blur, cv2.HOUGH_GRADIENT, 1, 20, param1=50, param2=30, minRadius=10, maxRadius=100)
+    return [] if circles is None else circles[0].tolist()
+
+
+def legacy_low_level(pyramid):
+    """HoughCircles as in scripts/verify_document.py before this change"""
+    scale = pyramid.factor(CANONICAL_LEVEL, 'low')
+    circles = cv2.HoughCircles(pyramid.context('low').blur, cv2.HOUGH_GRADIENT, 1, max(1, int(20 * scale)),
+                               param1=50, param2=30, minRadius=max(1, int(10 * scale)),
+                               maxRadius=max(2, int(100 * scale)))
+    return [] if circles is None else circles[0].tolist()
+
+
+def best_time(func, *args, repeats=REPEATS):
+    """Best wall time of repeats calls, in milliseconds, and the last result"""
+    best, result = float('inf'), None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def bench_image(name, image, template_paths, full_resolution=True):
+    h, w = image.shape[:2]
+    # Seconds to minutes per call on textured pages, so it runs once
+    full_ms, full = best_time(legacy_full_resolution, image, repeats=1) if full_resolution else (float('nan'), [])
+
+    # Detectors share the low level and its blur, as in the service
+    pyramid = ImagePyramid(image)
+    pyramid.context('low').blur
+    low_ms, low = best_time(legacy_low_level, pyramid)
+    region_ms, regions = best_time(detect_seals, pyramid)
+
+    registered = register(ImagePyramid(image), template_paths)
+    line = (f"{name:<28} {w:>5}x{h:<5} legacy full-res {full_ms:8.1f} ms {len(full):4d}   "
+            f"legacy low {low_ms:6.1f} ms {len(low):4d}   regions {region_ms:6.1f} ms {len(regions['circles']):2d}")
+    if registered is not None:
+        registered.context('low').blur
+        reg_ms, seals = best_time(detect_seals, registered, registered.frame)
+        seal = seals['regions'].get('seal', {})
+        line += (f"   registered {reg_ms:6.1f} ms {len(seals['circles']):2d}"
+                 f"   seal {'found' if seal.get('found') else 'missing'} (match {seal.get('match_score')})")
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark seal detection.')
+    parser.add_argument('images', nargs='*')
+    parser.add_argument('--photos', type=int, default=5, help='synthetic phone photos to add')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-full-res', action='store_true', help='skip the (very slow) full-resolution legacy run')
+    args = parser.parse_args()
+
+    template_paths = [os.path.join(TEMPLATE_DIR, f) for f in TEMPLATE_FILES]
+    for path in template_paths:
+        template_frame(path)
+
+    paths = args.images or template_paths
+    for path in paths:
+        image = cv2.imread(path)
+        if image is None:
+            print(f"Error: Could not read image: {path}")
+            continue
+        bench_image(os.path.basename(path), image, template_paths, not args.skip_full_res)
+
+    rng = random.Random(args.seed)
+    for i in range(args.photos):
+        data, _, _ = random_marksheet(rng, RESOLUTIONS['phone_12mp'])
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        bench_image(f"phone photo {i + 1}", image, template_paths, not args.skip_full_res)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Microbenchmark for table_structure against the morphology + HoughLinesP
+detector it replaces.
+
+Usage:
+    python bench_table_structure.py [image_path ...]
+
+Defaults to the images in templates/. Each image is run at the low and
+canonical pyramid levels, and as a full-resolution scan at larger long
+edges. Prints timings and the line counts of both detectors; Hough reports
+several overlapping segments per thick line where the run-length detector
+reports one line.
+"""
+
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from image_pyramid import ImagePyramid, CANONICAL_LEVEL
+from table_structure import table_structure
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
+
+LEVELS = ['low', CANONICAL_LEVEL]
+
+# Full-resolution long edges to benchmark at, in pixels
+LONG_EDGES = [3508, 4032]
+REPEATS = 5
+
+
+def legacy_table_structure(processed, scale=1.0):
+    """The opening + HoughLinesP detector from extract_table_structure() before this change"""
+    img_height, img_width = processed.shape
+    horizontal_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (img_width // 30, 1))
+    vertical_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, img_height // 30))
+    horizontal = cv2.morphologyEx(processed, cv2.MORPH_OPEN, horizontal_kernel)
+    vertical = cv2.morphologyEx(processed, cv2.MORPH_OPEN, vertical_kernel)
+
+    votes = max(1, int(100 * scale))
+    max_gap = max(1, int(20 * scale))
+    horizontal_lines = cv2.HoughLinesP(horizontal, 1, np.pi/180, votes,
+                                       minLineLength=img_width//3, maxLineGap=max_gap)
+    vertical_lines = cv2.HoughLinesP(vertical, 1, np.pi/180, votes,
+                                     minLineLength=img_height//3, maxLineGap=max_gap)
+    return (len(horizontal_lines) if horizontal_lines is not None else 0,
+            len(vertical_lines) if vertical_lines is not None else 0)
+
+
+def best_time(func, *args):
+    """Best wall time of REPEATS calls, in milliseconds"""
+    best = float('inf')
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def bench_mask(name, processed, scale):
+    h, w = processed.shape
+    old_h, old_v = legacy_table_structure(processed, scale)
+    new = table_structure(processed, scale)
+    old_ms = best_time(legacy_table_structure, processed, scale)
+    new_ms = best_time(table_structure, processed, scale)
+    print(f"  {name:<14} ({w}x{h})  legacy {old_ms:8.2f} ms   run-length {new_ms:8.2f} ms   x{old_ms / new_ms:5.1f}"
+          f"   lines {old_h}/{old_v} -> {new['h_lines_count']}/{new['v_lines_count']}, {new['cell_count']} cells")
+
+
+def main():
+    paths = sys.argv[1:]
+    if not paths:
+        paths = [os.path.join(TEMPLATE_DIR, f) for f in sorted(os.listdir(TEMPLATE_DIR))
+                 if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+
+    for path in paths:
+        img = cv2.imread(path)
+        if img is None:
+            print(f"Error: Could not read image: {path}")
+            continue
+        print(os.path.basename(path))
+
+        pyramid = ImagePyramid(img)
+        for level in LEVELS:
+            bench_mask(level, pyramid.context(level).processed, pyramid.factor(CANONICAL_LEVEL, level))
+
+        h, w = img.shape[:2]
+        for long_edge in LONG_EDGES:
+            scale = long_edge / max(h, w)
+            resized = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_CUBIC)
+            scan = ImagePyramid(resized)
+            bench_mask(f"{long_edge}px scan", scan.native.processed, scan.factor(CANONICAL_LEVEL, 'high'))
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+"""
+End-to-end benchmark of the verification pipeline.
+
+Measures /verify, /extract and /generate-pdf (through the Flask test client,
+so no server has to be running) and the scripts/verify_document.py CLI used
+by the Node server, on synthetic marksheets (synthetic_marksheets.py) at
+several resolutions. Reports p50/p95/p99 latency, documents per second and
+peak RSS, and writes the results to JSON so runs can be compared across
+commits.
+
+Usage:
+    python benchmark_pipeline.py [--endpoints verify,extract,generate-pdf,cli]
+                                 [--resolutions scan,a4_300dpi,phone_12mp]
+                                 [--iterations 20] [--output results.json]
+    python benchmark_pipeline.py --compare base.json [new.json] [--threshold 10]
+
+Each endpoint/resolution pair runs in a fresh process, so peak RSS is that
+of one scenario and imports are not shared between scenarios. Latency is per
+request with one client; see load_generator.py for throughput under
+concurrent load. Without a new file, --compare runs the benchmark first.
+"""
+
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+REPO_DIR = os.path.dirname(BASE_DIR)
+CLI_SCRIPT = os.path.join(REPO_DIR, 'scripts', 'verify_document.py')
+CLI_TEMPLATE_DIR = os.path.join(REPO_DIR, 'server', 'uploads', 'templates')
+CLI_FEATURES_DIR = os.path.join(REPO_DIR, 'server', 'data', 'features')
+CLI_TEMPLATE_NAME = 'benchmark_template'
+RESULTS_DIR = os.path.join(BASE_DIR, 'bench_results')
+
+ENDPOINTS = ['verify', 'extract', 'generate-pdf', 'cli']
+DEFAULT_RESOLUTIONS = ['scan', 'a4_300dpi', 'phone_12mp']
+
+# Distinct documents per scenario; requests cycle through them
+DOCUMENTS_PER_SCENARIO = 5
+
+RESULT_MARKER = 'BENCHMARK_RESULT '
+
+
+def peak_rss_mb(children=False):
+    """Peak resident set size of this process (or its finished children) in MB"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # Kilobytes on Linux, bytes on macOS
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(usage.ru_maxrss / divisor, 1)
+
+
+def summarize(latencies):
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'iterations': len(latencies),
+        'p50_ms': round(float(np.percentile(latencies_ms, 50)), 2),
+        'p95_ms': round(float(np.percentile(latencies_ms, 95)), 2),
+        'p99_ms': round(float(np.percentile(latencies_ms, 99)), 2),
+        'mean_ms': round(float(latencies_ms.mean()), 2),
+        'docs_per_second': round(len(latencies) / float(np.sum(latencies)), 3),
+    }
+
+
+def make_documents(resolution, count, seed, out_dir):
+    """Write count synthetic marksheets at resolution; returns [(path, student)]"""
+    from synthetic_marksheets import RESOLUTIONS, random_student, write_marksheet
+
+    rng = random.Random(seed)
+    documents = []
+    for i in range(count):
+        student = random_student(rng)
+        path = write_marksheet(os.path.join(out_dir, f"bench_{resolution}_{i}.jpg"), student, RESOLUTIONS[resolution])
+        documents.append((path, student))
+    return documents
+
+
+def run_http_scenario(endpoint, documents, iterations, warmup):
+    """Time requests to one Flask endpoint; returns per-request latencies in seconds"""
+    import app as service
+
+    client = service.app.test_client()
+    payloads = []
+    for path, student in documents:
+        with open(path, 'rb') as f:
+            data = f.read()
+        payloads.append((os.path.basename(path), data, student))
+
+    def request(i):
+        filename, data, student = payloads[i % len(payloads)]
+        if endpoint == 'generate-pdf':
+            body = {key: value for key, value in student.items() if not isinstance(value, dict)}
+            body['documentHash'] = f"Qm{i:044d}"
+            body['imageSource'] = 'data:image/jpeg;base64,' + base64.b64encode(data).decode('ascii')
+            response = client.post('/generate-pdf', json=body)
+        else:
+            response = client.post(f"/{endpoint}", data={'document': (io.BytesIO(data), filename)},
+                                   content_type='multipart/form-data')
+        # Consume streamed bodies, so the whole response is timed
+        response.get_data()
+        if response.status_code != 200:
+            raise RuntimeError(f"/{endpoint} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+    for i in range(warmup):
+        request(i)
+    latencies = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        request(i)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_cli_scenario(documents, iterations, warmup):
+    """Time scripts/verify_document.py runs, interpreter start-up included"""
+    from synthetic_marksheets import random_student, write_marksheet
+
+    os.makedirs(CLI_TEMPLATE_DIR, exist_ok=True)
+    template_path = os.path.join(CLI_TEMPLATE_DIR, f"{CLI_TEMPLATE_NAME}.jpg")
+    features_path = os.path.join(CLI_FEATURES_DIR, f"{CLI_TEMPLATE_NAME}.json")
+    write_marksheet(template_path, random_student(random.Random(-1), board='SSC'))
+
+    def run(i):
+        path = documents[i % len(documents)][0]
+        result = subprocess.run([sys.executable, CLI_SCRIPT, path, CLI_TEMPLATE_NAME],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"verify_document.py failed: {result.stderr[-500:]}")
+
+    try:
+        # The first run also trains the template features
+        for i in range(max(1, warmup)):
+            run(i)
+        latencies = []
+        for i in range(iterations):
+            start = time.perf_counter()
+            run(i)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+    finally:
+        for path in (template_path, features_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def run_one(endpoint, resolution, iterations, warmup, seed):
+    """Run one scenario in this process and return its result dict"""
+    work_dir = tempfile.mkdtemp(prefix='supercert_bench_')
+    try:
+        documents = make_documents(resolution, min(iterations, DOCUMENTS_PER_SCENARIO), seed, work_dir)
+        if endpoint == 'cli':
+            latencies = run_cli_scenario(documents, iterations, warmup)
+            rss = peak_rss_mb(children=True)
+        else:
+            latencies = run_http_scenario(endpoint, documents, iterations, warmup)
+            rss = peak_rss_mb()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    result = {'name': f"{endpoint}@{resolution}", 'endpoint': endpoint, 'resolution': resolution}
+    result.update(summarize(latencies))
+    result['peak_rss_mb'] = rss
+    return result
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_benchmark(endpoints, resolutions, iterations, cli_iterations, warmup, seed):
+    results = []
+    for endpoint in endpoints:
+        for resolution in resolutions:
+            count = cli_iterations if endpoint == 'cli' else iterations
+            print(f"Running {endpoint}@{resolution} ({count} iterations)...", flush=True)
+            command = [sys.executable, os.path.abspath(__file__), '--run-one', endpoint, resolution,
+                       '--iterations', str(count), '--warmup', str(warmup), '--seed', str(seed)]
+            process = subprocess.run(command, cwd=BASE_DIR, capture_output=True, text=True)
+            lines = [line for line in process.stdout.splitlines() if line.startswith(RESULT_MARKER)]
+            if process.returncode != 0 or not lines:
+                print(f"  failed: {process.stderr.strip()[-500:]}")
+                results.append({'name': f"{endpoint}@{resolution}", 'endpoint': endpoint,
+                                 'resolution': resolution, 'error': process.stderr.strip()[-500:]})
+                continue
+            result = json.loads(lines[-1][len(RESULT_MARKER):])
+            print(f"  p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, p99 {result['p99_ms']} ms, "
+                  f"{result['docs_per_second']} docs/s, peak RSS {result['peak_rss_mb']} MB")
+            results.append(result)
+
+    return {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'iterations': iterations,
+        'seed': seed,
+        'results': results,
+    }
+
+
+def compare(base, new, threshold):
+    """Print the change of every scenario; returns the names of regressed scenarios"""
+    base_results = {r['name']: r for r in base['results'] if 'error' not in r}
+    print(f"Comparing {base['commit']} -> {new['commit']} (regression threshold {threshold}%)")
+    print(f"{'scenario':<28}{'p50 ms':>18}{'p95 ms':>18}{'docs/s':>18}{'RSS MB':>16}")
+
+    def change(old, value, higher_is_worse=True):
+        if old is None or value is None or not old:
+            return f"{value}", False
+        pct = (value - old) / old * 100
+        worse = pct > threshold if higher_is_worse else pct < -threshold
+        return f"{value} ({pct:+.0f}%){'!' if worse else ''}", worse
+
+    regressions = []
+    for result in new['results']:
+        old = base_results.get(result['name'])
+        if 'error' in result or old is None:
+            print(f"{result['name']:<28}{'(no comparison)':>18}")
+            continue
+        p50, _ = change(old['p50_ms'], result['p50_ms'])
+        p95, p95_worse = change(old['p95_ms'], result['p95_ms'])
+        rate, rate_worse = change(old['docs_per_second'], result['docs_per_second'], higher_is_worse=False)
+        rss, _ = change(old.get('peak_rss_mb'), result.get('peak_rss_mb'))
+        print(f"{result['name']:<28}{p50:>18}{p95:>18}{rate:>18}{rss:>16}")
+        if p95_worse or rate_worse:
+            regressions.append(result['name'])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the verification pipeline.')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS),
+                        help=f"comma separated, from {', '.join(ENDPOINTS)}")
+    parser.add_argument('--resolutions', default=','.join(DEFAULT_RESOLUTIONS),
+                        help='comma separated names from synthetic_marksheets.RESOLUTIONS')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--cli-iterations', type=int, default=5, help='iterations for the CLI, which is slower')
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='results file (default bench_results/<commit>.json)')
+    parser.add_argument('--compare', nargs='+', metavar='JSON',
+                        help='compare a new run (or a second results file) against this results file')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='percent change of p95 or docs/s counted as a regression')
+    parser.add_argument('--run-one', nargs=2, metavar=('ENDPOINT', 'RESOLUTION'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        result = run_one(args.run_one[0], args.run_one[1], args.iterations, args.warmup, args.seed)
+        print(RESULT_MARKER + json.dumps(result))
+        return
+
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[0]) as f:
+            base = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+    else:
+        from synthetic_marksheets import RESOLUTIONS
+        endpoints = [e.strip() for e in args.endpoints.split(',') if e.strip()]
+        resolutions = [r.strip() for r in args.resolutions.split(',') if r.strip()]
+        for name in endpoints:
+            if name not in ENDPOINTS:
+                parser.error(f"unknown endpoint {name}")
+        for name in resolutions:
+            if name not in RESOLUTIONS:
+                parser.error(f"unknown resolution {name}")
+
+        new = run_benchmark(endpoints, resolutions, args.iterations, args.cli_iterations, args.warmup, args.seed)
+        output = args.output or os.path.join(RESULTS_DIR, f"{new['commit']}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(new, f, indent=2)
+        print(f"Results written to {output}")
+
+        if not args.compare:
+            return
+        with open(args.compare[0]) as f:
+            base = json.load(f)
+
+    regressions = compare(base, new, args.threshold)
+    if regressions:
+        print(f"Regressions: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,366 @@
+"""
+Low-resolution document-type classifier, run before OCR.
+
+Whether an upload is an HSC or SSC marksheet used to be decided from its OCR
+text, so every document was OCR'd (and registered against every template)
+before the candidate templates could be narrowed down. The page layout and
+paper colour already tell them apart at thumbnail size:
+
+- each document is reduced to a THUMBNAIL_SIZE grayscale/HSV thumbnail,
+  taken from the low pyramid level when a pyramid is at hand;
+- its feature vector is a HOG descriptor of the grayscale thumbnail (page
+  layout: table rules, header block, photo box) and an HSV hue/saturation
+  histogram (paper colour), each L2-normalized;
+- a k-nearest-neighbour model over the template images, plus distorted
+  phone-photo style copies of each (synthetic_marksheets.distort), predicts
+  board, document type and colour variant with a confidence per label.
+
+Labels come from templates/document_classes.json (per template image, with
+a 'default' entry, like seal_regions.json); what is not declared there is
+inferred: the document type from the file name, the colour variant from the
+template's mean colour with copy_template.py's rule (beige when every BGR
+channel averages above 180, pink otherwise).
+
+A prediction only counts as confident if the nearest training sample is no
+further away than MAX_DISTANCE_FACTOR times the largest nearest-neighbour
+distance seen between training samples, so documents unlike every template
+are not routed anywhere.
+
+Train with python doc_classifier.py [template_dir] (train_templates.py does
+it after training the templates). The model is a .npz next to the templates,
+loaded once and reloaded when the file changes.
+"""
+
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from image_pyramid import ImagePyramid
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
+
+MODEL_PATH = os.getenv('DOC_CLASSIFIER_PATH', os.path.join(TEMPLATE_DIR, 'document_classifier.npz'))
+CLASSES_FILE = 'document_classes.json'
+
+# Thumbnail (width, height): portrait A4-ish, 256 px on the long edge
+THUMBNAIL_SIZE = (192, 256)
+
+# HOG over the whole thumbnail: 32 px cells, 9 unsigned orientation bins,
+# blocks of 2x2 cells moved one cell at a time
+HOG_CELL = 32
+HOG_BINS = 9
+
+# Hue x saturation histogram bins
+COLOR_BINS = (16, 8)
+
+# Neighbours voting on each label
+K = int(os.getenv('DOC_CLASSIFIER_K', '3'))
+
+# Distorted copies of each template added to the training set
+AUGMENTATIONS = int(os.getenv('DOC_CLASSIFIER_AUGMENTATIONS', '8'))
+
+# Minimum vote share of the predicted document type to route on it
+MIN_CONFIDENCE = float(os.getenv('DOC_CLASSIFIER_MIN_CONFIDENCE', '0.6'))
+
+# Confident only within this factor of the training set's nearest-neighbour distances
+MAX_DISTANCE_FACTOR = 1.5
+
+_CELLS = (THUMBNAIL_SIZE[1] // HOG_CELL, THUMBNAIL_SIZE[0] // HOG_CELL)
+FEATURE_LENGTH = (_CELLS[0] - 1) * (_CELLS[1] - 1) * 4 * HOG_BINS + COLOR_BINS[0] * COLOR_BINS[1]
+
+LABELS = ('board', 'document_type', 'color')
+
+MODEL_VERSION = 1
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def _thumbnail(image):
+    """THUMBNAIL_SIZE BGR thumbnail of an image or ImagePyramid"""
+    if isinstance(image, ImagePyramid):
+        image = image.context('low').bgr
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    return cv2.resize(image, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+
+
+def _l2(vector):
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm > 0 else vector
+
+
+def hog(gray):
+    """
+    HOG descriptor of a THUMBNAIL_SIZE grayscale image (Dalal-Triggs layout,
+    L2-Hys block normalization, no interpolation between bins). Computed
+    here because cv2.HOGDescriptor is not in every OpenCV build.
+    """
+    gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=1)
+    gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=1)
+    magnitude, angle = cv2.cartToPolar(gx, gy, angleInDegrees=True)
+    bins = (angle % 180.0 * (HOG_BINS / 180.0)).astype(np.int32) % HOG_BINS
+
+    rows, cols = _CELLS
+    ys, xs = np.indices(gray.shape)
+    cell = (ys // HOG_CELL) * cols + xs // HOG_CELL
+    cells = np.bincount((cell * HOG_BINS + bins).ravel(), weights=magnitude.ravel(),
+                        minlength=rows * cols * HOG_BINS).reshape(rows, cols, HOG_BINS)
+
+    blocks = np.concatenate([cells[:-1, :-1], cells[:-1, 1:], cells[1:, :-1], cells[1:, 1:]], axis=2)
+    blocks = blocks.reshape(-1, 4 * HOG_BINS)
+    blocks /= np.linalg.norm(blocks, axis=1, keepdims=True) + 1e-6
+    blocks = np.minimum(blocks, 0.2)
+    blocks /= np.linalg.norm(blocks, axis=1, keepdims=True) + 1e-6
+    return blocks.ravel()
+
+
+def thumbnail_features(image):
+    """Feature vector (float32) of an image or ImagePyramid: HOG + hue/saturation histogram"""
+    thumb = _thumbnail(image)
+    gray = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+    layout = hog(gray)
+
+    hsv = cv2.cvtColor(thumb, cv2.COLOR_BGR2HSV)
+    color = cv2.calcHist([hsv], [0, 1], None, list(COLOR_BINS), [0, 180, 0, 256]).ravel()
+    # Square root of the normalized histogram: Hellinger distance under L2
+    color = np.sqrt(color / max(float(color.sum()), 1.0))
+
+    return np.concatenate([_l2(layout), _l2(color)]).astype(np.float32)
+
+
+def color_variant(image):
+    """'beige' or 'pink', by copy_template.py's mean colour rule"""
+    mean = image.reshape(-1, image.shape[-1]).mean(axis=0)
+    return 'beige' if all(channel > 180 for channel in mean[:3]) else 'pink'
+
+
+def load_classes(template_dir):
+    """Declared labels by template filename, with a 'default' entry"""
+    try:
+        with open(os.path.join(template_dir, CLASSES_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def template_labels(filename, image, classes):
+    """{label: value} of a template image: declared, else inferred"""
+    declared = {**classes.get('default', {}), **classes.get(filename, {})}
+    name = filename.lower()
+    inferred = {
+        'board': 'maharashtra',
+        'document_type': 'hsc' if 'hsc' in name else 'ssc' if 'ssc' in name else 'unknown',
+        'color': color_variant(image),
+    }
+    return {label: declared.get(label, inferred[label]) for label in LABELS}
+
+
+def _augmented(image, rng, count):
+    """count phone-photo style copies of a template image (BGR)"""
+    from PIL import Image
+    from synthetic_marksheets import distort
+
+    # Distort at the low level's size: the thumbnail is all that is kept
+    pyramid = ImagePyramid(image)
+    page = Image.fromarray(cv2.cvtColor(pyramid.context('low').bgr, cv2.COLOR_BGR2RGB))
+    for _ in range(count):
+        jpeg, _ = distort(page, rng)
+        yield cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+
+
+class DocumentClassifier:
+    """k-nearest-neighbour model over thumbnail features of labelled samples"""
+
+    def __init__(self, features, templates, labels, max_distance, signature=None):
+        self.features = features
+        self.templates = templates
+        self.labels = labels  # {label: array of values, one per sample}
+        self.max_distance = max_distance
+        self.signature = signature
+
+    def __len__(self):
+        return len(self.features)
+
+    def neighbours(self, vector, k=K):
+        """(indices, distances) of the k nearest samples, nearest first"""
+        distances = np.linalg.norm(self.features - vector, axis=1)
+        k = min(k, len(distances))
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest])]
+        return nearest, distances[nearest]
+
+    def predict(self, vector):
+        """Distance-weighted vote of the nearest samples on every label"""
+        nearest, distances = self.neighbours(vector)
+        weights = 1.0 / (distances + 1e-6)
+        prediction = {}
+        confidences = {}
+        for label in LABELS:
+            votes = {}
+            for index, weight in zip(nearest, weights):
+                value = str(self.labels[label][index])
+                votes[value] = votes.get(value, 0.0) + weight
+            value = max(votes, key=votes.get)
+            prediction[label] = value
+            confidences[label] = round(float(votes[value] / weights.sum()), 3)
+
+        distance = float(distances[0])
+        prediction['template'] = str(self.templates[nearest[0]])
+        prediction['confidence'] = confidences
+        prediction['distance'] = round(distance, 4)
+        prediction['confident'] = bool(confidences['document_type'] >= MIN_CONFIDENCE
+                                       and distance <= self.max_distance)
+        return prediction
+
+    def classify(self, image):
+        """predict() of an image or ImagePyramid, with the time it took"""
+        start = time.perf_counter()
+        prediction = self.predict(thumbnail_features(image))
+        prediction['ms'] = round((time.perf_counter() - start) * 1000, 2)
+        return prediction
+
+    def save(self, path):
+        """Write the model as .npz, atomically"""
+        arrays = {f'label_{label}': np.asarray(values, dtype=str) for label, values in self.labels.items()}
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.part',
+                                        dir=os.path.dirname(path) or '.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, version=np.int32(MODEL_VERSION), features=self.features,
+                                    templates=np.asarray(self.templates, dtype=str),
+                                    max_distance=np.float32(self.max_distance),
+                                    thumbnail=np.int32(THUMBNAIL_SIZE), **arrays)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """A saved model, or None if it is missing or was saved with other features"""
+        try:
+            signature = _signature(path)
+            with np.load(path, allow_pickle=False) as data:
+                if int(data['version']) != MODEL_VERSION or tuple(data['thumbnail']) != THUMBNAIL_SIZE:
+                    logger.warning(f"Document classifier {path} is outdated, retrain it")
+                    return None
+                features = data['features']
+                if features.ndim != 2 or features.shape[1] != FEATURE_LENGTH:
+                    logger.warning(f"Document classifier {path} has {features.shape[-1]} features, "
+                                   f"expected {FEATURE_LENGTH}")
+                    return None
+                labels = {label: data[f'label_{label}'] for label in LABELS}
+                return cls(features, data['templates'], labels, float(data['max_distance']), signature)
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning(f"Could not load document classifier {path}: {str(e)}")
+            return None
+
+
+def train(template_dir=TEMPLATE_DIR, augmentations=AUGMENTATIONS, seed=0):
+    """DocumentClassifier trained on the template images of a directory (None if there are none)"""
+    classes = load_classes(template_dir)
+    rng = random.Random(seed)
+    features, templates, labels = [], [], {label: [] for label in LABELS}
+
+    for filename in sorted(os.listdir(template_dir)):
+        if not filename.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        image = cv2.imread(os.path.join(template_dir, filename))
+        if image is None:
+            logger.error(f"Could not read template image {filename}")
+            continue
+        values = template_labels(filename, image, classes)
+        for sample in [image, *_augmented(image, rng, augmentations)]:
+            features.append(thumbnail_features(sample))
+            templates.append(filename)
+            for label in LABELS:
+                labels[label].append(values[label])
+
+    if not features:
+        return None
+    features = np.stack(features)
+
+    # Nearest other sample of each sample: how far apart genuine templates and photos of them get
+    distances = np.linalg.norm(features[:, None, :] - features[None, :, :], axis=2)
+    np.fill_diagonal(distances, np.inf)
+    max_distance = float(distances.min(axis=1).max()) * MAX_DISTANCE_FACTOR
+
+    return DocumentClassifier(features, templates, {label: np.asarray(values) for label, values in labels.items()},
+                              max_distance)
+
+
+def _signature(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+_model = None
+# (path, signature) of a model file that could not be loaded, so it is not
+# reopened on every request until it changes
+_failed = None
+_model_lock = threading.Lock()
+
+
+def classifier(path=MODEL_PATH):
+    """
+    The saved DocumentClassifier, reloaded when the file changes; None if
+    there is none or it cannot be loaded (e.g. outdated)
+    """
+    global _model, _failed
+    try:
+        signature = _signature(path)
+    except OSError:
+        return None
+    with _model_lock:
+        if _model is not None and _model.signature == signature:
+            return _model
+        if _failed == (path, signature):
+            return None
+        _model = DocumentClassifier.load(path)
+        if _model is None:
+            _failed = (path, signature)
+        else:
+            _failed = None
+            logger.info(f"Loaded document classifier with {len(_model)} samples from {path}")
+        return _model
+
+
+def classify(image, path=MODEL_PATH):
+    """
+    Board, document type and colour variant of an image or ImagePyramid, as
+    a dict with per-label confidences; None if no model has been trained
+    """
+    model = classifier(path)
+    if model is None:
+        return None
+    return model.classify(image)
+
+
+def train_and_save(template_dir=TEMPLATE_DIR, path=None, augmentations=AUGMENTATIONS):
+    """Train on template_dir and save the model; returns it (None if there were no templates)"""
+    start = time.perf_counter()
+    model = train(template_dir, augmentations)
+    if model is None:
+        print(f"No template images in {template_dir}, document classifier not trained")
+        return None
+    path = path or os.path.join(template_dir, os.path.basename(MODEL_PATH))
+    model.save(path)
+    print(f"Document classifier: {len(model)} samples from {len(set(model.templates))} templates "
+          f"saved to {path} in {time.perf_counter() - start:.2f}s")
+    return model
+
+
+if __name__ == '__main__':
+    train_and_save(sys.argv[1] if len(sys.argv) > 1 else TEMPLATE_DIR)
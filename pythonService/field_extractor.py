@@ -0,0 +1,158 @@
+"""
+Single-pass field extraction from OCR text.
+
+Student data used to be pulled out of OCR text by one uncompiled
+re.findall() scan per field. A FieldSchema compiles the fields of a template
+into one regular expression instead, one alternative per field, each with
+its value in a named group:
+
+- a field is an anchor (the printed label, e.g. "seat no"), a separator and
+  the value pattern; anchors and separators may not capture;
+- only the anchor and separator are consumed, the value is read in a
+  lookahead, so a greedy value cannot swallow the label of the next field
+  and one finditer() pass sees every field in text order;
+- a validator cleans and types each candidate value; a rejected value does
+  not stop the scan, the field's next occurrence is tried instead.
+
+Anchors are written in lower case and matched case-sensitively against the
+lower-cased text, values case-insensitively: an alternation of literal
+anchors lets the regex engine skip through the text, where a fully
+case-insensitive pattern tries every field at every position. Values are
+read from the original text.
+
+The first valid occurrence of each field is kept, with the field's
+confidence and its position in the text. extract_many() lower-cases many
+texts in one go, joined by a separator no field pattern can match, and scans
+each of them in place.
+"""
+
+import re
+from collections import namedtuple
+from datetime import datetime
+
+# Joins texts for bulk extraction; no field pattern may match it
+TEXT_SEPARATOR = '\x00'
+
+ExtractedField = namedtuple('ExtractedField', ['name', 'value', 'confidence', 'start', 'end'])
+
+
+class Field:
+    """
+    One field of a schema: anchor (lower case) + separator + value, as regex
+    sources. validator maps the matched value to a typed value, or None to
+    reject it.
+    """
+
+    def __init__(self, name, anchor, value, separator=r'[:\s]+', validator=None, confidence=0.8):
+        self.name = name
+        self.pattern = f'(?:{anchor}){separator}(?=(?P<{name}>(?i:{value})))'
+        self.validator = validator or _text
+        self.confidence = confidence
+        if re.compile(self.pattern).groups != 1:
+            raise ValueError(f"Field {name}: only the value may be a capturing group")
+
+
+class FieldSchema:
+    """Fields of one template, compiled into one regular expression"""
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = {field.name: field for field in fields}
+        alternatives = '|'.join(field.pattern for field in fields)
+        self.regex = re.compile(alternatives)
+        # For texts whose lower case changes length (a few non-ASCII letters)
+        self.regex_ignorecase = re.compile(alternatives, re.IGNORECASE)
+
+    def _scan(self, text, lowered, start, end):
+        """First valid occurrence of each field in text[start:end]: {name: ExtractedField}"""
+        if lowered is not None:
+            matches = self.regex.finditer(lowered, start, end)
+        else:
+            # Lower case changed the length (a few non-ASCII letters)
+            matches = self.regex_ignorecase.finditer(text, start, end)
+
+        found = {}
+        fields = self.fields
+        for match in matches:
+            name = match.lastgroup
+            if name in found:
+                continue
+            field = fields[name]
+            value_start, value_end = match.span(name)
+            value = field.validator(text[value_start:value_end])
+            if value is None:
+                continue
+            found[name] = ExtractedField(name, value, field.confidence, value_start - start, value_end - start)
+            if len(found) == len(fields):
+                break
+        return found
+
+    @staticmethod
+    def _lowered(text):
+        lowered = text.lower()
+        return lowered if len(lowered) == len(text) else None
+
+    def extract(self, text):
+        """{name: ExtractedField} of the fields found in text"""
+        text = text or ''
+        return self._scan(text, self._lowered(text), 0, len(text))
+
+    def extract_many(self, texts):
+        """
+        extract() of many texts: lower-cased together, then scanned text by
+        text (each scan stops once all fields are found)
+        """
+        texts = [(text or '').replace(TEXT_SEPARATOR, ' ') for text in texts]
+        joined = TEXT_SEPARATOR.join(texts)
+        lowered = self._lowered(joined)
+        results = []
+        start = 0
+        for text in texts:
+            results.append(self._scan(joined, lowered, start, start + len(text)))
+            start += len(text) + 1
+        return results
+
+
+def _text(raw):
+    """Whitespace-collapsed text with at least two letters"""
+    value = ' '.join(raw.split()).strip(' .')
+    return value if sum(ch.isalpha() for ch in value) >= 2 else None
+
+
+def _identifier(raw):
+    """Seat/roll numbers: upper case, at least one digit"""
+    value = raw.strip().upper()
+    return value if any(ch.isdigit() for ch in value) else None
+
+
+def _number(raw):
+    raw = raw.strip()
+    return int(raw) if raw.isdigit() else None
+
+
+def _year(raw):
+    """Plausible exam years only"""
+    value = _number(raw)
+    return value if value is not None and 1950 <= value <= datetime.now().year + 1 else None
+
+
+# Student data printed on marksheets and certificates. Values stay on the
+# line of their label; "(SURNAME FIRST)"-style hints after a label are skipped
+STUDENT_FIELDS = FieldSchema('student', [
+    Field('studentName', r'\bname\b(?:[ \t]*\([^)\n]*\))?', r'[A-Z][A-Z .]*', confidence=0.7),
+    Field('rollNumber', r'\b(?:roll|seat|registration)[\s.:]*(?:no|number)\b', r'[A-Z0-9]+',
+          separator=r'[\s.:#]*', validator=_identifier, confidence=0.9),
+    Field('board', r'\b(?:board|university)\b', r'[A-Z][A-Z .]*'),
+    Field('batch', r'\b(?:year|batch|session)\b', r'[0-9]+', validator=_number),
+    Field('examYear', r'\b(?:exam(?:ination)?|statement of marks)\b', r'(?:19|20)[0-9]{2}',
+          separator=r'[\s,:-]*(?:[a-z]+[\s,-]*)?', validator=_year, confidence=0.85),
+])
+
+# Field schemas by template name; templates without their own use 'default'
+SCHEMAS = {
+    'default': STUDENT_FIELDS,
+}
+
+
+def schema_for(template_name=None):
+    return SCHEMAS.get(template_name) or SCHEMAS['default']
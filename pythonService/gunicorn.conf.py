@@ -0,0 +1,72 @@
+"""
+Gunicorn configuration for the document verification service.
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+Every setting can be overridden from the environment; see the
+"Production deployment" section of README.md for recommended values per
+core count.
+"""
+
+import multiprocessing
+import os
+
+# Listening address
+bind = os.getenv('GUNICORN_BIND', f"0.0.0.0:{os.getenv('PORT', '5000')}")
+
+# Verification is CPU bound (OpenCV, tesseract subprocesses), so one worker
+# process per core; a few threads per worker cover the I/O bound
+# routes (IPFS upload, email, PDF streaming) without extra processes.
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+worker_class = 'gthread'
+
+# The admission gates (admission.py) size their per-process limits from
+# these, so the app must see the values gunicorn actually uses
+os.environ['WEB_CONCURRENCY'] = str(workers)
+os.environ['GUNICORN_THREADS'] = str(threads)
+
+# Import the app (and load templates) once in the master, then fork
+preload_app = True
+
+# OCR on a large upload can take a while
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+
+# Time given to in-flight requests after SIGTERM before workers are killed
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+# Recycle workers now and then to bound memory growth from large images
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '100'))
+
+# Worker heartbeat files on tmpfs, so a slow disk cannot stall workers
+worker_tmp_dir = os.getenv('GUNICORN_WORKER_TMP_DIR', '/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    # Threads do not survive fork: restart the template watcher and job
+    # workers in the worker
+    from app import template_registry, start_job_workers
+    template_registry.start()
+    start_job_workers()
+
+
+def post_worker_init(worker):
+    # Runs before the worker starts accepting connections
+    from wsgi import warm_up
+    seconds = warm_up()
+    worker.log.info(f"Worker {worker.pid} warmed up in {seconds:.2f}s")
+
+
+def worker_exit(server, worker):
+    # Let background work of this worker finish before it exits
+    from app import template_registry, job_workers
+    from pdf_output import flush_pending_writes
+    template_registry.stop()
+    job_workers.stop(timeout=graceful_timeout)
+    flush_pending_writes()
@@ -0,0 +1,231 @@
+"""
+Reduced-resolution image decoding.
+
+Uploads used to be decoded with cv2.imread at full colour resolution, often
+12-48 megapixels from a phone, only to be resized straight away to an 877 px
+pyramid level, a 600x800 comparison image or a classifier thumbnail. JPEG
+can be decoded at 1/2, 1/4 or 1/8 scale directly in the DCT domain, which is
+several times faster and never allocates the full-size image:
+
+- image_info() reads the image header only: size (after EXIF orientation)
+  and format;
+- decode() decodes at the largest DCT reduction that still gives at least the
+  requested long edge, in colour or straight to grayscale
+  (cv2.IMREAD_REDUCED_*; other formats are decoded in full and resized by
+  OpenCV);
+- DecodedPyramid is an ImagePyramid of a file: each level is decoded at its
+  own reduction the first time it is used, and the full-resolution image
+  only when something needs the native pixels, such as OCR at the high level.
+
+No image is decoded to more than MAX_DECODE_PIXELS pixels: larger JPEGs are
+decoded at the reduction that fits (that is their native image), other
+formats are refused.
+
+cv2.IMREAD_REDUCED_* applies EXIF orientation like cv2.imread does, so the
+images match the ones decoded before. Formats the installed OpenCV cannot
+read (GIF before OpenCV 4.10) are decoded with PIL instead.
+"""
+
+import logging
+import os
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from image_pyramid import ImagePyramid, LEVEL_LONG_EDGES
+from preprocess_context import DocumentContext
+
+logger = logging.getLogger(__name__)
+
+# DCT scaling factors JPEG decoders support, largest first
+REDUCTIONS = (8, 4, 2)
+
+# PIL formats decoded as JPEG: MPO is what PIL calls the multi-picture
+# JPEGs many phone cameras write (a JPEG with more images appended)
+JPEG_FORMATS = frozenset({'JPEG', 'MPO'})
+
+# Largest image decoded, in pixels; larger JPEGs are decoded reduced to fit,
+# other formats not at all (ingest_guard.py rejects them on upload)
+MAX_DECODE_PIXELS = int(os.getenv('MAX_DECODE_PIXELS', '50000000'))
+
+_REDUCED_FLAGS = {
+    (2, False): cv2.IMREAD_REDUCED_COLOR_2,
+    (4, False): cv2.IMREAD_REDUCED_COLOR_4,
+    (8, False): cv2.IMREAD_REDUCED_COLOR_8,
+    (2, True): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    (4, True): cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    (8, True): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+# EXIF orientations that swap width and height (rotations by 90 degrees)
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+ImageInfo = namedtuple('ImageInfo', ['width', 'height', 'format'])
+
+
+def image_info(path):
+    """ImageInfo of an image file from its header, or None if it is not a readable image"""
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+            orientation = image.getexif().get(0x0112) if image.format in JPEG_FORMATS | {'TIFF', 'WEBP'} else None
+            fmt = image.format
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning(f"Could not read image header of {path}: {str(e)}")
+        return None
+    if orientation in _TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+    return ImageInfo(width, height, fmt)
+
+
+def budget_reduction(info):
+    """
+    Smallest reduction that decodes an image within MAX_DECODE_PIXELS, or
+    None if it cannot be (too large, and not a JPEG or too large even at 1/8)
+    """
+    pixels = info.width * info.height
+    if pixels <= MAX_DECODE_PIXELS:
+        return 1
+    if info.format in JPEG_FORMATS:
+        for factor in reversed(REDUCTIONS):
+            if pixels // (factor * factor) <= MAX_DECODE_PIXELS:
+                return factor
+    return None
+
+
+def reduction_for(info, long_edge):
+    """
+    Largest DCT reduction keeping the long edge at or above long_edge (1: full
+    decode), but at least the reduction that keeps within MAX_DECODE_PIXELS
+    """
+    if info is None or info.format not in JPEG_FORMATS:
+        return 1
+    least = budget_reduction(info) or REDUCTIONS[0]
+    if long_edge is None:
+        return least
+    native = max(info.width, info.height)
+    for factor in REDUCTIONS:
+        if factor >= least and native // factor >= long_edge:
+            return factor
+    return least
+
+
+def _imread(path, flags, gray=False):
+    """cv2.imread, falling back to PIL (first frame) for formats OpenCV was built without"""
+    image = cv2.imread(path, flags)
+    if image is not None:
+        return image
+    try:
+        with Image.open(path) as pil_image:
+            if gray:
+                return np.asarray(pil_image.convert('L'))
+            return cv2.cvtColor(np.asarray(pil_image.convert('RGB')), cv2.COLOR_RGB2BGR)
+    except (OSError, ValueError):
+        return None
+
+
+def decode(path, long_edge=None, gray=False, info=None):
+    """
+    Decode an image file with at least long_edge pixels on its long edge
+    (all of them if None, within MAX_DECODE_PIXELS), as BGR or grayscale.
+    Returns None if it cannot be decoded, or not within MAX_DECODE_PIXELS.
+    """
+    info = info or image_info(path)
+    if info is None:
+        return None
+    if budget_reduction(info) is None:
+        logger.warning(f"Not decoding {path}: {info.width}x{info.height} is over {MAX_DECODE_PIXELS} pixels")
+        return None
+    factor = reduction_for(info, long_edge)
+    if factor > 1:
+        return cv2.imread(path, _REDUCED_FLAGS[(factor, gray)])
+    return _imread(path, cv2.IMREAD_GRAYSCALE if gray else cv2.IMREAD_COLOR, gray)
+
+
+class DecodedPyramid(ImagePyramid):
+    """
+    ImagePyramid of an image file whose levels are decoded at reduced
+    resolution on first use; the native image is decoded only on demand.
+    decodes lists (reduction, milliseconds) of every decode.
+    """
+
+    def __init__(self, path, info, long_edges=None):
+        self.path = path
+        self.info = info
+        # The native image is the largest decode within MAX_DECODE_PIXELS
+        self.native_reduction = budget_reduction(info) or REDUCTIONS[0]
+        self.long_edges = dict(long_edges or LEVEL_LONG_EDGES)
+        self._levels = {}
+        self._native = None
+        self.timings = {}
+        self.decodes = []
+
+    def _decode(self, factor):
+        if budget_reduction(self.info) is None:
+            raise ValueError(f"{self.path} is over {MAX_DECODE_PIXELS} pixels")
+        start = time.perf_counter()
+        if factor > 1:
+            image = cv2.imread(self.path, _REDUCED_FLAGS[(factor, False)])
+        else:
+            image = _imread(self.path, cv2.IMREAD_COLOR)
+        self.decodes.append((factor, round((time.perf_counter() - start) * 1000, 2)))
+        if image is None:
+            raise ValueError(f"Could not decode image {self.path}")
+        return image
+
+    @property
+    def native(self):
+        if self._native is None:
+            self._native = DocumentContext(self._decode(self.native_reduction))
+        return self._native
+
+    @property
+    def native_shape(self):
+        # JPEG reduction rounds sizes up
+        f = self.native_reduction
+        return -(-self.info.height // f), -(-self.info.width // f)
+
+    def _reduction(self, level):
+        return reduction_for(self.info, self.long_edges[level])
+
+    def context(self, level):
+        if level not in self._levels and self._native is None and abs(self.scale(level) - 1.0) >= 1e-3:
+            factor = self._reduction(level)
+            if factor > 1:
+                image = self._decode(factor)
+                start = time.perf_counter()
+                h, w = self.level_shape(level)
+                if image.shape[:2] != (h, w):
+                    image = cv2.resize(image, (w, h), interpolation=cv2.INTER_AREA)
+                self._levels[level] = DocumentContext(image)
+                self._level_timings(level)['resize_ms'] += (time.perf_counter() - start) * 1000
+        return super().context(level)
+
+    def crop(self, level, box):
+        # A reduced decode of the whole level is cheaper than the native image
+        if level not in self._levels and self._native is None and self._reduction(level) > 1:
+            self.context(level)
+        return super().crop(level, box)
+
+    def summary(self):
+        return {**super().summary(), 'decodes': [{'reduction': f, 'ms': ms} for f, ms in self.decodes]}
+
+
+def open_pyramid(path, level='low', long_edges=None):
+    """
+    DecodedPyramid of an image file, with one level decoded up front to check
+    the file; None if it is not a decodable image
+    """
+    info = image_info(path)
+    if info is None:
+        return None
+    pyramid = DecodedPyramid(path, info, long_edges)
+    try:
+        pyramid.context(level)
+    except (ValueError, cv2.error) as e:
+        logger.warning(f"Could not decode {path}: {str(e)}")
+        return None
+    return pyramid
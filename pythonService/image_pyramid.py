@@ -0,0 +1,172 @@
+"""
+Resolution-normalized image pyramid for document feature extraction.
+
+Phone photos of marksheets arrive anywhere between ~1 and 48 megapixels,
+while the extractors use kernels, radii and gaps sized in pixels. Every
+document is therefore resampled to a few fixed long edges (named levels,
+roughly an A4 page at a given DPI) and each extractor declares the level it
+runs at:
+
+- high:      OCR, where small glyphs need the pixels (never upscaled)
+- canonical: thresholds, contours and density features
+- low:       Hough transforms and other global structure
+
+Coordinates reported by extractors are mapped back to the canonical level,
+so stored template features do not depend on the camera that took them.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+from preprocess_context import DocumentContext
+
+# Long edge of each level, in pixels (A4 at 300, 150 and 75 DPI)
+LEVEL_LONG_EDGES = {
+    'high': int(os.getenv('PYRAMID_HIGH_LONG_EDGE', '3508')),
+    'canonical': int(os.getenv('PYRAMID_CANONICAL_LONG_EDGE', '1754')),
+    'low': int(os.getenv('PYRAMID_LOW_LONG_EDGE', '877')),
+}
+
+# Levels that are never upscaled beyond the native image
+NO_UPSCALE_LEVELS = {'high'}
+
+CANONICAL_LEVEL = 'canonical'
+
+
+def pyramid_level(level, scaled=False):
+    """
+    Decorator declaring the pyramid level an extractor runs at. Extractors
+    with pixel-sized parameters set scaled=True and receive a scale keyword:
+    pixels at their level per pixel at the canonical level.
+    """
+    if level not in LEVEL_LONG_EDGES:
+        raise ValueError(f"Unknown pyramid level: {level}")
+
+    def decorate(func):
+        func.pyramid_level = level
+        func.pyramid_scaled = scaled
+        return func
+    return decorate
+
+
+def level_of(extractor, default=CANONICAL_LEVEL):
+    """The pyramid level declared by an extractor"""
+    return getattr(extractor, 'pyramid_level', default)
+
+
+class ImagePyramid:
+    """
+    Lazily resampled levels of one document, each wrapped in its own
+    DocumentContext, with per-level resize and extractor timings.
+    """
+
+    def __init__(self, image, long_edges=None):
+        self.native = DocumentContext(image)
+        self.long_edges = dict(long_edges or LEVEL_LONG_EDGES)
+        self._levels = {}
+        self.timings = {}
+
+    @property
+    def native_shape(self):
+        return self.native.shape
+
+    def _level_timings(self, level):
+        return self.timings.setdefault(level, {'resize_ms': 0.0, 'extractors': {}})
+
+    def scale(self, level):
+        """Resampling factor from the native image to a level"""
+        h, w = self.native_shape
+        scale = self.long_edges[level] / float(max(h, w))
+        if level in NO_UPSCALE_LEVELS:
+            scale = min(scale, 1.0)
+        return scale
+
+    def level_shape(self, level):
+        """(height, width) of a level, without building it"""
+        scale = self.scale(level)
+        h, w = self.native_shape
+        return max(1, int(round(h * scale))), max(1, int(round(w * scale)))
+
+    def context(self, level):
+        """DocumentContext of the image resampled to a level"""
+        if level not in self._levels:
+            scale = self.scale(level)
+            if abs(scale - 1.0) < 1e-3:
+                self._levels[level] = self.native
+            else:
+                start = time.perf_counter()
+                h, w = self.level_shape(level)
+                size = (w, h)
+                interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+                resized = cv2.resize(self.native.image, size, interpolation=interpolation)
+                self._levels[level] = DocumentContext(resized)
+                self._level_timings(level)['resize_ms'] += (time.perf_counter() - start) * 1000
+        return self._levels[level]
+
+    def crop(self, level, box):
+        """
+        Grayscale crop (x0, y0, x1, y1) of a level. Levels that have not been
+        built are not built for it: the matching window of the native image
+        is resampled instead.
+        """
+        x0, y0, x1, y1 = box
+        if level in self._levels or abs(self.scale(level) - 1.0) < 1e-3:
+            return self.context(level).gray[y0:y1, x0:x1]
+        scale = self.scale(level)
+        h, w = self.native_shape
+        nx0, ny0 = max(0, int(x0 / scale)), max(0, int(y0 / scale))
+        nx1, ny1 = min(w, int(np.ceil(x1 / scale))), min(h, int(np.ceil(y1 / scale)))
+        window = self.native.gray[ny0:ny1, nx0:nx1]
+        if window.size == 0:
+            return window
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+        return cv2.resize(window, (max(1, x1 - x0), max(1, y1 - y0)), interpolation=interpolation)
+
+    def factor(self, from_level, to_level=CANONICAL_LEVEL):
+        """Multiplier converting pixel lengths/coordinates between two levels"""
+        return self.scale(to_level) / self.scale(from_level)
+
+    def to_level(self, values, from_level, to_level=CANONICAL_LEVEL):
+        """Convert a list of coordinates (or of coordinate lists) between levels"""
+        f = self.factor(from_level, to_level)
+        return [self.to_level(v, from_level, to_level) if isinstance(v, (list, tuple)) else int(round(v * f))
+                for v in values]
+
+    @contextmanager
+    def timed(self, level, name):
+        """Time an extractor running at a level"""
+        ctx = self.context(level)
+        start = time.perf_counter()
+        try:
+            yield ctx
+        finally:
+            extractors = self._level_timings(level)['extractors']
+            extractors[name] = extractors.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def run(self, extractor, *args, **kwargs):
+        """Run an extractor on the context of its declared level, timing it"""
+        level = level_of(extractor)
+        if getattr(extractor, 'pyramid_scaled', False):
+            kwargs.setdefault('scale', self.factor(CANONICAL_LEVEL, level))
+        with self.timed(level, extractor.__name__) as ctx:
+            return extractor(ctx, *args, **kwargs)
+
+    def summary(self):
+        """Size, scale and timings of every level built so far"""
+        levels = {}
+        for level, ctx in self._levels.items():
+            h, w = ctx.shape
+            timings = self._level_timings(level)
+            levels[level] = {
+                'width': w,
+                'height': h,
+                'scale': round(self.scale(level), 4),
+                'resize_ms': round(timings['resize_ms'], 2),
+                'extractors_ms': {k: round(v, 2) for k, v in timings['extractors'].items()},
+            }
+        h, w = self.native_shape
+        return {'native': {'width': w, 'height': h}, 'levels': levels}
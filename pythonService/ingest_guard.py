@@ -0,0 +1,156 @@
+"""
+Upload inspection before anything is decoded.
+
+allowed_file() only looks at the file name. A 16 MB PNG can expand to
+hundreds of megapixels, which cv2.imread would decode in full before
+anything checked the size. Every image upload is inspected from its header
+first, while it is still in the request stream:
+
+- the header gives the format, dimensions, mode, frame count and EXIF
+  orientation, without decoding any pixels;
+- the format must be a format the service accepts, and agree with
+  the file extension and with the declared content type (415 otherwise);
+  phone MPO files (JPEGs with more images appended) count as JPEGs;
+- images over MAX_DECODE_PIXELS (image_decode.py) are rejected (413) unless
+  they are JPEGs that a DCT-reduced decode brings within the budget; those
+  are accepted and downsampled while decoding;
+- multi-frame images (TIFF, GIF) and PDFs may have at most MAX_FRAMES
+  frames or pages (413); only the first frame's size is in the header, later
+  frames over the budget are skipped when the pages are read
+  (page_source.py). PDFs are accepted when pypdfium2 is installed (415
+  otherwise), and sized from their first page.
+
+Unreadable headers get 400. Rejections are counted in
+supercert_rejected_uploads_total by reason.
+"""
+
+import logging
+import os
+import warnings
+from collections import namedtuple
+
+from PIL import Image
+
+from image_decode import JPEG_FORMATS, MAX_DECODE_PIXELS, budget_reduction, ImageInfo
+from metrics import REGISTRY
+from page_source import UnsupportedPages, is_pdf, pdf_info
+
+logger = logging.getLogger(__name__)
+
+# Frames (pages) accepted in one multi-frame image
+MAX_FRAMES = int(os.getenv('INGEST_MAX_FRAMES', '100'))
+
+# Accepted image formats (PIL names), with their file extensions and content types
+JPEG_TYPES = ({'jpg', 'jpeg'}, {'image/jpeg', 'image/jpg', 'image/pjpeg'})
+FORMATS = {
+    **{fmt: JPEG_TYPES for fmt in JPEG_FORMATS},
+    'PNG': ({'png'}, {'image/png', 'image/x-png'}),
+    'GIF': ({'gif'}, {'image/gif'}),
+    'BMP': ({'bmp'}, {'image/bmp', 'image/x-bmp', 'image/x-ms-bmp'}),
+    'TIFF': ({'tif', 'tiff'}, {'image/tiff', 'image/x-tiff'}),
+    'PDF': ({'pdf'}, {'application/pdf'}),
+}
+
+# Resolution PDF headers are sized at (the highest pages are rasterized at)
+PDF_HEADER_DPI = 300
+
+# Content types that say nothing about the content
+GENERIC_CONTENT_TYPES = {'', 'application/octet-stream', 'binary/octet-stream'}
+
+REJECTED_UPLOADS = REGISTRY.counter(
+    'supercert_rejected_uploads_total',
+    'Uploads rejected before decoding, by reason',
+    ['reason'])
+
+ImageHeader = namedtuple('ImageHeader', ['format', 'width', 'height', 'mode', 'frames', 'orientation'])
+
+
+class UploadRejected(Exception):
+    """Raised when an upload fails inspection"""
+
+    def __init__(self, status, message, reason):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.reason = reason
+
+
+def read_header(stream):
+    """
+    ImageHeader of an image file or stream (dimensions after EXIF
+    orientation). PDFs are sized at PDF_HEADER_DPI, from their first page.
+    Raises UploadRejected (400) if it has no readable image header.
+    """
+    if is_pdf(stream):
+        try:
+            info = pdf_info(stream, PDF_HEADER_DPI)
+        except UnsupportedPages as e:
+            raise UploadRejected(415, str(e), 'unsupported_format')
+        except ValueError as e:
+            raise UploadRejected(400, 'Could not read PDF file', 'unreadable') from e
+        finally:
+            stream.seek(0)
+        return ImageHeader('PDF', info.width, info.height, 'RGB', info.pages, None)
+
+    try:
+        with warnings.catch_warnings():
+            # Size is checked below, against our own limit
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with Image.open(stream) as image:
+                width, height = image.size
+                orientation = image.getexif().get(0x0112) if image.format in JPEG_FORMATS | {'TIFF'} else None
+                frames = getattr(image, 'n_frames', 1)
+                header = ImageHeader(image.format, width, height, image.mode, frames, orientation)
+    except Image.DecompressionBombError as e:
+        raise UploadRejected(413, f'Image is too large: {str(e)}', 'too_many_pixels')
+    except (OSError, ValueError, SyntaxError) as e:
+        raise UploadRejected(400, 'Could not read image file', 'unreadable') from e
+    if orientation in (5, 6, 7, 8):
+        header = header._replace(width=height, height=width)
+    return header
+
+
+def check_header(header, extension=None, content_type=None):
+    """Raise UploadRejected if an upload with this header may not be decoded"""
+    if header.format not in FORMATS:
+        raise UploadRejected(415, f'Unsupported image format: {header.format}', 'unsupported_format')
+
+    extensions, content_types = FORMATS[header.format]
+    if extension is not None and extension.lower() not in extensions:
+        raise UploadRejected(415, f'File content is {header.format}, which does not match the '
+                                  f'.{extension} extension', 'content_mismatch')
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type not in GENERIC_CONTENT_TYPES and content_type not in content_types:
+        raise UploadRejected(415, f'File content is {header.format}, which does not match the '
+                                  f'declared content type {content_type}', 'content_mismatch')
+
+    # PDF pages are rasterized within the budget, whatever their size
+    if header.format != 'PDF' and budget_reduction(ImageInfo(header.width, header.height, header.format)) is None:
+        raise UploadRejected(413, f'Image is too large: {header.width}x{header.height} pixels '
+                                  f'(at most {MAX_DECODE_PIXELS})', 'too_many_pixels')
+    if header.frames > MAX_FRAMES:
+        raise UploadRejected(413, f'Image has too many frames: {header.frames} (at most {MAX_FRAMES})',
+                             'too_many_frames')
+
+
+def inspect_stream(stream, filename, content_type=None):
+    """
+    Inspect an uploaded file stream from its header, leaving the stream at
+    the start. Returns its ImageHeader; raises UploadRejected.
+    """
+    extension = filename.rsplit('.', 1)[1] if '.' in (filename or '') else None
+    try:
+        header = read_header(stream)
+        check_header(header, extension, content_type)
+    except UploadRejected as e:
+        REJECTED_UPLOADS.inc(reason=e.reason)
+        logger.warning(f"Rejected upload {filename}: {e.message}")
+        raise
+    finally:
+        stream.seek(0)
+    return header
+
+
+def inspect_upload(file):
+    """inspect_stream() of an uploaded werkzeug FileStorage"""
+    return inspect_stream(file.stream, file.filename, file.mimetype)
@@ -0,0 +1,355 @@
+"""
+Persistent job queue for long-running verification and extraction.
+
+Jobs are rows in a local SQLite database, so queued work survives restarts
+and no external broker is needed. Any number of worker threads, in any
+number of processes (e.g. gunicorn workers), can claim jobs: a claim is a
+single IMMEDIATE transaction, so each job runs once. Higher priority jobs
+are claimed first, then oldest first.
+
+A claim is a lease: the claiming process refreshes the heartbeat of its
+running jobs every HEARTBEAT_INTERVAL seconds. Only jobs whose heartbeat is
+older than the lease (e.g. their process crashed or was killed) are put back
+in the queue, so a long job in a live process never runs twice, and only
+the current claimant of a job can record its result.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+# Named priorities accepted by the API; larger runs first
+PRIORITIES = {
+    'interactive': 10,
+    'normal': 5,
+    'bulk': 0,
+}
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Seconds a worker sleeps when the queue is empty (jobs enqueued by this
+# process wake it immediately)
+POLL_INTERVAL = 1.0
+
+# Finished jobs are kept this long for GET /api/jobs/<id>
+DEFAULT_RETENTION_SECONDS = 24 * 3600
+
+# Seconds between heartbeats of running jobs, and the default lease: a
+# running job without a heartbeat for this long is requeued
+HEARTBEAT_INTERVAL = 10.0
+DEFAULT_LEASE_SECONDS = 60.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    worker TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority DESC, created_at);
+"""
+
+
+def parse_priority(value, default='normal'):
+    """Priority from a name ('interactive', 'bulk', ...) or an integer"""
+    if value is None or value == '':
+        value = default
+    if isinstance(value, str) and value.lower() in PRIORITIES:
+        return PRIORITIES[value.lower()]
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid priority: {value}. Use one of {', '.join(PRIORITIES)} or an integer")
+
+
+class JobQueue:
+    """SQLite-backed priority queue of jobs"""
+
+    def __init__(self, db_path):
+        # The database is created on first use, so importing a module that
+        # defines a queue touches no files
+        self.db_path = db_path
+        self._wakeup = threading.Condition()
+        self._created = False
+        self._create_lock = threading.Lock()
+
+    def _create(self):
+        with self._create_lock:
+            if self._created:
+                return
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            try:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.executescript(SCHEMA)
+                # Databases created before leases have no heartbeat column
+                columns = {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}
+                if 'heartbeat_at' not in columns:
+                    conn.execute('ALTER TABLE jobs ADD COLUMN heartbeat_at REAL')
+            finally:
+                conn.close()
+            self._created = True
+
+    def _connect(self):
+        # Autocommit connection; callers close it (contextlib.closing), as
+        # sqlite3's own context manager only commits
+        if not self._created:
+            self._create()
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def enqueue(self, kind, payload, priority=PRIORITIES['normal']):
+        """Add a job and return its id"""
+        job_id = uuid.uuid4().hex
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, priority, status, payload, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, priority, QUEUED, json.dumps(payload), time.time())
+            )
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def claim(self, worker):
+        """Atomically take the next queued job, or return None"""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY priority DESC, created_at LIMIT 1",
+                (QUEUED,)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, started_at = ?, heartbeat_at = ? WHERE id = ?",
+                (RUNNING, worker, now, now, row['id'])
+            )
+            conn.execute('COMMIT')
+            return self._to_dict(row, status=RUNNING, worker=worker)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def finish(self, job_id, result=None, error=None, worker=None):
+        """
+        Record the result (or error) of a running job. With worker, only if
+        the job is still running under that claim; returns whether it was
+        recorded.
+        """
+        query = "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?"
+        params = [FAILED if error else DONE, json.dumps(result) if result is not None else None,
+                  error, time.time(), job_id]
+        if worker is not None:
+            query += " AND status = ? AND worker = ?"
+            params += [RUNNING, worker]
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(query, params)
+        return cursor.rowcount > 0
+
+    def heartbeat(self, claims):
+        """Refresh the lease of running jobs, given as (job id, worker) pairs"""
+        if not claims:
+            return
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.executemany(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = ? AND worker = ?",
+                [(now, job_id, RUNNING, worker) for job_id, worker in claims]
+            )
+
+    def get(self, job_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def requeue_expired(self, lease=DEFAULT_LEASE_SECONDS):
+        """
+        Put running jobs whose heartbeat is older than lease seconds (their
+        process crashed or was killed) back in the queue
+        """
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, worker = NULL, started_at = NULL, heartbeat_at = NULL "
+                "WHERE status = ? AND COALESCE(heartbeat_at, started_at) < ?",
+                (QUEUED, RUNNING, time.time() - lease)
+            )
+        return cursor.rowcount
+
+    def purge(self, older_than=DEFAULT_RETENTION_SECONDS):
+        """Delete finished jobs older than older_than seconds"""
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (DONE, FAILED, time.time() - older_than)
+            )
+        return cursor.rowcount
+
+    def metrics(self):
+        """Queue depth by status and by priority, and the age of the oldest queued job"""
+        with closing(self._connect()) as conn:
+            by_status = {row['status']: row['n'] for row in conn.execute(
+                "SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")}
+            by_priority = {str(row['priority']): row['n'] for row in conn.execute(
+                "SELECT priority, COUNT(*) AS n FROM jobs WHERE status = ? GROUP BY priority", (QUEUED,))}
+            oldest = conn.execute(
+                "SELECT MIN(created_at) AS t FROM jobs WHERE status = ?", (QUEUED,)).fetchone()['t']
+        return {
+            'queued': by_status.get(QUEUED, 0),
+            'running': by_status.get(RUNNING, 0),
+            'done': by_status.get(DONE, 0),
+            'failed': by_status.get(FAILED, 0),
+            'queuedByPriority': by_priority,
+            'oldestQueuedSeconds': round(time.time() - oldest, 3) if oldest else 0,
+        }
+
+    def wait_for_work(self, timeout=POLL_INTERVAL):
+        with self._wakeup:
+            self._wakeup.wait(timeout)
+
+    def wake_all(self):
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    @staticmethod
+    def _to_dict(row, status=None, worker=None):
+        return {
+            'id': row['id'],
+            'kind': row['kind'],
+            'priority': row['priority'],
+            'status': status or row['status'],
+            'worker': worker or row['worker'],
+            'payload': json.loads(row['payload']),
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+            'createdAt': row['created_at'],
+            'startedAt': row['started_at'],
+            'finishedAt': row['finished_at'],
+        }
+
+
+class JobWorkers:
+    """
+    Background threads that claim and run jobs. handlers maps a job kind to
+    a function taking the job payload and returning a JSON-serialisable result.
+    A heartbeat thread keeps the leases of this process's running jobs
+    alive, and requeues jobs whose lease expired in any process.
+    """
+
+    def __init__(self, queue, handlers, count=1, retention=DEFAULT_RETENTION_SECONDS,
+                 lease=DEFAULT_LEASE_SECONDS):
+        self.queue = queue
+        self.handlers = handlers
+        self.count = count
+        self.retention = retention
+        self.lease = lease
+        self._threads = []
+        self._pid = None
+        self._stop = threading.Event()
+        self._claims = {}
+        self._claims_lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._pid == os.getpid() and any(t.is_alive() for t in self._threads)
+
+    def start(self):
+        """Start the worker threads (safe to call again, e.g. after fork)"""
+        if self.running:
+            return
+        self._stop.clear()
+        self._pid = os.getpid()
+        # Claims inherited through fork belong to the parent
+        self._claims = {}
+        self._threads = [threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)]
+        for i in range(self.count):
+            self._threads.append(threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=None):
+        """Stop claiming new jobs and wait for running ones to finish"""
+        self._stop.set()
+        self.queue.wake_all()
+        if self._pid == os.getpid():
+            for thread in self._threads:
+                thread.join(timeout)
+
+    def _run(self):
+        worker = f"{os.getpid()}:{threading.current_thread().name}"
+        last_purge = 0.0
+        while not self._stop.is_set():
+            if time.monotonic() - last_purge > 3600:
+                last_purge = time.monotonic()
+                try:
+                    self.queue.purge(self.retention)
+                except Exception as e:
+                    logger.error(f"Error purging finished jobs: {str(e)}")
+
+            try:
+                job = self.queue.claim(worker)
+            except Exception as e:
+                logger.error(f"Error claiming job: {str(e)}")
+                job = None
+            if job is None:
+                self.queue.wait_for_work()
+                continue
+
+            self.run_job(job)
+
+    def _heartbeat(self):
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                with self._claims_lock:
+                    claims = list(self._claims.items())
+                self.queue.heartbeat(claims)
+                requeued = self.queue.requeue_expired(self.lease)
+                if requeued:
+                    logger.warning(f"Requeued {requeued} running jobs whose lease expired")
+                    self.queue.wake_all()
+            except Exception as e:
+                logger.error(f"Error refreshing job leases: {str(e)}")
+
+    def run_job(self, job):
+        handler = self.handlers.get(job['kind'])
+        worker = job.get('worker')
+        with self._claims_lock:
+            self._claims[job['id']] = worker
+        try:
+            if handler is None:
+                raise ValueError(f"No handler for job type: {job['kind']}")
+            result = handler(job['payload'])
+            recorded = self.queue.finish(job['id'], result=result, worker=worker)
+        except Exception as e:
+            logger.error(f"Job {job['id']} ({job['kind']}) failed: {str(e)}")
+            traceback.print_exc()
+            recorded = self.queue.finish(job['id'], error=str(e), worker=worker)
+        finally:
+            with self._claims_lock:
+                self._claims.pop(job['id'], None)
+        if not recorded:
+            logger.warning(f"Job {job['id']} ({job['kind']}) lost its lease; its result was not recorded")
@@ -0,0 +1,173 @@
+"""
+Compiled multi-pattern keyword matching for OCR text.
+
+Board and certificate checks used to upper-case the whole OCR text again
+for every check and scan it once per phrase with `in`. A KeywordMatcher
+compiles named groups of phrases (e.g. the required and forbidden elements
+of a template) into one Aho-Corasick automaton instead, so a single pass
+over the text returns every hit of every group, with its position.
+
+Text and phrases are normalized the same way before matching:
+
+- upper-cased, with runs of whitespace (including line breaks) collapsed to
+  one space;
+- common OCR confusions folded onto one character (0/O, 1/I/|, 5/S, curly
+  quotes), so "MAHARASHTRA 5TATE B0ARD" still hits "STATE BOARD".
+
+Matching is by substring, as the `in` checks it replaces were. Hit
+positions refer to the original, unnormalized text.
+"""
+
+import functools
+from collections import namedtuple
+
+# OCR confusions, folded onto the letter in text and phrases alike
+CONFUSIONS = str.maketrans({
+    '0': 'O',
+    '1': 'I',
+    '|': 'I',
+    '5': 'S',
+    '‘': "'",
+    '’': "'",
+    '“': '"',
+    '”': '"',
+})
+
+Hit = namedtuple('Hit', ['group', 'phrase', 'start', 'end'])
+
+
+def normalize(text):
+    """
+    Normalized text and, for every normalized character, the offset of the
+    character of text it came from.
+    """
+    chars = []
+    offsets = []
+    space = True
+    for i, ch in enumerate(text):
+        if ch.isspace():
+            if not space:
+                chars.append(' ')
+                offsets.append(i)
+            space = True
+            continue
+        space = False
+        for folded in ch.upper().translate(CONFUSIONS):
+            chars.append(folded)
+            offsets.append(i)
+    if chars and chars[-1] == ' ':
+        chars.pop()
+        offsets.pop()
+    return ''.join(chars), offsets
+
+
+class KeywordMatches:
+    """All hits of a KeywordMatcher in one text, grouped by group name"""
+
+    def __init__(self, hits):
+        self.hits = hits
+        self.groups = {}
+        for hit in hits:
+            self.groups.setdefault(hit.group, []).append(hit)
+
+    def __contains__(self, group):
+        return group in self.groups
+
+    def any(self, *groups):
+        """Whether any of the groups was hit"""
+        return any(group in self.groups for group in groups)
+
+    def count(self, groups):
+        """Number of the given groups that were hit (each counted once)"""
+        return sum(1 for group in groups if group in self.groups)
+
+    def first(self, group):
+        """The earliest hit of a group, or None"""
+        hits = self.groups.get(group)
+        return hits[0] if hits else None
+
+    def summary(self):
+        """Hits by group as JSON-friendly dicts"""
+        return {group: [{'phrase': h.phrase, 'start': h.start, 'end': h.end} for h in hits]
+                for group, hits in self.groups.items()}
+
+
+class KeywordMatcher:
+    """
+    Named groups of phrases compiled into one Aho-Corasick automaton.
+    groups maps a group name to its phrases; a group is hit when any of its
+    phrases occurs in the text.
+    """
+
+    def __init__(self, groups):
+        self.group_names = list(groups)
+        self._patterns = []  # (group, phrase, normalized length)
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+
+        for group, phrases in groups.items():
+            for phrase in phrases:
+                key = normalize(phrase)[0]
+                if key:
+                    self._add(key, (group, phrase, len(key)))
+        self._link()
+
+    def _add(self, key, pattern):
+        node = 0
+        for ch in key:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append(len(self._patterns))
+        self._patterns.append(pattern)
+
+    def _link(self):
+        """Failure links, breadth first; outputs inherit those of their failure node"""
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for ch, nxt in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+                queue.append(nxt)
+
+    def search(self, text):
+        """Every hit in text, in order of where it ends"""
+        normalized, offsets = normalize(text or '')
+        goto, fail, out, patterns = self._goto, self._fail, self._out, self._patterns
+        hits = []
+        node = 0
+        for pos, ch in enumerate(normalized):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for index in out[node]:
+                group, phrase, length = patterns[index]
+                hits.append(Hit(group, phrase, offsets[pos - length + 1], offsets[pos] + 1))
+        return hits
+
+    def match(self, text):
+        """KeywordMatches of text"""
+        return KeywordMatches(self.search(text))
+
+
+def _freeze(groups):
+    return tuple((group, tuple(phrases)) for group, phrases in groups.items())
+
+
+@functools.lru_cache(maxsize=64)
+def _compiled(frozen):
+    return KeywordMatcher({group: phrases for group, phrases in frozen})
+
+
+def keyword_matcher(groups):
+    """The compiled KeywordMatcher of groups, cached by their contents"""
+    return _compiled(_freeze(groups))
@@ -0,0 +1,273 @@
+"""
+Load generator for sizing hardware.
+
+Synthesizes varied SSC/HSC marksheets from the template scans (random
+students, marks, rotation, blur, JPEG quality and phone-camera perspective,
+see synthetic_marksheets.py) and replays them against a running service at
+a series of target request rates, with a configurable mix of verify,
+extract, PDF and IPFS upload requests. For every rate it reports achieved
+throughput, latency percentiles and errors, i.e. a latency/throughput curve.
+
+Usage:
+    python load_generator.py generate out_dir [--count 2000] [--resolution phone_12mp] [--seed 0]
+    python load_generator.py run [--url http://localhost:5000] [--docs out_dir | --count 200]
+                                 [--rps 1,2,4,8,16] [--duration 60]
+                                 [--mix verify=50,extract=30,pdf=20,upload=0]
+                                 [--slo-ms 5000] [--output curve.json]
+
+Arrivals are open loop (Poisson at the target rate), so a slow service
+builds up a backlog instead of slowing the generator down. "upload" calls
+/api/ipfs/upload, which pins to Pinata for real; leave it at 0 unless the
+service is configured with a test account.
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from synthetic_marksheets import RESOLUTIONS, random_marksheet
+
+OPERATIONS = ['verify', 'extract', 'pdf', 'upload']
+DEFAULT_MIX = 'verify=50,extract=30,pdf=20,upload=0'
+
+_local = threading.local()
+
+
+def parse_mix(text):
+    """'verify=50,extract=30' -> ({'verify': 50.0, ...})"""
+    mix = {}
+    for part in text.split(','):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation {name}. Use {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise ValueError('The mix needs at least one operation with a positive weight')
+    return mix
+
+
+def generate(out_dir, count, resolution, seed):
+    """Write count distorted template marksheets and a manifest.jsonl of their students"""
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, 'manifest.jsonl'), 'w') as manifest:
+        for i in range(count):
+            data, student, params = random_marksheet(rng, resolution)
+            filename = f"load_{i:05d}.jpg"
+            with open(os.path.join(out_dir, filename), 'wb') as f:
+                f.write(data)
+            manifest.write(json.dumps({'path': filename, 'student': student, 'distortion': params}) + '\n')
+            if (i + 1) % 100 == 0:
+                print(f"Generated {i + 1}/{count}")
+    print(f"Wrote {count} marksheets to {out_dir}")
+
+
+def load_documents(docs_dir, count, resolution, seed):
+    """[(filename, jpeg bytes, student)] from a generated directory, or made in memory"""
+    if docs_dir:
+        documents = []
+        with open(os.path.join(docs_dir, 'manifest.jsonl')) as manifest:
+            for line in manifest:
+                entry = json.loads(line)
+                with open(os.path.join(docs_dir, entry['path']), 'rb') as f:
+                    documents.append((entry['path'], f.read(), entry['student']))
+        return documents
+
+    rng = random.Random(seed)
+    print(f"Generating {count} marksheets...")
+    return [(f"load_{i:05d}.jpg", *random_marksheet(rng, resolution)[:2]) for i in range(count)]
+
+
+def session():
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def send(url, operation, document, timeout):
+    """Send one request; returns its HTTP status"""
+    filename, data, student = document
+    if operation == 'pdf':
+        body = {key: value for key, value in student.items() if not isinstance(value, dict)}
+        body['documentHash'] = 'Qm' + base64.b32encode(os.urandom(20)).decode('ascii')[:44]
+        body['imageSource'] = 'data:image/jpeg;base64,' + base64.b64encode(data).decode('ascii')
+        response = session().post(f"{url}/api/generate-pdf", json=body, timeout=timeout)
+    else:
+        path = {'verify': '/api/verify', 'extract': '/api/extract', 'upload': '/api/ipfs/upload'}[operation]
+        form = {}
+        if operation == 'upload':
+            form = {'studentName': student['studentName'], 'documentType': student['program']}
+        response = session().post(f"{url}{path}", files={'document': (filename, data, 'image/jpeg')},
+                                  data=form, timeout=timeout)
+    # Read the whole body, so streamed PDFs are fully timed
+    response.content
+    return response.status_code
+
+
+def run_step(url, documents, mix, rps, duration, timeout, max_in_flight, rng):
+    """
+    Offer rps requests per second for duration seconds. Returns the request
+    records and the perf_counter() time the step began.
+    """
+    operations, weights = zip(*[(name, weight) for name, weight in mix.items() if weight > 0])
+    records = []
+    lock = threading.Lock()
+
+    def task(operation, document, scheduled):
+        start = time.perf_counter()
+        try:
+            status = send(url, operation, document, timeout)
+            error = None
+        except requests.RequestException as e:
+            status, error = None, type(e).__name__
+        end = time.perf_counter()
+        with lock:
+            records.append({'operation': operation, 'status': status, 'error': error,
+                            'latency': end - start, 'lag': start - scheduled, 'end': end})
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        begin = time.perf_counter()
+        next_arrival = begin
+        while next_arrival < begin + duration:
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            operation = rng.choices(operations, weights)[0]
+            pool.submit(task, operation, rng.choice(documents), next_arrival)
+            next_arrival += rng.expovariate(rps)
+    return records, begin
+
+
+def summarize_step(rps, duration, records, begin, slo_ms):
+    ok = [r for r in records if r['status'] is not None and r['status'] < 400]
+    rejected = [r for r in records if r['status'] in (429, 503)]
+    failed = [r for r in records if r['status'] is None or r['status'] >= 400]
+    latencies = np.array([r['latency'] for r in ok]) * 1000
+    # Until the last response, when the service fell behind
+    elapsed = max([r['end'] - begin for r in records] + [duration])
+
+    def percentile(values, q):
+        return round(float(np.percentile(values, q)), 1) if len(values) else None
+
+    by_operation = {}
+    for operation in OPERATIONS:
+        values = np.array([r['latency'] for r in ok if r['operation'] == operation]) * 1000
+        count = sum(1 for r in records if r['operation'] == operation)
+        if count:
+            by_operation[operation] = {'requests': count, 'ok': len(values), 'p50_ms': percentile(values, 50),
+                                       'p95_ms': percentile(values, 95)}
+
+    p95 = percentile(latencies, 95)
+    error_rate = len(failed) / len(records) if records else 0.0
+    return {
+        'target_rps': rps,
+        'requests': len(records),
+        'offered_rps': round(len(records) / duration, 2),
+        'throughput_rps': round(len(ok) / elapsed, 2) if elapsed > 0 else 0.0,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': p95,
+        'p99_ms': percentile(latencies, 99),
+        'max_client_lag_ms': round(max((r['lag'] for r in records), default=0) * 1000, 1),
+        'errors': len(failed),
+        'rejected': len(rejected),
+        'error_rate': round(error_rate, 4),
+        'within_slo': p95 is not None and p95 <= slo_ms and error_rate < 0.01,
+        'operations': by_operation,
+    }
+
+
+def print_curve(steps):
+    print(f"{'target':>8}{'offered':>9}{'achieved':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'errors':>8}{'429/503':>9}  SLO")
+    for step in steps:
+        print(f"{step['target_rps']:>8}{step['offered_rps']:>9}{step['throughput_rps']:>10}"
+              f"{str(step['p50_ms']):>10}{str(step['p95_ms']):>10}{str(step['p99_ms']):>10}"
+              f"{step['errors']:>8}{step['rejected']:>9}  {'ok' if step['within_slo'] else 'MISSED'}")
+
+
+def run(args):
+    mix = parse_mix(args.mix)
+    rates = [float(r) for r in args.rps.split(',') if r.strip()]
+    resolution = RESOLUTIONS[args.resolution] if args.resolution else None
+    documents = load_documents(args.docs, args.count, resolution, args.seed)
+    url = args.url.rstrip('/')
+
+    try:
+        requests.get(f"{url}/health", timeout=5).raise_for_status()
+    except requests.RequestException as e:
+        sys.exit(f"Service at {url} is not healthy: {e}")
+
+    rng = random.Random(args.seed)
+    steps = []
+    for rps in rates:
+        print(f"Offering {rps} requests/s for {args.duration}s...", flush=True)
+        records, begin = run_step(url, documents, mix, rps, args.duration, args.timeout, args.max_in_flight, rng)
+        step = summarize_step(rps, args.duration, records, begin, args.slo_ms)
+        steps.append(step)
+        print(f"  achieved {step['throughput_rps']}/s, p95 {step['p95_ms']} ms, "
+              f"{step['errors']} errors ({step['rejected']} rejected)")
+        if args.cooldown:
+            time.sleep(args.cooldown)
+
+    print()
+    print_curve(steps)
+    sustainable = [s['target_rps'] for s in steps if s['within_slo']]
+    print(f"\nHighest rate within SLO (p95 <= {args.slo_ms} ms, < 1% errors): "
+          f"{max(sustainable) if sustainable else 'none'}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'url': url, 'mix': mix, 'duration': args.duration, 'slo_ms': args.slo_ms,
+                       'documents': len(documents), 'steps': steps}, f, indent=2)
+        print(f"Curve written to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Synthetic marksheet load generator.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    gen = commands.add_parser('generate', help='write synthetic marksheets to a directory')
+    gen.add_argument('out_dir')
+    gen.add_argument('--count', type=int, default=2000)
+    gen.add_argument('--resolution', choices=sorted(RESOLUTIONS), help='photo size (default: template size)')
+    gen.add_argument('--seed', type=int, default=0)
+
+    replay = commands.add_parser('run', help='replay marksheets against the service')
+    replay.add_argument('--url', default='http://localhost:5000')
+    replay.add_argument('--docs', help='directory written by "generate" (default: generate in memory)')
+    replay.add_argument('--count', type=int, default=200, help='marksheets to generate when --docs is not given')
+    replay.add_argument('--resolution', choices=sorted(RESOLUTIONS), help='photo size for generated marksheets')
+    replay.add_argument('--rps', default='1,2,4,8', help='comma separated target request rates')
+    replay.add_argument('--duration', type=float, default=60, help='seconds per rate')
+    replay.add_argument('--cooldown', type=float, default=5, help='seconds between rates')
+    replay.add_argument('--mix', default=DEFAULT_MIX, help='operation weights, e.g. verify=70,extract=30')
+    replay.add_argument('--timeout', type=float, default=120, help='seconds per request')
+    replay.add_argument('--max-in-flight', type=int, default=256, help='most requests open at once')
+    replay.add_argument('--slo-ms', type=float, default=5000, help='p95 latency target')
+    replay.add_argument('--seed', type=int, default=0)
+    replay.add_argument('--output', help='write the curve as JSON')
+
+    args = parser.parse_args()
+    if args.command == 'generate':
+        generate(args.out_dir, args.count, RESOLUTIONS[args.resolution] if args.resolution else None, args.seed)
+    else:
+        try:
+            run(args)
+        except ValueError as e:
+            parser.error(str(e))
+
+
+if __name__ == '__main__':
+    main()
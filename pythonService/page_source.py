@@ -0,0 +1,183 @@
+"""
+Lazy page-by-page reading of multi-page scans.
+
+cv2.imread only reads the first frame of a TIFF or GIF, and cannot read PDF
+at all, while colleges scan marksheets in multi-page batches. A page source
+yields the pages of a document one at a time, as BGR arrays, so a 100-page
+scan never sits in memory at once:
+
+- TIFF and GIF frames are read with PIL's ImageSequence, one frame decoded
+  at a time; frames much larger than the requested resolution are reduced
+  right after decoding;
+- PDF pages are rasterized with pypdfium2 (optional: without it PDFs are not
+  accepted) at the DPI the caller needs, e.g. 150 DPI for verification and
+  300 DPI for OCR.
+
+No page is produced with more than MAX_DECODE_PIXELS pixels; larger pages
+are rendered or reduced to fit. Single-frame TIFFs and GIFs, and other
+formats, are a single page read with image_decode.decode().
+
+Documents this installation cannot read at all (PDFs without pypdfium2)
+raise UnsupportedPages; unreadable or corrupt files raise ValueError or
+OSError.
+"""
+
+import logging
+import math
+from collections import namedtuple
+
+import cv2
+import numpy as np
+from PIL import Image, ImageSequence
+
+from image_decode import MAX_DECODE_PIXELS, decode
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+logger = logging.getLogger(__name__)
+
+# Formats read page by page (PIL names; PDF is sniffed from its magic bytes)
+PAGED_FORMATS = {'TIFF', 'GIF', 'PDF'}
+
+PDF_MAGIC = b'%PDF-'
+
+# PDF user space units per inch
+POINTS_PER_INCH = 72.0
+
+# Long edge of an A4 page, in inches: raster frames are sized for a DPI by it
+A4_LONG_EDGE_INCHES = 11.69
+
+Page = namedtuple('Page', ['number', 'image'])
+
+PageInfo = namedtuple('PageInfo', ['format', 'pages', 'width', 'height'])
+
+PDF_UNSUPPORTED = 'PDF support needs pypdfium2 (pip install pypdfium2)'
+
+
+class UnsupportedPages(Exception):
+    """Raised for documents that cannot be read in this installation (PDF without pypdfium2)"""
+
+
+def is_pdf(stream):
+    """Whether a file or stream starts with the PDF magic bytes (the stream is rewound)"""
+    if isinstance(stream, str):
+        with open(stream, 'rb') as f:
+            return f.read(len(PDF_MAGIC)) == PDF_MAGIC
+    position = stream.tell()
+    try:
+        return stream.read(len(PDF_MAGIC)) == PDF_MAGIC
+    finally:
+        stream.seek(position)
+
+
+def pdf_info(source, dpi):
+    """
+    PageInfo of a PDF file, stream or bytes: page count, and the size of the
+    first page rasterized at dpi. Raises UnsupportedPages without pypdfium2,
+    and ValueError if it cannot be parsed.
+    """
+    if pdfium is None:
+        raise UnsupportedPages(PDF_UNSUPPORTED)
+    try:
+        document = pdfium.PdfDocument(source)
+    except pdfium.PdfiumError as e:
+        raise ValueError(f"Could not read PDF: {str(e)}") from e
+    try:
+        count = len(document)
+        if count == 0:
+            raise ValueError('PDF has no pages')
+        width, height = document.get_page_size(0)
+    finally:
+        document.close()
+    scale = dpi / POINTS_PER_INCH
+    return PageInfo('PDF', count, int(round(width * scale)), int(round(height * scale)))
+
+
+def _fit_scale(width, height, scale):
+    """scale, lowered so a width x height page stays within MAX_DECODE_PIXELS"""
+    pixels = width * height * scale * scale
+    if pixels > MAX_DECODE_PIXELS:
+        scale *= math.sqrt(MAX_DECODE_PIXELS / pixels)
+    return scale
+
+
+def _pdf_pages(path, dpi):
+    try:
+        document = pdfium.PdfDocument(path)
+    except pdfium.PdfiumError as e:
+        raise ValueError(f"Could not read PDF: {str(e)}") from e
+    try:
+        for index in range(len(document)):
+            try:
+                image = _render_pdf_page(document, index, dpi)
+            except pdfium.PdfiumError as e:
+                raise ValueError(f"Could not render page {index + 1} of {path}: {str(e)}") from e
+            yield Page(index + 1, image)
+    finally:
+        document.close()
+
+
+def _render_pdf_page(document, index, dpi):
+    page = document[index]
+    try:
+        width, height = page.get_size()
+        scale = _fit_scale(width, height, dpi / POINTS_PER_INCH)
+        bitmap = page.render(scale=scale)
+        try:
+            # pdfium renders BGR(A), as OpenCV expects
+            image = bitmap.to_numpy()
+            return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR) if image.shape[2] == 4 else image.copy()
+        finally:
+            bitmap.close()
+    finally:
+        page.close()
+
+
+def _frame_pages(path, dpi):
+    long_edge = dpi * A4_LONG_EDGE_INCHES if dpi else None
+    with Image.open(path) as image:
+        for index, frame in enumerate(ImageSequence.Iterator(image)):
+            width, height = frame.size
+            if width * height > MAX_DECODE_PIXELS:
+                logger.warning(f"Skipping page {index + 1} of {path}: {width}x{height} is over "
+                               f"{MAX_DECODE_PIXELS} pixels")
+                continue
+            page = frame.convert('RGB')
+            # Integer reduction only when the frame is at least twice the needed size
+            if long_edge:
+                factor = int(max(width, height) // long_edge)
+                if factor >= 2:
+                    page = page.reduce(factor)
+            yield Page(index + 1, cv2.cvtColor(np.asarray(page), cv2.COLOR_RGB2BGR))
+
+
+def is_paged(path):
+    """Whether a document has to be read with iter_pages() (PDF, TIFF or GIF with several frames)"""
+    if is_pdf(path):
+        return True
+    try:
+        with Image.open(path) as image:
+            return image.format in PAGED_FORMATS and getattr(image, 'n_frames', 1) > 1
+    except (OSError, ValueError):
+        return False
+
+
+def iter_pages(path, dpi=None):
+    """
+    Pages of a document, one at a time: Page(number, BGR image), numbered
+    from 1. dpi is the resolution PDFs are rasterized at (and raster frames
+    reduced towards); required for PDFs.
+    """
+    if is_pdf(path):
+        if pdfium is None:
+            raise UnsupportedPages(PDF_UNSUPPORTED)
+        yield from _pdf_pages(path, dpi)
+    elif is_paged(path):
+        yield from _frame_pages(path, dpi)
+    else:
+        image = decode(path)
+        if image is not None:
+            yield Page(1, image)
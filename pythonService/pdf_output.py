@@ -0,0 +1,153 @@
+"""
+Output handling for generated PDF documents.
+
+PDFs are rendered into a spooled temporary file (kept in memory while small,
+moved to disk once it grows) and sent to the client in fixed-size chunks.
+Persisting a copy to disk is optional and content-addressed: the file is
+named after the SHA-256 of its bytes, so two students with the same name
+can never overwrite each other's transcript.
+"""
+
+import os
+import hashlib
+import tempfile
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from image_decode import JPEG_FORMATS
+
+logger = logging.getLogger(__name__)
+
+# Rendered PDFs larger than this are spooled to disk instead of memory
+SPOOL_MAX_BYTES = 1024 * 1024
+
+# Size of each chunk sent to the client
+CHUNK_SIZE = 64 * 1024
+
+# Longest edge (in pixels) of images embedded in a PDF. 1800px covers the
+# 450pt wide image slot at 288 DPI, well above print quality.
+MAX_EMBED_PIXELS = 1800
+
+# Single background worker for writing PDFs to disk
+_persist_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pdf-persist')
+
+
+class PdfSpool:
+    """File-like sink for a rendered PDF that tracks the SHA-256 of its bytes"""
+
+    def __init__(self):
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        self.size = 0
+        self._digest = hashlib.sha256()
+
+    def write(self, data):
+        self._digest.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    def chunks(self):
+        """Yield the PDF bytes from the start in CHUNK_SIZE pieces"""
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    def persist(self, pdf_dir):
+        """Write the PDF to pdf_dir as <sha256>.pdf and return its path"""
+        os.makedirs(pdf_dir, exist_ok=True)
+        pdf_path = content_path(pdf_dir, self.sha256)
+        if os.path.exists(pdf_path):
+            return pdf_path
+
+        # Write to a temporary name first so readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=pdf_dir, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in self.chunks():
+                    f.write(chunk)
+            os.replace(temp_path, pdf_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return pdf_path
+
+    def close(self):
+        self.file.close()
+
+
+def content_path(pdf_dir, sha256):
+    """Path of the content-addressed PDF with the given digest"""
+    return os.path.join(pdf_dir, f"{sha256}.pdf")
+
+
+def _persist_and_close(spool, pdf_dir):
+    try:
+        pdf_path = spool.persist(pdf_dir)
+        logger.info(f"PDF persisted at: {pdf_path}")
+    except Exception as e:
+        logger.error(f"Error persisting PDF: {str(e)}")
+    finally:
+        spool.close()
+
+
+class PdfStream:
+    """
+    WSGI response iterable that streams a rendered PDF to the client.
+
+    The spool is finished in close(), which the WSGI server calls whether the
+    response was sent in full, cut off by a client disconnect, or dropped
+    before the first chunk (a generator's finally would not run then). If
+    persist_dir is given, a content-addressed copy is written in the
+    background; the spool is closed exactly once either way.
+    """
+
+    def __init__(self, spool, persist_dir=None):
+        self.spool = spool
+        self.persist_dir = persist_dir
+        self._closed = False
+
+    def __iter__(self):
+        return self.spool.chunks()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self.persist_dir:
+            _persist_executor.submit(_persist_and_close, self.spool, self.persist_dir)
+        else:
+            self.spool.close()
+
+
+def stream_pdf(spool, persist_dir=None):
+    """Response iterable streaming a rendered PDF (see PdfStream)"""
+    return PdfStream(spool, persist_dir)
+
+
+def flush_pending_writes():
+    """Wait for background PDF writes to finish; call once when the process shuts down"""
+    _persist_executor.shutdown(wait=True)
+
+
+def bound_embed_image(pil_img, max_pixels=MAX_EMBED_PIXELS):
+    """
+    Bound an opened (not yet loaded) PIL image to max_pixels on its longest
+    edge for embedding in a PDF. JPEGs (and phone MPOs) are decoded at reduced
+    scale directly, so a large phone photo never has to be fully decoded.
+    """
+    if pil_img.format in JPEG_FORMATS:
+        pil_img.draft('RGB', (max_pixels, max_pixels))
+    if max(pil_img.size) > max_pixels:
+        pil_img.thumbnail((max_pixels, max_pixels), Image.LANCZOS)
+    if pil_img.mode not in ('RGB', 'L'):
+        pil_img = pil_img.convert('RGB')
+    return pil_img
@@ -0,0 +1,126 @@
+"""
+Per-document preprocessing context.
+
+Feature extractors used to each redo grayscale conversion, thresholding,
+blurring and Canny on the same image. A DocumentContext wraps one decoded
+document and computes every derived image lazily, at most once, so all
+extractors in a verification share the same intermediate results.
+"""
+
+import cv2
+import numpy as np
+
+
+class DocumentContext:
+    """Lazily computed, memoized derived images of one document"""
+
+    def __init__(self, image):
+        if not isinstance(image, np.ndarray):
+            image = np.array(image)
+        self.image = image
+        self._cache = {}
+
+    def _memo(self, key, compute):
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    @property
+    def shape(self):
+        return self.image.shape[:2]
+
+    @property
+    def bgr(self):
+        """Original image as 3 channel BGR"""
+        if self.image.ndim == 3:
+            return self.image
+        return self._memo('bgr', lambda: cv2.cvtColor(self.image, cv2.COLOR_GRAY2BGR))
+
+    @property
+    def rgb(self):
+        """Original image as 3 channel RGB"""
+        if self.image.ndim == 3:
+            return self._memo('rgb', lambda: cv2.cvtColor(self.image, cv2.COLOR_BGR2RGB))
+        return self._memo('rgb', lambda: cv2.cvtColor(self.image, cv2.COLOR_GRAY2RGB))
+
+    @property
+    def gray(self):
+        """Grayscale image"""
+        if self.image.ndim == 2:
+            return self.image
+        return self._memo('gray', lambda: cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY))
+
+    @property
+    def blur(self):
+        """Gaussian blurred (5x5) grayscale image"""
+        return self._memo('blur', lambda: cv2.GaussianBlur(self.gray, (5, 5), 0))
+
+    @property
+    def otsu(self):
+        """Otsu binarization, black text on white background"""
+        return self._memo('otsu', lambda: cv2.threshold(self.gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1])
+
+    @property
+    def otsu_inv(self):
+        """Inverted Otsu binarization, white text on black background"""
+        return self._memo('otsu_inv', lambda: cv2.threshold(self.gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1])
+
+    @property
+    def adaptive(self):
+        """Inverted adaptive Gaussian threshold (block 11, C 2)"""
+        return self._memo('adaptive', lambda: cv2.adaptiveThreshold(
+            self.gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 11, 2
+        ))
+
+    @property
+    def processed(self):
+        """Adaptive threshold closed with a 2x2 kernel to reduce noise"""
+        return self._memo('processed', lambda: cv2.morphologyEx(
+            self.adaptive, cv2.MORPH_CLOSE, np.ones((2, 2), np.uint8)
+        ))
+
+    def derived(self, source):
+        """Derived image by name ('gray', 'blur', 'otsu', 'processed', ...)"""
+        return getattr(self, source)
+
+    def threshold(self, source, value, thresh_type=cv2.THRESH_BINARY):
+        """Fixed-level threshold of a derived image"""
+        return self._memo(('threshold', source, value, thresh_type), lambda: cv2.threshold(
+            self.derived(source), value, 255, thresh_type
+        )[1])
+
+    def canny(self, source='gray', low=50, high=150):
+        """Canny edge map of a derived image"""
+        return self._memo(('canny', source, low, high), lambda: cv2.Canny(self.derived(source), low, high))
+
+    def morphology(self, source, op, ksize):
+        """Morphological operation with a rectangular (width, height) kernel on a derived image"""
+        def compute():
+            kernel = cv2.getStructuringElement(cv2.MORPH_RECT, ksize)
+            return cv2.morphologyEx(self.derived(source), op, kernel)
+        return self._memo(('morphology', source, op, tuple(ksize)), compute)
+
+
+# Extractors accept either a DocumentContext or an already processed image.
+# These helpers memoize on the context and fall back to computing directly.
+
+def processed_image(image):
+    """The processed (binarized) image of a DocumentContext, or image itself if it already is one"""
+    if isinstance(image, DocumentContext):
+        return image.processed
+    return image
+
+
+def processed_canny(image, low, high):
+    """Canny edge map of the processed image"""
+    if isinstance(image, DocumentContext):
+        return image.canny('processed', low, high)
+    return cv2.Canny(image, low, high)
+
+
+def processed_morphology(image, op, ksize):
+    """Morphological operation with a rectangular kernel on the processed image"""
+    if isinstance(image, DocumentContext):
+        return image.morphology('processed', op, ksize)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, ksize)
+    return cv2.morphologyEx(image, op, kernel)
@@ -0,0 +1,164 @@
+"""
+Opt-in per-request profiling.
+
+Profiling is off unless the deployment enables it with
+PROFILING_ENABLED=true. Then add ?profile=1 to a request (or send an X-Profile: 1 header) to get a
+breakdown of where its time went. Every metrics.stage() block that runs
+while handling the request is recorded, and the breakdown is returned
+
+- in a Server-Timing header on every profiled response, and
+- under 'profile' in the body of JSON responses.
+
+?profile=cprofile adds the top functions by cumulative time from cProfile,
+and ?profile=pyinstrument a pyinstrument call tree if it is installed.
+These slow the request down several times and expose function names and
+file paths, so they are only honoured for requests that send the
+PROFILING_TOKEN configured on the server in an X-Profile-Token header;
+other requests get the stage breakdown. Profiler output only fits in JSON bodies, so for PDF downloads use the
+Server-Timing header.
+
+When profiling is not requested, the only cost is one thread-local lookup
+per stage.
+"""
+
+import cProfile
+import functools
+import hmac
+import io
+import json
+import os
+import pstats
+import threading
+import time
+
+from flask import request, make_response
+
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+    has_pyinstrument = True
+except ImportError:
+    has_pyinstrument = False
+
+# Set PROFILING_ENABLED=true to honour profile requests (off by default)
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+
+# Secret that requests must send in X-Profile-Token for the cprofile and
+# pyinstrument modes; unset, those modes are never honoured
+PROFILING_TOKEN = os.getenv('PROFILING_TOKEN', '')
+
+# Modes that run a profiler over the whole request
+PROFILER_MODES = ('cprofile', 'pyinstrument')
+
+# Functions listed in cProfile output
+CPROFILE_TOP = 30
+
+_local = threading.local()
+
+
+class RequestProfile:
+    """Stage timings of one request, in the order they ran"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = []
+
+    def record(self, name, seconds):
+        self.stages.append((name, seconds))
+
+    def summary(self):
+        totals = {}
+        for name, seconds in self.stages:
+            total = totals.setdefault(name, {'ms': 0.0, 'count': 0})
+            total['ms'] += seconds * 1000
+            total['count'] += 1
+        for total in totals.values():
+            total['ms'] = round(total['ms'], 3)
+        return {
+            'totalMs': round((time.perf_counter() - self.start) * 1000, 3),
+            'stages': totals,
+            'timeline': [{'stage': name, 'ms': round(seconds * 1000, 3)} for name, seconds in self.stages],
+        }
+
+    def server_timing(self, summary):
+        entries = [f"{name};dur={total['ms']}" for name, total in summary['stages'].items()]
+        entries.append(f"total;dur={summary['totalMs']}")
+        return ', '.join(entries)
+
+
+def current():
+    """The profile of the request being handled by this thread, if any"""
+    return getattr(_local, 'profile', None)
+
+
+def record(name, seconds):
+    profile = getattr(_local, 'profile', None)
+    if profile is not None:
+        profile.record(name, seconds)
+
+
+def requested_mode():
+    """None, or the profiling mode asked for by the current request"""
+    if not PROFILING_ENABLED:
+        return None
+    value = request.args.get('profile') or request.headers.get('X-Profile')
+    if not value or value.lower() in ('0', 'false', 'no'):
+        return None
+    value = value.lower()
+    if value in PROFILER_MODES and profiler_authorized():
+        return value
+    return 'stages'
+
+
+def profiler_authorized():
+    """Whether the current request carries the PROFILING_TOKEN"""
+    token = request.headers.get('X-Profile-Token', '')
+    return bool(PROFILING_TOKEN) and hmac.compare_digest(token.encode(), PROFILING_TOKEN.encode())
+
+
+def _cprofile_text(profiler):
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(CPROFILE_TOP)
+    return stream.getvalue()
+
+
+def profiled(view):
+    """Flask view decorator adding the profile of the request to its response when asked for"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        mode = requested_mode()
+        if mode is None:
+            return view(*args, **kwargs)
+
+        profile = _local.profile = RequestProfile()
+        profiler = None
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif mode == 'pyinstrument' and has_pyinstrument:
+            profiler = PyinstrumentProfiler()
+            profiler.start()
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        finally:
+            _local.profile = None
+            if mode == 'cprofile':
+                profiler.disable()
+            elif profiler is not None:
+                profiler.stop()
+
+        summary = profile.summary()
+        response.headers['Server-Timing'] = profile.server_timing(summary)
+
+        if response.is_json and not response.direct_passthrough:
+            if mode == 'cprofile':
+                summary['cprofile'] = _cprofile_text(profiler)
+            elif mode == 'pyinstrument':
+                summary['pyinstrument'] = (profiler.output_text(unicode=True) if profiler is not None
+                                           else 'pyinstrument is not installed')
+            body = response.get_json()
+            if isinstance(body, dict):
+                body['profile'] = summary
+                response.set_data(json.dumps(body))
+        return response
+    return wrapper
@@ -0,0 +1,246 @@
+"""
+Template-space document registration.
+
+Phone photos of marksheets are rotated, skewed and shot in perspective, so
+resizing them to the template size and comparing pixels (SSIM) says little
+about whether they are the same document. Registration estimates the
+homography from a document to a template instead:
+
+- ORB keypoints of every template are computed once, at the low pyramid
+  level, and cached until the template file changes;
+- the document's keypoints are computed once, also at the low level, and
+  matched against each candidate template; the template with the most RANSAC
+  inliers is the best candidate;
+- the document is warped into that template's frame, once per pyramid level
+  that is actually used.
+
+The result is a RegisteredPyramid: an ImagePyramid whose levels are the
+document seen in the template's frame, pixel-aligned with the template's own
+pyramid. SSIM, ROI OCR and seal/table checks all run on it instead of each
+resizing the upload themselves.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from image_pyramid import ImagePyramid, CANONICAL_LEVEL
+from preprocess_context import DocumentContext
+
+logger = logging.getLogger(__name__)
+
+# Pyramid level keypoints are detected and matched at
+REGISTRATION_LEVEL = 'low'
+
+# Keypoints detected per image
+ORB_FEATURES = int(os.getenv('REGISTRATION_ORB_FEATURES', '2000'))
+
+# Lowe's ratio test for descriptor matches
+MATCH_RATIO = 0.75
+
+# RANSAC reprojection error, in pixels at the registration level
+RANSAC_THRESHOLD = 4.0
+
+# A homography needs at least this many inliers to be trusted
+MIN_INLIERS = int(os.getenv('REGISTRATION_MIN_INLIERS', '30'))
+
+# Reject homographies that shrink/stretch the page more than this (area ratio)
+MAX_AREA_CHANGE = 4.0
+
+
+def _orb():
+    return cv2.ORB_create(nfeatures=ORB_FEATURES)
+
+
+def detect_keypoints(gray):
+    """(N x 2 float32 keypoint coordinates, N x 32 uint8 ORB descriptors) of a grayscale image"""
+    keypoints, descriptors = _orb().detectAndCompute(gray, None)
+    if descriptors is None:
+        return np.empty((0, 2), np.float32), np.empty((0, 32), np.uint8)
+    return np.float32([kp.pt for kp in keypoints]), descriptors
+
+
+def _level_matrix(pyramid, from_level, to_level):
+    """3x3 scaling matrix converting coordinates of one pyramid level to another"""
+    f = pyramid.factor(from_level, to_level)
+    return np.diag([f, f, 1.0])
+
+
+class TemplateFrame:
+    """A template image with its pyramid and precomputed low-level keypoints"""
+
+    def __init__(self, name, path, signature, image):
+        self.name = name
+        self.path = path
+        self.signature = signature
+        self.pyramid = ImagePyramid(image)
+        self.points, self.descriptors = detect_keypoints(self.pyramid.context(REGISTRATION_LEVEL).gray)
+
+    def __repr__(self):
+        return f"TemplateFrame({self.name}, {len(self.points)} keypoints)"
+
+
+_frames = {}
+_frames_lock = threading.Lock()
+
+
+def _signature(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def template_frame(path):
+    """
+    The TemplateFrame of a template image, cached until the file changes.
+    Returns None if the image cannot be read.
+    """
+    try:
+        signature = _signature(path)
+    except OSError:
+        return None
+
+    with _frames_lock:
+        frame = _frames.get(path)
+    if frame is not None and frame.signature == signature:
+        return frame
+
+    image = cv2.imread(path)
+    if image is None:
+        logger.error(f"Could not read template image {path}")
+        return None
+    frame = TemplateFrame(os.path.basename(path), path, signature, image)
+    with _frames_lock:
+        _frames[path] = frame
+    logger.info(f"Computed {len(frame.points)} registration keypoints for {frame.name}")
+    return frame
+
+
+def _plausible(homography, shape):
+    """False for degenerate homographies (flipped, collapsed or wildly rescaled pages)"""
+    h, w = shape
+    corners = np.float32([[0, 0], [w, 0], [w, h], [0, h]]).reshape(-1, 1, 2)
+    projected = cv2.perspectiveTransform(corners, homography).reshape(-1, 2)
+    # Signed area (shoelace); negative means the page was mirrored
+    x, y = projected[:, 0], projected[:, 1]
+    area = 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+    if area <= 0:
+        return False
+    ratio = area / float(w * h)
+    return 1.0 / MAX_AREA_CHANGE <= ratio <= MAX_AREA_CHANGE
+
+
+def estimate_homography(points, descriptors, frame, shape):
+    """
+    Homography mapping document coordinates to template coordinates, both at
+    the registration level. Returns (homography, inliers, matches); the
+    homography is None if it could not be estimated reliably.
+    """
+    if len(points) < 4 or len(frame.points) < 4:
+        return None, 0, 0
+
+    pairs = cv2.BFMatcher(cv2.NORM_HAMMING).knnMatch(descriptors, frame.descriptors, k=2)
+    good = [p[0] for p in pairs if len(p) == 2 and p[0].distance < MATCH_RATIO * p[1].distance]
+    if len(good) < MIN_INLIERS:
+        return None, 0, len(good)
+
+    src = points[[m.queryIdx for m in good]].reshape(-1, 1, 2)
+    dst = frame.points[[m.trainIdx for m in good]].reshape(-1, 1, 2)
+    homography, mask = cv2.findHomography(src, dst, cv2.RANSAC, RANSAC_THRESHOLD)
+    inliers = int(mask.sum()) if mask is not None else 0
+    if homography is None or inliers < MIN_INLIERS or not _plausible(homography, shape):
+        return None, inliers, len(good)
+    return homography, inliers, len(good)
+
+
+class RegisteredPyramid(ImagePyramid):
+    """
+    A document warped into a template's frame. Each level is the document's
+    own level warped once, on first use, to the size of the template's level,
+    so the two pyramids are pixel-aligned.
+    """
+
+    def __init__(self, document, frame, homography, inliers, matches):
+        self.document = document
+        self.frame = frame
+        self.homography = homography
+        self.inliers = inliers
+        self.matches = matches
+        self.long_edges = dict(frame.pyramid.long_edges)
+        self._levels = {}
+        self.timings = {}
+
+    @property
+    def native(self):
+        return self.context(CANONICAL_LEVEL)
+
+    @property
+    def native_shape(self):
+        return self.frame.pyramid.native_shape
+
+    def level_homography(self, level):
+        """Homography from the document's level to the template's level"""
+        to_registration = _level_matrix(self.document, level, REGISTRATION_LEVEL)
+        from_registration = _level_matrix(self.frame.pyramid, REGISTRATION_LEVEL, level)
+        return from_registration @ self.homography @ to_registration
+
+    def context(self, level):
+        if level not in self._levels:
+            source = self.document.context(level)
+            start = time.perf_counter()
+            h, w = self.frame.pyramid.level_shape(level)
+            warped = cv2.warpPerspective(source.image, self.level_homography(level), (w, h),
+                                         flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+            self._levels[level] = DocumentContext(warped)
+            self._level_timings(level)['resize_ms'] += (time.perf_counter() - start) * 1000
+        return self._levels[level]
+
+    def crop(self, level, box):
+        """Grayscale crop (x0, y0, x1, y1) of a level, warping only that window if the level is not built"""
+        x0, y0, x1, y1 = box
+        if level in self._levels:
+            return self._levels[level].gray[y0:y1, x0:x1]
+        # Straight from the native document: native -> document level -> template level -> window
+        s = self.document.scale(level)
+        homography = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype=float) \
+            @ self.level_homography(level) @ np.diag([s, s, 1.0])
+        return cv2.warpPerspective(self.document.native.gray, homography, (max(1, x1 - x0), max(1, y1 - y0)),
+                                   flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+    def summary(self):
+        return {
+            'template': self.frame.name,
+            'inliers': self.inliers,
+            'matches': self.matches,
+            **super().summary(),
+        }
+
+
+def register(document, template_paths):
+    """
+    Register a document (ImagePyramid or image) against candidate templates.
+    Returns the RegisteredPyramid for the template with the most inliers, or
+    None if no template could be registered.
+    """
+    if not isinstance(document, ImagePyramid):
+        document = ImagePyramid(document)
+
+    low = document.context(REGISTRATION_LEVEL)
+    points, descriptors = detect_keypoints(low.gray)
+
+    best = None
+    for path in template_paths:
+        frame = template_frame(path)
+        if frame is None:
+            continue
+        homography, inliers, matches = estimate_homography(points, descriptors, frame, low.shape)
+        logger.info(f"Registration against {frame.name}: {inliers} inliers of {matches} matches")
+        if homography is not None and (best is None or inliers > best[2]):
+            best = (frame, homography, inliers, matches)
+
+    if best is None:
+        return None
+    return RegisteredPyramid(document, *best)
@@ -0,0 +1,267 @@
+"""
+Region-restricted seal and logo detection.
+
+Running HoughCircles over a whole full-resolution page with a small minDist
+returns hundreds of circles on the guilloche backgrounds of marksheets, and
+costs more than any other structural extractor. Seals and logos sit in known
+places, so detection is restricted to them:
+
+1. Each template declares its seal/logo regions in templates/seal_regions.json,
+   as boxes in page fractions plus a radius range as a fraction of the page
+   width (the "default" entry covers documents without a template).
+2. Inside each region, the strongest circle is found at the low pyramid level.
+3. A hit is refined at the high level, in a small window around it, with
+   a narrow radius range.
+4. If the template is known, the region is also matched (normalized
+   cross-correlation) against the template's own seal, cut from the template
+   image once and cached until the image changes.
+
+Page fractions are only meaningful when the document fills the frame, which
+registered documents (see registration.py) do by construction.
+"""
+
+import json
+import logging
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from image_pyramid import CANONICAL_LEVEL
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+SEAL_REGIONS_FILE = os.getenv('SEAL_REGIONS_FILE', os.path.join(BASE_DIR, 'templates', 'seal_regions.json'))
+
+DETECT_LEVEL = 'low'
+REFINE_LEVEL = 'high'
+
+# Hough parameters (accumulator resolution, Canny high threshold, vote threshold)
+HOUGH_PARAM1 = 50
+HOUGH_PARAM2 = 30
+
+# Radius tolerance when refining a low-level hit at the high level
+REFINE_RADIUS_TOLERANCE = 0.2
+
+# Seal template scales tried, relative to the document page
+MATCH_SCALES = (0.9, 1.0, 1.1)
+
+# Normalized cross-correlation that counts as the template's seal
+MATCH_THRESHOLD = float(os.getenv('SEAL_MATCH_THRESHOLD', '0.5'))
+
+# Ink density of the upper left corner that counts as a logo (legacy heuristic)
+LOGO_DENSITY_THRESHOLD = 0.1
+
+
+class SealRegion:
+    """A declared seal/logo region: box and radius range in page fractions"""
+
+    __slots__ = ('name', 'kind', 'box', 'radius')
+
+    def __init__(self, name, kind, box, radius):
+        self.name = name
+        self.kind = kind
+        self.box = tuple(float(v) for v in box)
+        self.radius = tuple(float(v) for v in radius)
+
+    def pixels(self, shape):
+        """(x0, y0, x1, y1) box and (min, max) radius in pixels of an image of shape"""
+        h, w = shape[:2]
+        fx0, fy0, fx1, fy1 = self.box
+        box = (int(fx0 * w), int(fy0 * h), int(np.ceil(fx1 * w)), int(np.ceil(fy1 * h)))
+        radius = (max(1, int(self.radius[0] * w)), max(2, int(np.ceil(self.radius[1] * w))))
+        return box, radius
+
+
+_regions = {'signature': None, 'regions': {}}
+_seals = {}
+_lock = threading.Lock()
+
+
+def load_regions(path=None):
+    """Declared regions by template name, reloaded when the file changes"""
+    path = path or SEAL_REGIONS_FILE
+    try:
+        st = os.stat(path)
+        signature = (path, st.st_mtime_ns, st.st_size)
+    except OSError:
+        signature = (path, None, None)
+
+    with _lock:
+        if _regions['signature'] == signature:
+            return _regions['regions']
+
+    regions = {}
+    if signature[1] is not None:
+        try:
+            with open(path) as f:
+                declared = json.load(f)
+            regions = {name: [SealRegion(**entry) for entry in entries] for name, entries in declared.items()}
+        except (ValueError, TypeError) as e:
+            logger.error(f"Invalid seal regions file {path}: {e}")
+    with _lock:
+        _regions['signature'] = signature
+        _regions['regions'] = regions
+    return regions
+
+
+def regions_for(template_name=None, path=None):
+    """Declared regions of a template, falling back to the default regions"""
+    regions = load_regions(path)
+    return regions.get(template_name) or regions.get('default', [])
+
+
+def _strongest_circle(gray, radius):
+    """(x, y, r) of the strongest circle in a grayscale crop, or None"""
+    h, w = gray.shape[:2]
+    if min(h, w) < 2 * radius[0]:
+        return None
+    # minDist larger than the crop: the accumulator peak only
+    circles = cv2.HoughCircles(gray, cv2.HOUGH_GRADIENT, 1, max(h, w),
+                               param1=HOUGH_PARAM1, param2=HOUGH_PARAM2,
+                               minRadius=radius[0], maxRadius=radius[1])
+    if circles is None:
+        return None
+    x, y, r = circles[0, 0]
+    return float(x), float(y), float(r)
+
+
+def _refine(pyramid, circle):
+    """Refine a low-level circle at the refine level; returns it at that level"""
+    f = pyramid.factor(DETECT_LEVEL, REFINE_LEVEL)
+    x, y, r = (v * f for v in circle)
+    if f <= 1.0:
+        return x, y, r
+
+    # Only the window around the hit is resampled (or warped) at the refine level
+    h, w = pyramid.level_shape(REFINE_LEVEL)
+    margin = r * (1 + REFINE_RADIUS_TOLERANCE) + 2 * f
+    x0, y0 = max(0, int(x - margin)), max(0, int(y - margin))
+    x1, y1 = min(w, int(np.ceil(x + margin))), min(h, int(np.ceil(y + margin)))
+    crop = cv2.GaussianBlur(pyramid.crop(REFINE_LEVEL, (x0, y0, x1, y1)), (5, 5), 0)
+    radius = (max(1, int(r * (1 - REFINE_RADIUS_TOLERANCE))), int(np.ceil(r * (1 + REFINE_RADIUS_TOLERANCE))))
+    refined = _strongest_circle(crop, radius)
+    if refined is None:
+        return x, y, r
+    return refined[0] + x0, refined[1] + y0, refined[2]
+
+
+class SealTemplate:
+    """A template's own seal (or logo): grayscale patch at the detect level"""
+
+    def __init__(self, region, patch, circle):
+        self.region = region
+        self.patch = patch
+        self.circle = circle
+
+
+def seal_templates(frame):
+    """
+    Seal templates of a TemplateFrame (see registration.py), cut from the
+    template image around the circle found in each declared region. Cached
+    until the template image changes.
+    """
+    key = (frame.path, frame.signature)
+    with _lock:
+        cached = _seals.get(key)
+    if cached is not None:
+        return cached
+
+    low = frame.pyramid.context(DETECT_LEVEL)
+    templates = {}
+    for region in regions_for(frame.name):
+        (x0, y0, x1, y1), radius = region.pixels(low.shape)
+        circle = _strongest_circle(low.blur[y0:y1, x0:x1], radius)
+        if circle is None:
+            logger.warning(f"No {region.kind} found in region {region.name} of template {frame.name}")
+            continue
+        cx, cy, r = circle[0] + x0, circle[1] + y0, circle[2]
+        half = int(np.ceil(r * 1.1))
+        px0, py0 = max(0, int(cx) - half), max(0, int(cy) - half)
+        patch = low.gray[py0:int(cy) + half + 1, px0:int(cx) + half + 1].copy()
+        templates[region.name] = SealTemplate(region, patch, (cx, cy, r))
+
+    with _lock:
+        _seals[key] = templates
+    return templates
+
+
+def match_seal(gray, seal):
+    """Best normalized cross-correlation of a seal patch in a grayscale crop: (score, (x, y) of the centre)"""
+    best_score, best_center = -1.0, None
+    for scale in MATCH_SCALES:
+        patch = seal.patch if scale == 1.0 else cv2.resize(seal.patch, None, fx=scale, fy=scale,
+                                                            interpolation=cv2.INTER_AREA)
+        ph, pw = patch.shape
+        if ph > gray.shape[0] or pw > gray.shape[1]:
+            continue
+        scores = cv2.matchTemplate(gray, patch, cv2.TM_CCOEFF_NORMED)
+        _, score, _, location = cv2.minMaxLoc(scores)
+        if score > best_score:
+            best_score, best_center = float(score), (location[0] + pw / 2.0, location[1] + ph / 2.0)
+    return best_score, best_center
+
+
+def detect_seals(pyramid, frame=None, regions=None):
+    """
+    Find seals and logos of a document (ImagePyramid) in the declared
+    regions of a template. frame is the TemplateFrame of the template the
+    document was registered to, if any; it selects the template's regions and
+    enables matching against its seal. Returns the seal_positions feature
+    fields, with circles in canonical coordinates, plus per-region results.
+    """
+    if regions is None:
+        regions = regions_for(frame.name if frame is not None else None)
+    seals = seal_templates(frame) if frame is not None else {}
+
+    low = pyramid.context(DETECT_LEVEL)
+    to_canonical = pyramid.factor(REFINE_LEVEL, CANONICAL_LEVEL)
+    low_to_canonical = pyramid.factor(DETECT_LEVEL, CANONICAL_LEVEL)
+
+    circles = []
+    bottom_circles = []
+    found = {}
+    for region in regions:
+        (x0, y0, x1, y1), radius = region.pixels(low.shape)
+        entry = {'kind': region.kind, 'found': False, 'circle': None}
+
+        circle = _strongest_circle(low.blur[y0:y1, x0:x1], radius)
+        if circle is not None:
+            x, y, r = _refine(pyramid, (circle[0] + x0, circle[1] + y0, circle[2]))
+            entry['circle'] = [int(round(v * to_canonical)) for v in (x, y, r)]
+
+        seal = seals.get(region.name)
+        if seal is not None:
+            score, center = match_seal(low.gray[y0:y1, x0:x1], seal)
+            entry['match_score'] = round(score, 4)
+            if score >= MATCH_THRESHOLD and entry['circle'] is None:
+                # Matched without a clean circle (e.g. glare on a hologram)
+                r = seal.circle[2]
+                entry['circle'] = [int(round(v * low_to_canonical)) for v in (center[0] + x0, center[1] + y0, r)]
+            entry['found'] = score >= MATCH_THRESHOLD
+        else:
+            entry['found'] = entry['circle'] is not None
+
+        if entry['found'] and entry['circle'] is not None:
+            circles.append(entry['circle'])
+            if region.kind == 'seal':
+                bottom_circles.append(entry['circle'])
+        found[region.name] = entry
+
+    # Legacy logo heuristic: ink density of the upper left corner
+    processed = low.processed
+    h, w = processed.shape
+    upper_left = processed[:h // 4, :w // 4]
+    upper_left_density = float(np.count_nonzero(upper_left)) / upper_left.size if upper_left.size else 0.0
+
+    return {
+        'circles': circles,
+        'bottom_circles': bottom_circles,
+        'upper_left_density': upper_left_density,
+        'has_logo_pattern': (upper_left_density > LOGO_DENSITY_THRESHOLD
+                             or any(e['found'] for e in found.values() if e['kind'] == 'logo')),
+        'has_seal_pattern': len(bottom_circles) > 0,
+        'regions': found,
+    }
@@ -0,0 +1,378 @@
+"""
+Synthetic SSC/HSC marksheets for benchmarks and load tests.
+
+Two kinds of marksheet:
+
+- render_marksheet() draws one from scratch like generate_test_images.py
+  (header, student details, a table of subjects and marks, a round board
+  seal and a signature) at any resolution: coordinates and font sizes scale
+  with the page, so a 12 MP "phone photo" has as much detail as a real one.
+- render_from_template() starts from a real scan in templates/ and replaces
+  the seat number, names and marks in the regions listed in
+  TEMPLATE_LAYOUTS, so the paper colour, seal, guilloche and QR code are
+  those of a real marksheet.
+
+distort() then turns either into a phone-camera style photo (perspective,
+rotation, blur, lighting, JPEG quality).
+
+    python synthetic_marksheets.py out_dir [--count N] [--resolution NAME] [--seed S]
+                                   [--from-templates] [--distort]
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
+
+# Layout is designed at this size (the size of the SSC template scans)
+BASE_SIZE = (1116, 1600)
+
+# Named resolutions, (width, height) in pixels
+RESOLUTIONS = {
+    'scan': BASE_SIZE,
+    'a4_150dpi': (1240, 1754),
+    'a4_300dpi': (2480, 3508),
+    'phone_12mp': (3024, 4032),
+}
+
+BOARDS = {
+    'SSC': {
+        'title': 'SECONDARY SCHOOL CERTIFICATE EXAMINATION',
+        'subjects': ['FIRST LANGUAGE MARATHI', 'SECOND LANGUAGE HINDI', 'THIRD LANGUAGE ENGLISH',
+                     'MATHEMATICS', 'SCIENCE AND TECHNOLOGY', 'SOCIAL SCIENCES'],
+    },
+    'HSC': {
+        'title': 'HIGHER SECONDARY CERTIFICATE EXAMINATION',
+        'subjects': ['ENGLISH', 'MARATHI', 'PHYSICS', 'CHEMISTRY', 'MATHEMATICS AND STATISTICS', 'BIOLOGY'],
+    },
+}
+
+FIRST_NAMES = ['AARAV', 'ADITI', 'ANANYA', 'ARJUN', 'DIYA', 'ISHAAN', 'KAVYA', 'MIHIR', 'NEHA', 'OMKAR',
+               'PRIYA', 'RAHUL', 'RIYA', 'ROHAN', 'SAKSHI', 'SANIKA', 'SIDDHARTH', 'TANVI', 'VEDANT', 'YASH']
+LAST_NAMES = ['DESHMUKH', 'JOSHI', 'KULKARNI', 'PATIL', 'PAWAR', 'SHINDE', 'JADHAV', 'GAIKWAD',
+              'CHAVAN', 'KALE', 'MORE', 'NAIK', 'SAWANT', 'BHOSALE', 'KADAM']
+DIVISIONAL_BOARDS = ['PUNE', 'MUMBAI', 'NAGPUR', 'NASHIK', 'KOLHAPUR', 'AURANGABAD', 'AMRAVATI', 'LATUR']
+
+
+# Regions of the template scans that hold student data, in pixels of the
+# scan. Each subject row is (marks in figures, marks in words, maximum marks).
+TEMPLATE_LAYOUTS = {
+    'marksheet ssc 3.jpg': {
+        'board': 'SSC',
+        'seat': (95, 375, 235, 405),
+        'name': (560, 465, 900, 500),
+        'mother': (780, 508, 960, 540),
+        'percentage': (250, 1105, 330, 1135),
+        'total': (685, 1093, 745, 1125),
+        'total_words': (792, 1095, 1015, 1145),
+        'rows': [((662, 662 + 36 * i, 722, 690 + 36 * i), (795, 662 + 36 * i, 1000, 690 + 36 * i), 100)
+                 for i in range(6)],
+        'subjects': ['ENGLISH', 'SANSKRIT', 'MARATHI', 'MATHEMATICS', 'SCIENCE & TECHNOLOGY', 'SOCIAL SCIENCES'],
+    },
+    'marksheet hsc .jpg': {
+        'board': 'HSC',
+        'seat': (268, 404, 392, 440),
+        'name': (470, 508, 680, 542),
+        'mother': (668, 572, 752, 600),
+        'percentage': (300, 1132, 388, 1162),
+        'total': (655, 1118, 725, 1165),
+        'total_words': (738, 1118, 990, 1178),
+        'rows': [((655, 720 + 30 * i, 712, 746 + 30 * i), (738, 720 + 30 * i, 960, 746 + 30 * i), 100)
+                 for i in range(4)] + [((655, 840, 712, 866), (738, 838, 990, 892), 200)],
+        'subjects': ['ENGLISH', 'MATHEMATICS & STATISTICS', 'PHYSICS', 'CHEMISTRY', 'COMPUTER SCIENCE'],
+    },
+}
+
+# Largest font size for filled-in values, about the size of the printed ones
+TEMPLATE_TEXT_SIZE = 24
+
+ONES = ['ZERO', 'ONE', 'TWO', 'THREE', 'FOUR', 'FIVE', 'SIX', 'SEVEN', 'EIGHT', 'NINE', 'TEN', 'ELEVEN',
+        'TWELVE', 'THIRTEEN', 'FOURTEEN', 'FIFTEEN', 'SIXTEEN', 'SEVENTEEN', 'EIGHTEEN', 'NINETEEN']
+TENS = ['', '', 'TWENTY', 'THIRTY', 'FORTY', 'FIFTY', 'SIXTY', 'SEVENTY', 'EIGHTY', 'NINETY']
+
+
+def marks_in_words(n):
+    """Marks as printed on the boards' marksheets, e.g. 87 -> EIGHTYSEVEN"""
+    if n >= 100:
+        hundreds, rest = divmod(n, 100)
+        words = f"{ONES[hundreds]} HUNDRED"
+        return f"{words} AND {marks_in_words(rest)}" if rest else words
+    if n < 20:
+        return ONES[n]
+    tens, ones = divmod(n, 10)
+    return TENS[tens] + (ONES[ones] if ones else '')
+
+
+def random_student(rng, board=None, subjects=None):
+    """
+    Random student record with the keys used by /extract and /generate-pdf.
+    subjects is an optional list of (name, maximum marks).
+    """
+    board = board or rng.choice(list(BOARDS))
+    subjects = subjects or [(subject, 100) for subject in BOARDS[board]['subjects']]
+    marks = {subject: rng.randint(int(maximum * 0.35), maximum) for subject, maximum in subjects}
+    total = sum(marks.values())
+    maximum_total = sum(maximum for _, maximum in subjects)
+    return {
+        'studentName': f"{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)} {rng.choice(FIRST_NAMES)}",
+        'motherName': rng.choice(FIRST_NAMES),
+        'rollNumber': f"{rng.choice('ABCDEFGHJKLMNPRS')}{rng.randint(100000, 999999)}",
+        'examYear': str(rng.randint(2015, 2025)),
+        'board': f"MAHARASHTRA STATE BOARD, {rng.choice(DIVISIONAL_BOARDS)} DIVISIONAL BOARD",
+        'program': board,
+        'batch': '',
+        'marks': marks,
+        'total': total,
+        'maxTotal': maximum_total,
+        'percentage': round(total * 100 / maximum_total, 2),
+    }
+
+
+def _font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 has a single fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+def render_marksheet(student, size=BASE_SIZE):
+    """Draw the marksheet of student as an RGB PIL image of the given size"""
+    width, height = size
+    sx, sy = width / BASE_SIZE[0], height / BASE_SIZE[1]
+    s = min(sx, sy)
+
+    def pt(x, y):
+        return (int(x * sx), int(y * sy))
+
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    line = max(1, int(2 * s))
+    title_font, text_font, small_font = _font(int(30 * s)), _font(int(20 * s)), _font(int(16 * s))
+
+    board = student['program']
+    draw.text(pt(120, 50), 'MAHARASHTRA STATE BOARD OF SECONDARY AND', fill='black', font=title_font)
+    draw.text(pt(200, 90), 'HIGHER SECONDARY EDUCATION, PUNE', fill='black', font=title_font)
+    draw.text(pt(180, 150), BOARDS[board]['title'], fill='black', font=text_font)
+    draw.text(pt(380, 185), f"STATEMENT OF MARKS - {student['examYear']}", fill='black', font=text_font)
+
+    draw.text(pt(60, 240), f"SEAT NO : {student['rollNumber']}", fill='black', font=text_font)
+    draw.text(pt(60, 275), f"CANDIDATE'S FULL NAME : {student['studentName']}", fill='black', font=text_font)
+    draw.text(pt(60, 310), f"CANDIDATE'S MOTHER'S NAME : {student['motherName']}", fill='black', font=text_font)
+    draw.text(pt(60, 345), student['board'], fill='black', font=small_font)
+
+    # Subjects table
+    top, row_height = 400, 70
+    rows = len(student['marks']) + 2
+    bottom = top + rows * row_height
+    for i in range(rows + 1):
+        draw.line([pt(50, top + i * row_height), pt(1066, top + i * row_height)], fill='black', width=line)
+    for x in (50, 650, 850, 1066):
+        draw.line([pt(x, top), pt(x, bottom)], fill='black', width=line)
+
+    draw.text(pt(60, top + 20), 'SUBJECT', fill='black', font=text_font)
+    draw.text(pt(660, top + 20), 'MAX MARKS', fill='black', font=text_font)
+    draw.text(pt(860, top + 20), 'MARKS OBTAINED', fill='black', font=text_font)
+    for i, (subject, mark) in enumerate(student['marks'].items(), start=1):
+        y = top + i * row_height + 20
+        draw.text(pt(60, y), subject, fill='black', font=text_font)
+        draw.text(pt(700, y), '100', fill='black', font=text_font)
+        draw.text(pt(900, y), f"{mark:03d}", fill='black', font=text_font)
+    y = bottom - row_height + 20
+    draw.text(pt(60, y), f"TOTAL MARKS   PERCENTAGE {student['percentage']}", fill='black', font=text_font)
+    draw.text(pt(700, y), str(student['maxTotal']), fill='black', font=text_font)
+    draw.text(pt(900, y), str(student['total']), fill='black', font=text_font)
+
+    # Board seal and signature
+    seal = (90, bottom + 60, 250, bottom + 220)
+    draw.ellipse([pt(*seal[:2]), pt(*seal[2:])], outline='black', width=line)
+    draw.ellipse([pt(seal[0] + 15, seal[1] + 15), pt(seal[2] - 15, seal[3] - 15)], outline='black', width=line)
+    draw.text(pt(seal[0] + 30, seal[1] + 70), 'BOARD SEAL', fill='black', font=small_font)
+    draw.line([pt(800, bottom + 160), pt(840, bottom + 120), pt(880, bottom + 170), pt(930, bottom + 110),
+               pt(990, bottom + 165)], fill='black', width=line)
+    draw.text(pt(800, bottom + 190), 'DIVISIONAL SECRETARY', fill='black', font=small_font)
+
+    return image
+
+
+def template_student(rng, template_name):
+    """Random student for a template scan in TEMPLATE_LAYOUTS"""
+    layout = TEMPLATE_LAYOUTS[template_name]
+    subjects = [(subject, row[2]) for subject, row in zip(layout['subjects'], layout['rows'])]
+    student = random_student(rng, layout['board'], subjects)
+    student['template'] = template_name
+    return student
+
+
+def _paint_text(draw, image, box, text, lines=1, color=(35, 30, 40)):
+    """Cover box with the surrounding paper colour and write text in it, sized for lines lines"""
+    x1, y1, x2, y2 = box
+    pixels = np.asarray(image)
+    ring = np.concatenate([
+        pixels[max(0, y1 - 4):y1, x1:x2].reshape(-1, 3),
+        pixels[y2:y2 + 4, x1:x2].reshape(-1, 3),
+    ])
+    paper = tuple(int(v) for v in np.median(ring, axis=0)) if ring.size else (255, 255, 255)
+    draw.rectangle(box, fill=paper)
+
+    text_lines = text.split('\n')
+    lines = max(lines, len(text_lines))
+    size = min(int((y2 - y1) / lines * 0.85), TEMPLATE_TEXT_SIZE)
+    font = _font(size)
+    while size > 8 and max(draw.textlength(line, font=font) for line in text_lines) > x2 - x1:
+        size -= 1
+        font = _font(size)
+    for i, line in enumerate(text_lines):
+        draw.text((x1 + 2, y1 + i * (y2 - y1) / lines), line, fill=color, font=font)
+
+
+def render_from_template(student, template_name=None):
+    """Fill a template scan with the data of student; returns an RGB PIL image"""
+    template_name = template_name or student['template']
+    layout = TEMPLATE_LAYOUTS[template_name]
+    image = Image.open(os.path.join(TEMPLATE_DIR, template_name)).convert('RGB')
+    draw = ImageDraw.Draw(image)
+
+    _paint_text(draw, image, layout['seat'], student['rollNumber'])
+    _paint_text(draw, image, layout['name'], student['studentName'].title())
+    _paint_text(draw, image, layout['mother'], student['motherName'].title())
+    _paint_text(draw, image, layout['percentage'], f"{student['percentage']:.2f}")
+    _paint_text(draw, image, layout['total'], str(student['total']))
+    _paint_text(draw, image, layout['total_words'], _wrap(marks_in_words(student['total']), 16), lines=2)
+    for (figures, words, _), mark in zip(layout['rows'], student['marks'].values()):
+        # Word boxes taller than a row hold two lines
+        two_lines = words[3] - words[1] > 40
+        _paint_text(draw, image, figures, f"{mark:03d}")
+        _paint_text(draw, image, words, _wrap(marks_in_words(mark), 16) if two_lines else marks_in_words(mark),
+                    lines=2 if two_lines else 1)
+    return image
+
+
+def _wrap(text, width):
+    """Break text into two lines if it is longer than width characters"""
+    if len(text) <= width or ' ' not in text:
+        return text
+    cut = text.rfind(' ', 0, width + 1)
+    cut = cut if cut > 0 else text.find(' ')
+    return text[:cut] + '\n' + text[cut + 1:]
+
+
+def distort(image, rng, rotation=4.0, perspective=0.06, blur=1.5, jpeg_quality=(55, 95),
+            size=None, background=(60, 55, 50)):
+    """
+    Make a phone-camera style photo of a flat marksheet image (PIL RGB).
+
+    rotation is the largest in-plane rotation in degrees, perspective the
+    largest corner displacement as a fraction of the page, blur the largest
+    Gaussian sigma in pixels and jpeg_quality a (min, max) range. The page is
+    placed on a dark background with uneven lighting. Returns
+    (JPEG bytes, parameters used).
+    """
+    page = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+    height, width = page.shape[:2]
+    out_w, out_h = size or (width, height)
+
+    # Page corners: shrink into the frame, then jitter each corner and rotate
+    margin = 0.06
+    corners = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    target = np.float32([[margin, margin], [1 - margin, margin], [1 - margin, 1 - margin], [margin, 1 - margin]])
+    target += np.float32([[rng.uniform(-perspective, perspective), rng.uniform(-perspective, perspective)]
+                          for _ in range(4)])
+    target *= np.float32([out_w, out_h])
+    angle = rng.uniform(-rotation, rotation)
+    rotate = cv2.getRotationMatrix2D((out_w / 2, out_h / 2), angle, 1.0)
+    target = cv2.transform(target[None], rotate)[0].astype(np.float32)
+
+    matrix = cv2.getPerspectiveTransform(corners, target)
+    photo = cv2.warpPerspective(page, matrix, (out_w, out_h), flags=cv2.INTER_LINEAR,
+                                borderMode=cv2.BORDER_CONSTANT, borderValue=background)
+
+    # Uneven lighting: a brightness gradient in a random direction
+    strength = rng.uniform(0.0, 0.25)
+    direction = rng.uniform(0, 2 * np.pi)
+    ys, xs = np.mgrid[0:out_h, 0:out_w].astype(np.float32)
+    ramp = (np.cos(direction) * xs / out_w + np.sin(direction) * ys / out_h)
+    ramp = 1.0 - strength * (ramp - ramp.min()) / max(float(np.ptp(ramp)), 1e-6)
+    photo = np.clip(photo.astype(np.float32) * ramp[:, :, None], 0, 255).astype(np.uint8)
+
+    sigma = rng.uniform(0, blur)
+    if sigma > 0.3:
+        photo = cv2.GaussianBlur(photo, (0, 0), sigma)
+
+    quality = rng.randint(*jpeg_quality)
+    ok, encoded = cv2.imencode('.jpg', photo, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError('Could not encode distorted image')
+    params = {'rotation': round(angle, 2), 'blur_sigma': round(sigma, 2), 'jpeg_quality': quality,
+              'lighting': round(strength, 3), 'size': [out_w, out_h]}
+    return encoded.tobytes(), params
+
+
+def random_marksheet(rng, resolution=None, from_templates=True, distorted=True):
+    """
+    One random marksheet as (JPEG bytes, student, distortion parameters).
+    resolution is the (width, height) of the result; template marksheets
+    keep the size of their scan when it is None.
+    """
+    if from_templates:
+        student = template_student(rng, rng.choice(sorted(TEMPLATE_LAYOUTS)))
+        image = render_from_template(student)
+    else:
+        student = random_student(rng)
+        image = render_marksheet(student, resolution or BASE_SIZE)
+
+    if distorted:
+        data, params = distort(image, rng, size=resolution)
+        return data, student, params
+
+    if resolution and image.size != tuple(resolution):
+        image = image.resize(resolution, Image.BICUBIC)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=95)
+    return buffer.getvalue(), student, {}
+
+
+def to_bgr(image):
+    """PIL RGB image as an OpenCV BGR array"""
+    return np.asarray(image)[:, :, ::-1].copy()
+
+
+def write_marksheet(path, student, size=BASE_SIZE, quality=95):
+    render_marksheet(student, size).save(path, quality=quality)
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write synthetic SSC/HSC marksheets.')
+    parser.add_argument('out_dir')
+    parser.add_argument('--count', type=int, default=10)
+    parser.add_argument('--resolution', choices=sorted(RESOLUTIONS),
+                        help='output size (default: scan size, or the template size with --from-templates)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--from-templates', action='store_true', help='fill in the template scans')
+    parser.add_argument('--distort', action='store_true', help='make phone-camera style photos')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    resolution = RESOLUTIONS[args.resolution] if args.resolution else None
+    os.makedirs(args.out_dir, exist_ok=True)
+    with open(os.path.join(args.out_dir, 'manifest.jsonl'), 'w') as manifest:
+        for i in range(args.count):
+            path = os.path.join(args.out_dir, f"marksheet_{i:05d}.jpg")
+            if args.from_templates or args.distort:
+                data, student, params = random_marksheet(rng, resolution, args.from_templates, args.distort)
+                with open(path, 'wb') as f:
+                    f.write(data)
+            else:
+                student, params = random_student(rng), {}
+                write_marksheet(path, student, resolution or BASE_SIZE)
+            manifest.write(json.dumps({'path': os.path.basename(path), 'student': student, 'distortion': params}) + '\n')
+            print(path)
@@ -0,0 +1,265 @@
+"""
+In-memory template registry with hot reload.
+
+Trained template features live on disk: .npy files in TEMPLATE_DIR (written
+by /train, /upload_template and train_templates.py) and .json files in
+server/data/features (written by scripts/train_template.py). The registry
+loads them once, then watches both directories by polling file signatures
+(mtime, size). Changed files are loaded and validated off to the side and
+swapped in by replacing the whole snapshot (copy-on-write): unchanged entries
+are shared with the previous snapshot, and a request that grabbed a snapshot
+keeps seeing exactly that set of templates until it finishes.
+
+Each snapshot also carries an LSH index of its templates' text signatures
+(see text_similarity.py), built on first use, so candidate templates for a
+document's text are found without comparing against every template.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from types import MappingProxyType
+
+import numpy as np
+
+from text_similarity import LshIndex, signature_of
+
+logger = logging.getLogger(__name__)
+
+# Seconds between directory scans
+DEFAULT_POLL_INTERVAL = 2.0
+
+# Feature file extension for each source
+SOURCE_EXTENSIONS = {
+    'templates': '.npy',
+    'features': '.json',
+}
+
+# At least one of these keys must be present in a feature file
+REQUIRED_FEATURE_KEYS = ('text', 'edge_density')
+
+
+class TemplateEntry:
+    """One trained template: its features and where they came from"""
+
+    __slots__ = ('name', 'source', 'path', 'signature', 'features', '_text', '_text_signature')
+
+    def __init__(self, name, source, path, signature, features):
+        self.name = name
+        self.source = source
+        self.path = path
+        self.signature = signature
+        self.features = features
+        self._text = None
+        self._text_signature = None
+
+    @property
+    def text(self):
+        """The template's OCR text as a string"""
+        if self._text is None:
+            self._text = str(self.features.get('text', '') or '')
+        return self._text
+
+    @property
+    def text_signature(self):
+        """TextSignature of the template's text (stored at training time, else computed once)"""
+        if self._text_signature is None:
+            self._text_signature = signature_of(self.features)
+        return self._text_signature
+
+    def __repr__(self):
+        return f"TemplateEntry({self.source}:{self.name})"
+
+
+class TemplateSnapshot:
+    """Immutable set of templates, keyed by (source, name)"""
+
+    def __init__(self, entries, version):
+        self._entries = MappingProxyType(dict(entries))
+        self.version = version
+        self.created_at = time.time()
+        self._text_indexes = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, name, source='templates'):
+        return self._entries.get((source, name))
+
+    def entries(self, source='templates'):
+        """Entries of one source, sorted by name"""
+        return [entry for (src, _), entry in sorted(self._entries.items()) if src == source]
+
+    def names(self, source='templates'):
+        return [entry.name for entry in self.entries(source)]
+
+    def text_index(self, source='templates'):
+        """LshIndex of the text signatures of one source, by template name"""
+        index = self._text_indexes.get(source)
+        if index is None:
+            # Built at most a few times concurrently; every build is identical
+            index = LshIndex()
+            for entry in self.entries(source):
+                index.add(entry.name, entry.text_signature)
+            self._text_indexes[source] = index
+        return index
+
+
+def validate_features(features):
+    """Return an error message if a loaded feature object is unusable, else None"""
+    if not isinstance(features, dict):
+        return f"expected a dict of features, got {type(features).__name__}"
+    if not any(key in features for key in REQUIRED_FEATURE_KEYS):
+        return f"missing all of {', '.join(REQUIRED_FEATURE_KEYS)}"
+    if 'text' in features and not isinstance(features['text'], str):
+        return "'text' is not a string"
+    return None
+
+
+def load_feature_file(path):
+    """Load a .npy or .json feature file into a dict"""
+    if path.endswith('.npy'):
+        data = np.load(path, allow_pickle=True)
+        return data.item() if isinstance(data, np.ndarray) and data.shape == () else data
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class TemplateRegistry:
+    """
+    Watches template feature directories and publishes consistent snapshots.
+
+    Call snapshot() once per request and use only that snapshot. If the
+    background watcher is not running (e.g. right after a fork), snapshot()
+    rescans at most once per poll interval instead.
+    """
+
+    def __init__(self, template_dir, features_dir=None, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.directories = {'templates': template_dir}
+        if features_dir:
+            self.directories['features'] = features_dir
+        self.poll_interval = poll_interval
+
+        self._snapshot = TemplateSnapshot({}, version=0)
+        self._refresh_lock = threading.Lock()
+        self._failed = {}
+        self._last_scan = 0.0
+        self._thread = None
+        self._thread_pid = None
+        self._stop = threading.Event()
+
+    def snapshot(self):
+        """The current snapshot of all templates"""
+        if not self.watching and time.monotonic() - self._last_scan >= self.poll_interval:
+            self.refresh()
+        return self._snapshot
+
+    def _scan(self):
+        """Feature files on disk: {(source, name): (path, signature)}"""
+        found = {}
+        for source, directory in self.directories.items():
+            extension = SOURCE_EXTENSIONS[source]
+            try:
+                filenames = os.listdir(directory)
+            except OSError:
+                continue
+            for filename in filenames:
+                if not filename.endswith(extension):
+                    continue
+                name = filename[:-len(extension)].strip()
+                if not name:
+                    continue
+                path = os.path.join(directory, filename)
+                try:
+                    found[(source, name)] = (path, file_signature(path))
+                except OSError:
+                    # Removed between listdir and stat
+                    continue
+        return found
+
+    def refresh(self):
+        """
+        Rescan the directories and swap in a new snapshot if anything changed.
+        Returns True if a new snapshot was published.
+        """
+        with self._refresh_lock:
+            self._last_scan = time.monotonic()
+            current = self._snapshot
+            found = self._scan()
+            entries = {}
+            changed = False
+
+            for key, (path, signature) in found.items():
+                old = current.get(key[1], key[0])
+                if old is not None and old.path == path and old.signature == signature:
+                    entries[key] = old
+                    continue
+                if self._failed.get(path) == signature:
+                    # Already rejected this version of the file; keep the previous entry if any
+                    if old is not None:
+                        entries[key] = old
+                    continue
+
+                try:
+                    features = load_feature_file(path)
+                    error = validate_features(features)
+                except Exception as e:
+                    error = str(e)
+
+                if error:
+                    logger.warning(f"Rejected template features {path}: {error}")
+                    self._failed[path] = signature
+                    if old is not None:
+                        entries[key] = old
+                    continue
+
+                self._failed.pop(path, None)
+                entries[key] = TemplateEntry(key[1], key[0], path, signature, MappingProxyType(features))
+                # Text signature off the request path, with the rest of the loading
+                entries[key].text_signature
+                changed = True
+                logger.info(f"{'Reloaded' if old is not None else 'Loaded'} template {key[0]}:{key[1]}")
+
+            removed = [key for key in current._entries if key not in entries]
+            for key in removed:
+                logger.info(f"Removed template {key[0]}:{key[1]}")
+                changed = True
+
+            if changed:
+                self._snapshot = TemplateSnapshot(entries, version=current.version + 1)
+            return changed
+
+    @property
+    def watching(self):
+        return (self._thread is not None and self._thread.is_alive()
+                and self._thread_pid == os.getpid())
+
+    def start(self):
+        """Start the background watcher (safe to call again, e.g. after fork)"""
+        if self.watching:
+            return
+        self._stop.clear()
+        self.refresh()
+        self._thread = threading.Thread(target=self._watch, name='template-registry', daemon=True)
+        self._thread_pid = os.getpid()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread_pid == os.getpid():
+            self._thread.join(timeout=self.poll_interval + 1)
+        self._thread = None
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Template registry refresh failed: {str(e)}")
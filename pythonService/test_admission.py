@@ -0,0 +1,115 @@
+"""
+Checks that the admission gates, with the limits derived for the shipped
+gunicorn settings, queue and shed CPU-heavy requests.
+
+Usage:
+    python -m pytest test_admission.py
+    python test_admission.py
+"""
+
+import os
+import threading
+import time
+from unittest import mock
+
+from flask import Flask, jsonify
+
+from admission import admission_controlled, default_concurrency, default_queue, gate_from_env
+
+CORES = os.cpu_count() or 1
+
+# gunicorn.conf.py defaults: one worker per core, 4 threads each
+SHIPPED_ENV = {'WEB_CONCURRENCY': str(CORES), 'GUNICORN_THREADS': '4'}
+
+
+def test_defaults_follow_gunicorn_settings():
+    with mock.patch.dict(os.environ, SHIPPED_ENV):
+        assert default_concurrency() == 1
+        assert default_queue(1) == 2
+    with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '1', 'GUNICORN_THREADS': '2'}):
+        # Always below the thread count, or the gate could never engage
+        assert default_concurrency() == 1
+        assert default_queue(1) == 0
+    with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '1'}):
+        os.environ.pop('GUNICORN_THREADS', None)
+        assert default_concurrency() == CORES
+        assert default_queue(CORES) == 2 * CORES
+
+
+def gated_app(gate, release):
+    """Flask app with one view held by the gate until release is set"""
+    app = Flask(__name__)
+
+    @app.route('/verify', methods=['POST'])
+    @admission_controlled(gate)
+    def verify():
+        release.wait(10)
+        return jsonify({'success': True})
+
+    return app
+
+
+def send_concurrently(app, count, gate, admitted):
+    """
+    Send count requests from as many threads, waiting until the gate holds
+    admitted of them (running or waiting) before sending the rest
+    """
+    statuses = [None] * count
+    headers = [None] * count
+
+    def send(i):
+        response = app.test_client().post('/verify')
+        statuses[i], headers[i] = response.status_code, response.headers
+
+    threads = [threading.Thread(target=send, args=(i,)) for i in range(count)]
+    for i, thread in enumerate(threads):
+        thread.start()
+        if i < admitted:
+            deadline = time.monotonic() + 5
+            while gate.active + gate.waiting <= i and time.monotonic() < deadline:
+                time.sleep(0.005)
+    return threads, statuses, headers
+
+
+def test_shipped_limits_reject_with_429():
+    with mock.patch.dict(os.environ, SHIPPED_ENV):
+        gate = gate_from_env('verify')
+    release = threading.Event()
+    app = gated_app(gate, release)
+
+    # As many requests as one gunicorn worker's threads: 1 runs, 2 wait, 1 is rejected
+    threads, statuses, headers = send_concurrently(app, 4, gate, admitted=3)
+    threads[3].join(5)
+    assert statuses[3] == 429
+    assert int(headers[3]['Retry-After']) >= 1
+    assert (gate.active, gate.waiting) == (1, 2)
+
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert statuses[:3] == [200, 200, 200]
+    metrics = gate.metrics()
+    assert metrics['admitted'] == 3 and metrics['rejectedQueueFull'] == 1
+
+
+def test_waiting_too_long_gets_503():
+    env = {**SHIPPED_ENV, 'ADMISSION_VERIFY_TIMEOUT': '0.2'}
+    with mock.patch.dict(os.environ, env):
+        gate = gate_from_env('verify')
+    release = threading.Event()
+    app = gated_app(gate, release)
+
+    threads, statuses, _ = send_concurrently(app, 2, gate, admitted=2)
+    threads[1].join(5)
+    assert statuses[1] == 503
+    release.set()
+    threads[0].join(5)
+    assert statuses[0] == 200
+    assert gate.metrics()['rejectedTimeout'] == 1
+
+
+if __name__ == '__main__':
+    for test in (test_defaults_follow_gunicorn_settings, test_shipped_limits_reject_with_429,
+                 test_waiting_too_long_gets_503):
+        test()
+        print(f"ok  {test.__name__}")
@@ -0,0 +1,81 @@
+"""
+Smoke test of the feature extraction in app_fixed.py: the module imports,
+and extract_features runs every extractor on its pyramid level, from a plain
+image, a DocumentContext and a document registered to a template.
+
+Usage:
+    python -m pytest test_app_fixed.py
+    python test_app_fixed.py
+"""
+
+import glob
+import os
+
+import cv2
+
+import app_fixed
+from grid_features import grid_cell_features
+from image_pyramid import ImagePyramid
+from preprocess_context import DocumentContext
+from registration import register
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
+TEMPLATE = os.path.join(TEMPLATE_DIR, 'marksheet hsc .jpg')
+
+
+def check_features(features, pyramid):
+    canonical = pyramid.context('canonical')
+    assert (features['dimensions']['height'], features['dimensions']['width']) == canonical.shape
+
+    # Vectorized grid features (user-028), from the canonical level
+    grid, edges = grid_cell_features(canonical.rgb, grid_size=8, gray=canonical.gray)
+    assert features['grid_features'] == grid and features['edge_density'] == edges
+
+    # Projection-profile tables (user-042) and region seals (user-043)
+    for key in ('horizontal_lines', 'vertical_lines', 'cells', 'cell_count', 'has_table'):
+        assert key in features['table_structure'], key
+    assert features['seal_positions']['regions']
+
+    # Every extractor ran on its declared level (user-030)
+    levels = features['pyramid']['levels']
+    assert 'grid_cell_features' in levels['canonical']['extractors_ms']
+    assert 'extract_table_structure' in levels['low']['extractors_ms']
+
+
+def test_extract_features_from_image():
+    image = cv2.imread(TEMPLATE)
+    features = app_fixed.extract_features(image)
+    check_features(features, ImagePyramid(image))
+
+
+def test_extract_features_from_context():
+    # One shared context per document (user-029)
+    image = cv2.imread(TEMPLATE)
+    features = app_fixed.extract_features(DocumentContext(image))
+    check_features(features, ImagePyramid(image))
+
+
+def test_extract_features_registered():
+    registered = register(ImagePyramid(cv2.imread(TEMPLATE)), glob.glob(os.path.join(TEMPLATE_DIR, '*.jpg')))
+    assert registered is not None and registered.frame.path == TEMPLATE
+    features = app_fixed.extract_features(registered)
+    check_features(features, registered)
+    # The template's own scan matches its seals
+    assert features['seal_positions']['has_seal_pattern']
+
+
+def test_board_keywords():
+    # Keyword automaton (user-044)
+    text = 'MAHARASHTRA STATE BOARD OF SECONDARY AND HIGHER SECONDARY EDUCATION, PUNE\n' \
+           'HIGHER SECONDARY CERTIFICATE EXAMINATION STATEMENT OF MARKS'
+    hsc = app_fixed.detect_maharashtra_hsc(text)
+    assert hsc['is_maharashtra_hsc'] and hsc['is_maharashtra'] and hsc['is_board']
+    assert not app_fixed.detect_maharashtra_ssc('unrelated text')['is_maharashtra_ssc']
+
+
+if __name__ == '__main__':
+    for test in (test_extract_features_from_image, test_extract_features_from_context,
+                 test_extract_features_registered, test_board_keywords):
+        test()
+        print(f"ok  {test.__name__}")
@@ -0,0 +1,67 @@
+"""
+Checks that grid_features reproduces the per-cell loops it replaced exactly.
+
+Usage:
+    python -m pytest test_grid_features.py
+    python test_grid_features.py
+"""
+
+import os
+
+import cv2
+import numpy as np
+
+from bench_grid_features import legacy_grid_features, legacy_region_densities
+from grid_features import cell_sums, grid_cell_features, proportional_bounds, region_densities, uniform_bounds
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
+
+
+def sample_images():
+    """Template scans, plus blurred noise of odd sizes (cells that do not divide evenly)"""
+    for name in sorted(os.listdir(TEMPLATE_DIR)):
+        if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            img = cv2.imread(os.path.join(TEMPLATE_DIR, name))
+            if img is not None:
+                yield name, cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    rng = np.random.default_rng(0)
+    for i in range(10):
+        h, w = rng.integers(8, 700, 2)
+        noise = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+        yield f"noise {w}x{h}", cv2.GaussianBlur(noise, (5, 5), 0)
+
+
+def test_grid_cell_features_match_legacy():
+    for name, rgb in sample_images():
+        for grid_size in (8, 5, 1):
+            assert grid_cell_features(rgb, grid_size) == legacy_grid_features(rgb, grid_size), (name, grid_size)
+
+
+def test_shared_gray_matches():
+    for name, rgb in sample_images():
+        gray = cv2.cvtColor(cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR), cv2.COLOR_BGR2GRAY)
+        assert grid_cell_features(rgb, 8, gray=gray) == legacy_grid_features(rgb, 8), name
+
+
+def test_region_densities_match_legacy():
+    for name, rgb in sample_images():
+        edges = cv2.Canny(cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY), 50, 150)
+        assert region_densities(edges, 3) == legacy_region_densities(edges, 3), name
+
+
+def test_cell_sums():
+    rng = np.random.default_rng(1)
+    image = rng.integers(0, 256, (101, 77, 3), dtype=np.uint8)
+    for ys, xs in ((uniform_bounds(101, 4), uniform_bounds(77, 4)),
+                   (proportional_bounds(101, 3), proportional_bounds(77, 3))):
+        expected = [[int(image[ys[i]:ys[i + 1], xs[j]:xs[j + 1]].sum()) for j in range(len(xs) - 1)]
+                    for i in range(len(ys) - 1)]
+        assert cell_sums(image, ys, xs).tolist() == expected
+
+
+if __name__ == '__main__':
+    for test in (test_grid_cell_features_match_legacy, test_shared_gray_matches,
+                 test_region_densities_match_legacy, test_cell_sums):
+        test()
+        print(f"ok  {test.__name__}")
@@ -0,0 +1,110 @@
+"""
+Checks that upload inspection accepts the formats the service decodes,
+including phone MPO files, and rejects mismatched, oversized and
+unreadable uploads with the documented status codes.
+
+Usage:
+    python -m pytest test_ingest_guard.py
+    python test_ingest_guard.py
+"""
+
+import io
+from unittest import mock
+
+from PIL import Image
+
+import image_decode
+import ingest_guard
+from ingest_guard import UploadRejected, inspect_stream
+
+ORIENTATION = 0x0112
+
+
+def encode(fmt, size=(40, 30), frames=1, orientation=None):
+    """Bytes of a solid image in PIL format fmt, with frames frames"""
+    image = Image.new('RGB', size, (200, 120, 40))
+    kwargs = {}
+    if frames > 1:
+        kwargs = {'save_all': True, 'append_images': [image.copy() for _ in range(frames - 1)]}
+    if orientation is not None:
+        exif = Image.Exif()
+        exif[ORIENTATION] = orientation
+        kwargs['exif'] = exif
+    buf = io.BytesIO()
+    image.save(buf, fmt, **kwargs)
+    return buf.getvalue()
+
+
+def rejection(data, filename, content_type=None):
+    """(status, reason) inspect_stream() rejects an upload with, or None if it is accepted"""
+    stream = io.BytesIO(data)
+    try:
+        inspect_stream(stream, filename, content_type)
+    except UploadRejected as e:
+        return e.status, e.reason
+    finally:
+        assert stream.tell() == 0
+    return None
+
+
+def test_accepts_supported_formats():
+    for fmt, filename, content_type in (('JPEG', 'scan.jpg', 'image/jpeg'), ('PNG', 'scan.png', 'image/png'),
+                                        ('GIF', 'scan.gif', 'image/gif'), ('BMP', 'scan.bmp', 'image/bmp'),
+                                        ('TIFF', 'scan.tiff', 'image/tiff')):
+        assert rejection(encode(fmt), filename, content_type) is None, fmt
+
+
+def test_accepts_mpo_as_jpeg():
+    # What many phone cameras write: a JPEG with a second image appended
+    mpo = encode('MPO', frames=2, orientation=6)
+    header = inspect_stream(io.BytesIO(mpo), 'photo.jpg', 'image/jpeg')
+    assert header.format == 'MPO'
+    # Orientation 6 is a 90 degree rotation: dimensions are swapped
+    assert (header.width, header.height, header.orientation) == (30, 40, 6)
+    assert rejection(mpo, 'photo.jpeg', 'application/octet-stream') is None
+    assert rejection(mpo, 'photo.png') == (415, 'content_mismatch')
+
+
+def test_large_mpo_is_decoded_reduced():
+    mpo = encode('MPO', size=(800, 600), frames=2)
+    with mock.patch.object(image_decode, 'MAX_DECODE_PIXELS', 100_000):
+        assert rejection(mpo, 'photo.jpg', 'image/jpeg') is None
+        assert rejection(encode('PNG', size=(800, 600)), 'scan.png') == (413, 'too_many_pixels')
+
+
+def test_mismatched_extension_or_content_type():
+    png = encode('PNG')
+    assert rejection(png, 'scan.jpg') == (415, 'content_mismatch')
+    assert rejection(png, 'scan.png', 'image/jpeg') == (415, 'content_mismatch')
+    assert rejection(png, 'scan.png', 'image/png; charset=binary') is None
+    assert rejection(encode('WEBP'), 'scan.webp') == (415, 'unsupported_format')
+
+
+def test_unreadable_upload():
+    assert rejection(b'not an image at all', 'scan.png') == (400, 'unreadable')
+    assert rejection(b'%PDF-1.4\nnot really a pdf', 'scan.pdf') == (400, 'unreadable')
+
+
+def test_pixel_budget():
+    with mock.patch.object(image_decode, 'MAX_DECODE_PIXELS', 10_000):
+        assert rejection(encode('PNG', size=(101, 100)), 'scan.png') == (413, 'too_many_pixels')
+        assert rejection(encode('PNG', size=(100, 100)), 'scan.png') is None
+        # JPEGs within the budget at 1/8 scale are decoded reduced; larger ones are not
+        assert rejection(encode('JPEG', size=(800, 100)), 'scan.jpg') is None
+        assert rejection(encode('JPEG', size=(900, 800)), 'scan.jpg') == (413, 'too_many_pixels')
+
+
+def test_max_frames():
+    tiff = encode('TIFF', frames=3)
+    with mock.patch.object(ingest_guard, 'MAX_FRAMES', 3):
+        assert rejection(tiff, 'scan.tif') is None
+    with mock.patch.object(ingest_guard, 'MAX_FRAMES', 2):
+        assert rejection(tiff, 'scan.tif') == (413, 'too_many_frames')
+
+
+if __name__ == '__main__':
+    for test in (test_accepts_supported_formats, test_accepts_mpo_as_jpeg, test_large_mpo_is_decoded_reduced,
+                 test_mismatched_extension_or_content_type, test_unreadable_upload, test_pixel_budget,
+                 test_max_frames):
+        test()
+        print(f"ok  {test.__name__}")
@@ -0,0 +1,117 @@
+"""
+Checks the job queue's claim order and leases: jobs are claimed by priority,
+only jobs whose heartbeat expired are requeued, and a claim that lost its
+lease cannot record a result.
+
+Usage:
+    python -m pytest test_job_queue.py
+    python test_job_queue.py
+"""
+
+import pathlib
+import sqlite3
+import tempfile
+import time
+from unittest import mock
+
+import job_queue
+from job_queue import DONE, PRIORITIES, QUEUED, RUNNING, JobQueue
+
+# Short lease, so tests only wait a fraction of a second for it to expire
+LEASE = 0.2
+
+
+def new_queue(tmp_path):
+    return JobQueue(str(tmp_path / 'jobs.sqlite3'))
+
+
+def expire_lease():
+    time.sleep(LEASE * 1.5)
+
+
+def test_claim_by_priority_then_age(tmp_path):
+    queue = new_queue(tmp_path)
+    ids = {}
+    for name, priority in (('bulk', 'bulk'), ('normal 1', 'normal'), ('interactive', 'interactive'),
+                           ('normal 2', 'normal')):
+        ids[name] = queue.enqueue('verify', {'name': name}, PRIORITIES[priority])
+        time.sleep(0.002)
+
+    claimed = [queue.claim('w1') for _ in range(4)]
+    assert [job['payload']['name'] for job in claimed] == ['interactive', 'normal 1', 'normal 2', 'bulk']
+    assert all(job['status'] == RUNNING and job['worker'] == 'w1' for job in claimed)
+    assert queue.claim('w1') is None
+    assert queue.get(ids['bulk'])['status'] == RUNNING
+
+
+def test_requeue_leaves_heartbeating_jobs(tmp_path):
+    queue = new_queue(tmp_path)
+    stale = queue.enqueue('verify', {}, PRIORITIES['interactive'])
+    live = queue.enqueue('verify', {}, PRIORITIES['normal'])
+    assert queue.claim('dead:0')['id'] == stale
+    assert queue.claim('live:0')['id'] == live
+
+    expire_lease()
+    queue.heartbeat([(live, 'live:0')])
+    assert queue.requeue_expired(LEASE) == 1
+    assert queue.get(stale)['status'] == QUEUED and queue.get(stale)['worker'] is None
+    assert queue.get(live)['status'] == RUNNING and queue.get(live)['worker'] == 'live:0'
+
+    # A heartbeat of a claim the job no longer has does not revive it
+    queue.heartbeat([(stale, 'dead:0')])
+    assert queue.get(stale)['status'] == QUEUED
+
+
+def test_finish_ignored_after_lease_expires(tmp_path):
+    queue = new_queue(tmp_path)
+    job_id = queue.enqueue('extract', {})
+    assert queue.claim('w1')['id'] == job_id
+
+    expire_lease()
+    assert queue.requeue_expired(LEASE) == 1
+    assert queue.claim('w2')['id'] == job_id
+
+    # The first claim finishing late must not overwrite the new claim's run
+    assert not queue.finish(job_id, result={'by': 'w1'}, worker='w1')
+    assert queue.get(job_id)['status'] == RUNNING
+    assert queue.finish(job_id, result={'by': 'w2'}, worker='w2')
+    job = queue.get(job_id)
+    assert job['status'] == DONE and job['result'] == {'by': 'w2'}
+    assert not queue.finish(job_id, result={'by': 'w2'}, worker='w2')
+
+
+def test_connections_are_closed(tmp_path):
+    queue = new_queue(tmp_path)
+    opened = []
+    connect = sqlite3.connect
+
+    def tracking_connect(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        opened.append(conn)
+        return conn
+
+    with mock.patch.object(job_queue.sqlite3, 'connect', side_effect=tracking_connect):
+        job_id = queue.enqueue('verify', {})
+        queue.claim('w1')
+        queue.heartbeat([(job_id, 'w1')])
+        queue.requeue_expired(LEASE)
+        queue.finish(job_id, result={}, worker='w1')
+        queue.get(job_id)
+        queue.metrics()
+        queue.purge()
+
+    assert opened
+    for conn in opened:
+        try:
+            conn.execute('SELECT 1')
+        except sqlite3.ProgrammingError:
+            continue
+        raise AssertionError('connection left open')
+
+
+if __name__ == '__main__':
+    for test in (test_claim_by_priority_then_age, test_requeue_leaves_heartbeating_jobs,
+                 test_finish_ignored_after_lease_expires, test_connections_are_closed):
+        with tempfile.TemporaryDirectory() as directory:
+            test(pathlib.Path(directory))
+        print(f"ok  {test.__name__}")
@@ -0,0 +1,119 @@
+"""
+Checks which uploads are read page by page, that multi-frame TIFFs and GIFs
+and PDFs are paged in order, and that PDFs without pypdfium2 are refused
+with UnsupportedPages (415 on upload).
+
+Usage:
+    python -m pytest test_page_source.py
+    python test_page_source.py
+"""
+
+import io
+import os
+import tempfile
+from unittest import mock
+
+from PIL import Image
+
+import page_source
+from ingest_guard import UploadRejected, inspect_stream
+from page_source import UnsupportedPages, is_paged, iter_pages, pdf_info
+
+# Frame colours (RGB); page n is filled with COLOURS[n - 1]
+COLOURS = [(255, 0, 0), (0, 255, 0), (0, 0, 255)]
+
+
+def save(directory, name, frames, size=(60, 40)):
+    """Write a document with one solid frame per colour in frames; returns its path"""
+    images = [Image.new('RGB', size, colour) for colour in frames]
+    path = os.path.join(directory, name)
+    if len(images) > 1:
+        images[0].save(path, save_all=True, append_images=images[1:])
+    else:
+        images[0].save(path)
+    return path
+
+
+def page_colours(path, dpi=None):
+    """(page number, colour in COLOURS nearest its centre pixel) of every page"""
+    result = []
+    for number, image in iter_pages(path, dpi=dpi):
+        b, g, r = (int(v) for v in image[image.shape[0] // 2, image.shape[1] // 2])
+        # PIL stores PDF images as JPEG, so colours come back only approximately
+        colour = min(COLOURS, key=lambda c: abs(c[0] - r) + abs(c[1] - g) + abs(c[2] - b))
+        result.append((number, colour))
+    return result
+
+
+def test_multi_frame_tiff_is_paged():
+    with tempfile.TemporaryDirectory() as directory:
+        path = save(directory, 'scan.tif', COLOURS)
+        assert is_paged(path)
+        assert page_colours(path) == list(enumerate(COLOURS, 1))
+
+
+def test_single_frames_are_not_paged():
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ('scan.tif', 'scan.gif', 'scan.png', 'scan.jpg'):
+            path = save(directory, name, COLOURS[:1])
+            assert not is_paged(path), name
+            pages = list(iter_pages(path))
+            assert [number for number, _ in pages] == [1], name
+        assert is_paged(save(directory, 'anim.gif', COLOURS))
+
+
+def test_frames_over_budget_are_skipped():
+    with tempfile.TemporaryDirectory() as directory:
+        path = save(directory, 'scan.tif', COLOURS)
+        with mock.patch.object(page_source, 'MAX_DECODE_PIXELS', 60 * 40 - 1):
+            assert page_colours(path) == []
+
+
+def test_pdf_pages():
+    if page_source.pdfium is None:
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        path = save(directory, 'scan.pdf', COLOURS)
+        assert is_paged(path)
+        assert pdf_info(path, 72).pages == 3
+        assert page_colours(path, dpi=72) == list(enumerate(COLOURS, 1))
+
+
+def test_pdf_without_pypdfium2():
+    with tempfile.TemporaryDirectory() as directory:
+        path = save(directory, 'scan.pdf', COLOURS[:1])
+        with mock.patch.object(page_source, 'pdfium', None):
+            for read in (lambda: pdf_info(path, 72), lambda: list(iter_pages(path, dpi=72))):
+                try:
+                    read()
+                except UnsupportedPages:
+                    pass
+                else:
+                    raise AssertionError('UnsupportedPages not raised')
+            with open(path, 'rb') as stream:
+                try:
+                    inspect_stream(stream, 'scan.pdf', 'application/pdf')
+                except UploadRejected as e:
+                    assert (e.status, e.reason) == (415, 'unsupported_format')
+                else:
+                    raise AssertionError('PDF accepted without pypdfium2')
+
+
+def test_corrupt_pdf_is_value_error():
+    if page_source.pdfium is None:
+        return
+    stream = io.BytesIO(b'%PDF-1.4\nnot really a pdf')
+    try:
+        pdf_info(stream, 72)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('ValueError not raised')
+
+
+if __name__ == '__main__':
+    for test in (test_multi_frame_tiff_is_paged, test_single_frames_are_not_paged,
+                 test_frames_over_budget_are_skipped, test_pdf_pages, test_pdf_without_pypdfium2,
+                 test_corrupt_pdf_is_value_error):
+        test()
+        print(f"ok  {test.__name__}")
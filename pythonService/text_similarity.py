@@ -0,0 +1,175 @@
+"""
+Precomputed text signatures for template text similarity.
+
+Text similarity is the Jaccard similarity of the word sets of two OCR texts.
+Tokenizing a template's stored text again on every comparison, and comparing
+a document against every template that way, does the same work over and
+over. Instead:
+
+- each template's token set and MinHash signature are computed once, at
+  training time, and stored with its features under 'text_signature'
+  (templates trained before that get theirs computed once when loaded);
+- an LSH index over the MinHash signatures (banded, BANDS bands of
+  NUM_PERM / BANDS rows) finds the templates whose text is likely similar
+  to a document's with a few bucket lookups, and ranks them by estimated
+  similarity (integer comparisons of their signatures);
+- exact Jaccard over the token sets is only computed for the top candidates.
+
+MinHash uses CRC32 of each token and NUM_PERM universal hash functions with
+a fixed seed, so signatures are stable across processes and can be stored.
+"""
+
+import os
+import re
+import zlib
+
+import numpy as np
+
+# MinHash permutations (signature length) and LSH bands; NUM_PERM must be a multiple of BANDS
+NUM_PERM = int(os.getenv('MINHASH_PERMUTATIONS', '128'))
+BANDS = int(os.getenv('LSH_BANDS', '64'))
+
+# Universal hashing modulo a Mersenne prime. CRC32 values and coefficients
+# are below 2**32 and 2**31, so products fit in uint64 without overflow
+_PRIME = np.uint64((1 << 31) - 1)
+_SEED = 1
+_rng = np.random.RandomState(_SEED)
+_A = _rng.randint(1, int(_PRIME), NUM_PERM).astype(np.uint64)
+_B = _rng.randint(0, int(_PRIME), NUM_PERM).astype(np.uint64)
+
+_TOKEN = re.compile(r'\b\w+\b')
+
+
+def tokenize(text):
+    """Lower-cased word set of a text"""
+    return frozenset(_TOKEN.findall((text or '').lower()))
+
+
+def minhash(tokens):
+    """MinHash signature (NUM_PERM uint32 values) of a token set"""
+    if not tokens:
+        return np.full(NUM_PERM, int(_PRIME), dtype=np.uint32)
+    hashes = np.fromiter((zlib.crc32(token.encode('utf-8')) for token in tokens),
+                         dtype=np.uint64, count=len(tokens))
+    return ((hashes[:, None] * _A + _B) % _PRIME).min(axis=0).astype(np.uint32)
+
+
+def jaccard(tokens_a, tokens_b):
+    """Exact Jaccard similarity of two token sets (0 if either is empty)"""
+    if not tokens_a or not tokens_b:
+        return 0.0
+    intersection = len(tokens_a & tokens_b)
+    return intersection / (len(tokens_a) + len(tokens_b) - intersection)
+
+
+class TextSignature:
+    """Token set and MinHash signature of one text"""
+
+    __slots__ = ('tokens', 'minhash')
+
+    def __init__(self, tokens, signature=None):
+        self.tokens = frozenset(tokens)
+        self.minhash = minhash(self.tokens) if signature is None else signature
+
+    def estimate(self, other):
+        """Jaccard similarity estimated from the MinHash signatures"""
+        if not self.tokens or not other.tokens:
+            return 0.0
+        return float(np.count_nonzero(self.minhash == other.minhash)) / NUM_PERM
+
+    def jaccard(self, other):
+        return jaccard(self.tokens, other.tokens)
+
+    def to_features(self):
+        """JSON-friendly form stored with template features"""
+        return {
+            'tokens': sorted(self.tokens),
+            'minhash': self.minhash.tolist(),
+            'num_perm': NUM_PERM,
+            'seed': _SEED,
+        }
+
+    @classmethod
+    def from_features(cls, stored):
+        """A stored signature, or None if it is missing or was made with other MinHash parameters"""
+        if not isinstance(stored, dict) or stored.get('num_perm') != NUM_PERM or stored.get('seed') != _SEED:
+            return None
+        try:
+            signature = np.asarray(stored['minhash'], dtype=np.uint32)
+            tokens = stored['tokens']
+        except (KeyError, TypeError, ValueError):
+            return None
+        if signature.shape != (NUM_PERM,):
+            return None
+        return cls(tokens, signature)
+
+
+def text_signature(text):
+    """TextSignature of a text"""
+    return TextSignature(tokenize(text))
+
+
+def signature_of(features):
+    """
+    TextSignature of a feature dict: the stored 'text_signature' if usable,
+    else computed from its 'text'
+    """
+    signature = TextSignature.from_features(features.get('text_signature'))
+    if signature is None:
+        signature = text_signature(str(features.get('text', '') or ''))
+    return signature
+
+
+def text_jaccard(doc_features, template_features):
+    """Exact Jaccard similarity of the texts of two feature dicts"""
+    return signature_of(doc_features).jaccard(signature_of(template_features))
+
+
+class LshIndex:
+    """
+    Banded LSH index of TextSignatures by key. Two signatures share a
+    bucket in a band when all of the band's rows are equal; texts with
+    Jaccard similarity s collide in at least one band with probability
+    1 - (1 - s**rows)**bands.
+    """
+
+    def __init__(self, bands=BANDS):
+        if NUM_PERM % bands:
+            raise ValueError(f"{NUM_PERM} MinHash permutations cannot be split into {bands} bands")
+        self.bands = bands
+        self.rows = NUM_PERM // bands
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = {}
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def _band_keys(self, signature):
+        bands = signature.minhash.reshape(self.bands, self.rows)
+        return [band.tobytes() for band in bands]
+
+    def add(self, key, signature):
+        if not signature.tokens:
+            return
+        self._signatures[key] = signature
+        for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+            buckets.setdefault(band_key, []).append(key)
+
+    def candidates(self, signature):
+        """Keys sharing at least one band with signature"""
+        if not signature.tokens:
+            return set()
+        found = set()
+        for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+            found.update(buckets.get(band_key, ()))
+        return found
+
+    def query(self, signature, limit=5):
+        """
+        [(key, exact Jaccard)] of the best candidates, best first: candidates
+        are ranked by estimated similarity and the top limit get exact Jaccard
+        """
+        ranked = sorted(self.candidates(signature),
+                        key=lambda key: signature.estimate(self._signatures[key]), reverse=True)
+        scored = [(key, signature.jaccard(self._signatures[key])) for key in ranked[:limit]]
+        return sorted(scored, key=lambda item: item[1], reverse=True)
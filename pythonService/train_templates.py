@@ -1,9 +1,90 @@
+"""
+Train template features for every template image in a directory.
+
+Templates are trained in parallel across a process pool. A template is
+retrained only when it is stale: its image content (sha256) changed, or the
+features were produced by an older FEATURE_VERSION of the extractors. The
+hashes and versions are kept in a manifest next to the templates, and all
+outputs are written atomically so a crash never leaves a half-written .npy.
+The document-type classifier (doc_classifier.py) is retrained afterwards
+whenever any template was.
+
+Usage:
+    python train_templates.py [template_dir] [--workers N] [--force]
+"""
+
+import argparse
+import hashlib
+import json
 import os
-import cv2
-import numpy as np
 import sys
+import tempfile
 import time
-from app import extract_features, preprocess_image
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+from app import extract_features, FEATURE_VERSION
+from doc_classifier import train_and_save as train_classifier, MODEL_PATH as CLASSIFIER_PATH
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Staleness manifest, stored in the template directory
+MANIFEST_NAME = '.training_manifest.json'
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    """Hex sha256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def atomic_write(path, write):
+    """Call write(f) on a temporary file next to path, then rename it into place"""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.part', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_manifest(template_dir):
+    """Manifest of trained templates: {image filename: {sha256, feature_version, ...}}"""
+    path = os.path.join(template_dir, MANIFEST_NAME)
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(template_dir, manifest):
+    path = os.path.join(template_dir, MANIFEST_NAME)
+    data = json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8')
+    atomic_write(path, lambda f: f.write(data))
+
+
+def feature_path_for(template_path):
+    template_name = os.path.splitext(os.path.basename(template_path))[0]
+    return os.path.join(os.path.dirname(template_path), f"{template_name}.npy")
+
+
+def is_stale(entry, sha256, feature_path):
+    """Whether a template has to be (re)trained"""
+    if not entry or not os.path.exists(feature_path):
+        return True
+    return entry.get('sha256') != sha256 or entry.get('feature_version') != FEATURE_VERSION
+
 
 def train_template(template_path):
     """Train a template and save its features"""
@@ -11,26 +92,22 @@ def train_template(template_path):
         # Load the template image
         print(f"Loading template: {template_path}")
         template_img = cv2.imread(template_path)
-        
+
         if template_img is None:
             print(f"Error: Could not read template image: {template_path}")
             return False
-        
+
         # Get template name without extension
         template_name = os.path.splitext(os.path.basename(template_path))[0]
-        
-        # Process the template image
-        print(f"Preprocessing template: {template_name}")
-        processed_img = preprocess_image(template_img)
-        
+
         # Extract features
         print(f"Extracting features for template: {template_name}")
         template_features = extract_features(template_img)
-        
-        # Save features to .npy file
-        feature_path = os.path.join(os.path.dirname(template_path), f"{template_name}.npy")
-        np.save(feature_path, template_features)
-        
+
+        # Save features to .npy file (atomically, readers never see a partial file)
+        feature_path = feature_path_for(template_path)
+        atomic_write(feature_path, lambda f: np.save(f, template_features))
+
         print(f"Features extracted and saved for {template_name}")
         return True
     except Exception as e:
@@ -39,36 +116,111 @@ def train_template(template_path):
         traceback.print_exc()
         return False
 
-def train_all_templates(template_dir):
-    """Train all templates in a directory"""
-    count = 0
-    success = 0
-    
-    # Check for template images
-    for filename in os.listdir(template_dir):
-        if filename.endswith('.jpg') or filename.endswith('.jpeg') or filename.endswith('.png'):
-            template_path = os.path.join(template_dir, filename)
-            
-            # Skip if npy file already exists
-            template_name = os.path.splitext(filename)[0]
-            feature_path = os.path.join(template_dir, f"{template_name}.npy")
-            
-            if os.path.exists(feature_path):
-                print(f"Skipping {filename} - features already exist")
-                success += 1
-                count += 1
-                continue
-                
-            count += 1
-            if train_template(template_path):
-                success += 1
-    
-    print(f"Training complete: {success}/{count} templates processed successfully")
+
+def _init_worker():
+    # One template per process; OpenCV's own thread pool would oversubscribe the cores
+    cv2.setNumThreads(1)
+
+
+def _train_worker(template_path):
+    """Process pool entry point: train one template and time it"""
+    start = time.perf_counter()
+    success = train_template(template_path)
+    return success, time.perf_counter() - start
+
+
+def train_all_templates(template_dir, workers=None, force=False):
+    """
+    Train all stale templates in a directory in parallel.
+    Returns a summary dict with per-template results and timings.
+    """
+    start = time.perf_counter()
+    manifest = load_manifest(template_dir)
+    workers = workers or os.cpu_count() or 1
+
+    # Decide what to train from content hashes and the extractor version
+    results = {}
+    stale = {}
+    for filename in sorted(os.listdir(template_dir)):
+        if not filename.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        template_path = os.path.join(template_dir, filename)
+        sha256 = file_sha256(template_path)
+
+        if not force and not is_stale(manifest.get(filename), sha256, feature_path_for(template_path)):
+            results[filename] = {'status': 'skipped', 'seconds': 0.0}
+            continue
+        stale[filename] = sha256
+
+    print(f"{len(stale)} of {len(stale) + len(results)} templates need training "
+          f"(feature version {FEATURE_VERSION}, {workers} workers)")
+
+    if stale:
+        with ProcessPoolExecutor(max_workers=min(workers, len(stale)), initializer=_init_worker) as executor:
+            futures = {
+                executor.submit(_train_worker, os.path.join(template_dir, filename)): filename
+                for filename in stale
+            }
+            for future in as_completed(futures):
+                filename = futures[future]
+                try:
+                    success, seconds = future.result()
+                except Exception as e:
+                    print(f"Error training template {filename}: {str(e)}")
+                    success, seconds = False, 0.0
+
+                results[filename] = {'status': 'trained' if success else 'failed', 'seconds': seconds}
+                if success:
+                    manifest[filename] = {
+                        'sha256': stale[filename],
+                        'feature_version': FEATURE_VERSION,
+                        'trained_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                        'seconds': round(seconds, 3),
+                    }
+
+    # Forget templates whose image was removed
+    for filename in list(manifest):
+        if filename not in results:
+            del manifest[filename]
+    save_manifest(template_dir, manifest)
+
+    summary = {
+        'trained': sum(1 for r in results.values() if r['status'] == 'trained'),
+        'skipped': sum(1 for r in results.values() if r['status'] == 'skipped'),
+        'failed': sum(1 for r in results.values() if r['status'] == 'failed'),
+        'workers': workers,
+        'seconds': time.perf_counter() - start,
+        'templates': results,
+    }
+    print_summary(summary)
+    return summary
+
+
+def print_summary(summary):
+    print("\nTemplate                                   Status     Time (s)")
+    for filename, result in sorted(summary['templates'].items(), key=lambda item: -item[1]['seconds']):
+        print(f"{filename[:42]:<42} {result['status']:<10} {result['seconds']:8.2f}")
+    total = summary['trained'] + summary['skipped'] + summary['failed']
+    print(f"\nTraining complete: {summary['trained'] + summary['skipped']}/{total} templates up to date "
+          f"({summary['trained']} trained, {summary['skipped']} skipped, {summary['failed']} failed) "
+          f"in {summary['seconds']:.2f}s with {summary['workers']} workers")
+
 
 if __name__ == "__main__":
     # Get templates directory
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    template_dir = os.path.join(script_dir, 'templates')
-    
-    print(f"Training templates in: {template_dir}")
-    train_all_templates(template_dir) 
\ No newline at end of file
+
+    parser = argparse.ArgumentParser(description='Train features for all template images in a directory.')
+    parser.add_argument('template_dir', nargs='?', default=os.path.join(script_dir, 'templates'))
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    parser.add_argument('--force', action='store_true', help='Retrain every template')
+    args = parser.parse_args()
+
+    print(f"Training templates in: {args.template_dir}")
+    summary = train_all_templates(args.template_dir, workers=args.workers, force=args.force)
+
+    # The document-type classifier learns from the same template images
+    classifier_path = os.path.join(args.template_dir, os.path.basename(CLASSIFIER_PATH))
+    if summary['trained'] or args.force or not os.path.exists(classifier_path):
+        train_classifier(args.template_dir, classifier_path)
+    sys.exit(1 if summary['failed'] else 0)
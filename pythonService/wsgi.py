@@ -0,0 +1,61 @@
+"""
+Production WSGI entry point.
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+With preload_app (see gunicorn.conf.py) this module is imported once in the
+gunicorn master: the Flask app, OpenCV, the template registry and the
+document classifier are loaded before forking, so every worker shares those
+pages copy-on-write instead of loading its own copy. Per-process state that
+does not survive a fork (the registry watcher thread) is started again in
+each worker, and OCR is warmed up before a worker accepts traffic.
+"""
+
+import glob
+import os
+import time
+
+import numpy as np
+import cv2
+
+from app import app, init_service, template_registry, extract_text, has_tesseract, TEMPLATE_DIR
+from registration import template_frame
+from doc_classifier import classifier, train_and_save as train_classifier, MODEL_PATH as CLASSIFIER_PATH
+
+init_service()
+
+# Load every template into the registry, and compute the registration
+# keypoints of every template image, before workers fork
+template_registry.refresh()
+for path in glob.glob(os.path.join(TEMPLATE_DIR, '*.jpg')):
+    template_frame(path)
+
+# The classifier model is generated, not shipped: train it (a couple of
+# seconds) if train_templates.py has not been run on this checkout
+if not os.path.exists(CLASSIFIER_PATH):
+    train_classifier(TEMPLATE_DIR, CLASSIFIER_PATH)
+classifier()
+
+application = app
+
+
+def warm_up():
+    """
+    Run the OCR and OpenCV code paths once, so the first real request does
+    not pay for loading the tesseract binary and language data, or for
+    OpenCV's lazy initialisation. Returns the time taken in seconds.
+    """
+    start = time.perf_counter()
+
+    # White page with one line of black text
+    image = np.full((120, 600, 3), 255, dtype=np.uint8)
+    cv2.putText(image, 'STATEMENT OF MARKS 2024', (10, 70), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 0), 2)
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    cv2.Canny(gray, 50, 150)
+    cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 11, 2)
+
+    if has_tesseract:
+        extract_text(image)
+
+    return time.perf_counter() - start
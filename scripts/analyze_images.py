@@ -15,6 +15,27 @@ from pathlib import Path
 
 # Constants
 FEATURES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server', 'data', 'features')
+PYTHON_SERVICE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pythonService')
+
+# Shared image processing modules live in pythonService
+sys.path.insert(0, PYTHON_SERVICE_DIR)
+from table_structure import detect_lines, table_cells
+from image_pyramid import ImagePyramid
+from seal_detector import detect_seals
+from field_extractor import Field, FieldSchema
+
+def _stripped(raw):
+    return raw.strip() or None
+
+# Potential field labels and values, found in one scan of the OCR text
+FIELD_PATTERNS = FieldSchema('analysis', [
+    Field('student_name_pattern', r'student|name', r'[A-Za-z\s.]+', validator=_stripped),
+    Field('roll_number_pattern', r'(?:roll|seat)[:\s]*(?:no|number|#)', r'[A-Z0-9]+',
+          separator=r'[:\s]*', validator=_stripped),
+    Field('board_pattern', r'board|university', r'[A-Za-z\s.]+', validator=_stripped),
+    Field('year_pattern', r'batch|year', r'\d{4}', validator=_stripped),
+    Field('exam_pattern', r'exam', r'[A-Za-z\s.]+\d{4}', validator=_stripped),
+])
 
 def preprocess_image(image_path):
     """Preprocess the image for better feature extraction."""
@@ -63,20 +84,7 @@ def extract_features(image_path):
         features['text'] = text
         
         # Extract named entities and potential fields
-        # Look for patterns that could be field labels
-        field_patterns = [
-            (r'(?:STUDENT|NAME)[:\s]+([A-Za-z\s.]+)', 'student_name_pattern'),
-            (r'(?:ROLL|SEAT)[:\s]*(?:NO|NUMBER|#)[:\s]*([A-Z0-9]+)', 'roll_number_pattern'),
-            (r'(?:BOARD|UNIVERSITY)[:\s]+([A-Za-z\s.]+)', 'board_pattern'),
-            (r'BATCH|YEAR[:\s]+(\d{4})', 'year_pattern'),
-            (r'EXAM[:\s]+([A-Za-z\s.]+\d{4})', 'exam_pattern')
-        ]
-        
-        patterns_found = {}
-        for pattern, label in field_patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            if matches:
-                patterns_found[label] = matches[0].strip()
+        patterns_found = {name: field.value for name, field in FIELD_PATTERNS.extract(text).items()}
         
         features['field_patterns'] = patterns_found
         
@@ -97,46 +105,24 @@ def extract_features(image_path):
         contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         features['num_contours'] = len(contours)
         
-        # Extract logo and seal positions - look for circular patterns
-        circles = cv2.HoughCircles(
-            processed['blur'],
-            cv2.HOUGH_GRADIENT,
-            1,
-            20,
-            param1=50,
-            param2=30,
-            minRadius=10,
-            maxRadius=100
-        )
-        
-        if circles is not None:
-            circles = np.round(circles[0, :]).astype("int")
-            features['seal_positions'] = circles.tolist()
-        else:
-            features['seal_positions'] = []
-        
-        # Layout detection - detect horizontal and vertical lines
-        horizontal_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (50, 1))
-        horizontal_lines = cv2.morphologyEx(processed['thresh'], cv2.MORPH_OPEN, horizontal_kernel)
-        vertical_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 50))
-        vertical_lines = cv2.morphologyEx(processed['thresh'], cv2.MORPH_OPEN, vertical_kernel)
+        # Extract logo and seal positions - circles in the declared seal regions
+        seals = detect_seals(ImagePyramid(processed['original']))
+        features['seal_positions'] = seals['circles']
         
-        # Get line positions
-        h_lines, _ = cv2.findContours(horizontal_lines, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        v_lines, _ = cv2.findContours(vertical_lines, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # Layout detection - runs of at least 50 solid pixels along rows/columns
+        h_lines = detect_lines(processed['thresh'], 'horizontal', min_length=50, solid_length=50, max_gap=0)
+        v_lines = detect_lines(processed['thresh'], 'vertical', min_length=50, solid_length=50, max_gap=0)
         
         features['layout'] = {
             'h_lines': len(h_lines),
             'v_lines': len(v_lines),
         }
         
-        # Extract regions of interest - look for rectangular sections
-        combined_lines = cv2.addWeighted(horizontal_lines, 0.5, vertical_lines, 0.5, 0)
-        rect_contours, _ = cv2.findContours(combined_lines, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # Extract regions of interest - the ruled cells of tables
+        _, _, cells = table_cells(h_lines, v_lines)
         
         rois = []
-        for contour in rect_contours:
-            x, y, w, h = cv2.boundingRect(contour)
+        for x, y, w, h in cells:
             if w > 50 and h > 20:  # Filter out small noise
                 rois.append([x, y, w, h])
         
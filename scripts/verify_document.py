@@ -10,17 +10,23 @@ import cv2
 import numpy as np
 from PIL import Image
 import pytesseract
-import re
 from pathlib import Path
 import argparse
 
 # Constants
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 SERVER_DIR = os.path.join(os.path.dirname(SCRIPT_DIR), 'server')
+PYTHON_SERVICE_DIR = os.path.join(os.path.dirname(SCRIPT_DIR), 'pythonService')
 TEMPLATE_DIR = os.path.join(SERVER_DIR, 'uploads', 'templates')
 FEATURES_DIR = os.path.join(SERVER_DIR, 'data', 'features')
 TEMP_DIR = os.path.join(SERVER_DIR, 'uploads', 'temp')
 
+# Shared image processing modules live in pythonService
+sys.path.insert(0, PYTHON_SERVICE_DIR)
+from image_pyramid import ImagePyramid, CANONICAL_LEVEL
+from seal_detector import detect_seals
+from text_similarity import text_signature, text_jaccard
+
 # Debug flag
 DEBUG = False
 
@@ -35,7 +41,11 @@ def debug_print(message):
         print(f"DEBUG: {message}", file=sys.stderr)
 
 def preprocess_image(image_path):
-    """Preprocess the image for better feature extraction."""
+    """
+    Preprocess the image for better feature extraction.
+    The image is normalized to the canonical pyramid level, so features and
+    coordinates do not depend on the resolution of the upload.
+    """
     try:
         # Read image
         debug_print(f"Reading image from {image_path}")
@@ -43,32 +53,29 @@ def preprocess_image(image_path):
         if img is None:
             raise ValueError(f"Could not read image from {image_path}")
         
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Apply thresholding to handle variations in brightness
-        _, thresh = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-        
-        # Additional preprocessing
-        # Noise reduction
-        blur = cv2.GaussianBlur(gray, (5, 5), 0)
+        pyramid = ImagePyramid(img)
+        canonical = pyramid.context(CANONICAL_LEVEL)
         
         debug_print("Image preprocessing completed successfully")
         return {
-            'original': img,
-            'gray': gray,
-            'thresh': thresh,
-            'blur': blur
+            'pyramid': pyramid,
+            'original': canonical.bgr,
+            'gray': canonical.gray,
+            'blur': canonical.blur
         }
     except Exception as e:
         debug_print(f"Error in preprocess_image: {str(e)}")
         raise
 
-def extract_features(image_path):
-    """Extract features from the document image."""
+def extract_features(image_path, processed=None):
+    """
+    Extract features from the document image.
+    Pass processed (from preprocess_image) to reuse an already decoded image.
+    """
     try:
         debug_print(f"Extracting features from {image_path}")
-        processed = preprocess_image(image_path)
+        if processed is None:
+            processed = preprocess_image(image_path)
         features = {}
         
         # Extract text using OCR
@@ -76,18 +83,22 @@ def extract_features(image_path):
             debug_print("Running OCR...")
             # Configuration for detailed OCR
             custom_config = r'--oem 3 --psm 6 -l eng'
-            text = pytesseract.image_to_string(processed['gray'], config=custom_config)
+            with processed['pyramid'].timed('high', 'ocr') as high:
+                text = pytesseract.image_to_string(high.gray, config=custom_config)
             features['text'] = text
             debug_print(f"OCR text length: {len(text)}")
         except Exception as e:
             debug_print(f"OCR error: {str(e)}")
             features['text'] = ""
+        # Token set and MinHash, stored with template features when saved
+        features['text_signature'] = text_signature(features['text']).to_features()
         
         # Extract structural features
         try:
             debug_print("Extracting structural features...")
             # Edge detection
-            edges = cv2.Canny(processed['blur'], 50, 150)
+            pyramid = processed['pyramid']
+            edges = pyramid.context(CANONICAL_LEVEL).canny('blur', 50, 150)
             
             # Extract edge density
             edge_pixels = np.sum(edges > 0)
@@ -109,29 +120,16 @@ def extract_features(image_path):
             features['rois'] = rois
             debug_print(f"Number of ROIs: {len(rois)}")
             
-            # Detect seals/logos (circular patterns)
-            circles = None
+            # Detect seals/logos in the declared seal regions, at the low
+            # pyramid level with hits refined at the high level
             try:
-                circles = cv2.HoughCircles(
-                    processed['blur'],
-                    cv2.HOUGH_GRADIENT,
-                    1,
-                    20,
-                    param1=50,
-                    param2=30,
-                    minRadius=10,
-                    maxRadius=100
-                )
+                with pyramid.timed('low', 'seal_detector'):
+                    seals = detect_seals(pyramid)
+                features['seal_positions'] = seals['circles']
+                debug_print(f"Number of seals/logos detected: {len(features['seal_positions'])}")
             except Exception as e:
                 debug_print(f"Circle detection error: {str(e)}")
-                
-            if circles is not None:
-                circles = np.round(circles[0, :]).astype("int")
-                features['seal_positions'] = circles.tolist()
-                debug_print(f"Number of seals/logos detected: {len(features['seal_positions'])}")
-            else:
                 features['seal_positions'] = []
-                debug_print("No seals/logos detected")
             
         except Exception as e:
             debug_print(f"Structural feature extraction error: {str(e)}")
@@ -140,6 +138,7 @@ def extract_features(image_path):
             features['rois'] = []
             features['seal_positions'] = []
         
+        debug_print(f"Pyramid levels: {json.dumps(processed['pyramid'].summary()['levels'])}")
         debug_print("Feature extraction completed")
         return features
     except Exception as e:
@@ -164,28 +163,9 @@ def compare_features(doc_features, template_features):
         # Compare text similarity
         try:
             debug_print("Comparing text similarity")
-            doc_text = doc_features.get('text', '').lower()
-            template_text = template_features.get('text', '').lower()
-            
-            # Simple text matching for testing
-            if doc_text and template_text:
-                # Generate word sets from both texts
-                doc_words = set(re.findall(r'\b\w+\b', doc_text))
-                template_words = set(re.findall(r'\b\w+\b', template_text))
-                
-                # Calculate Jaccard similarity
-                if doc_words and template_words:
-                    intersection = len(doc_words.intersection(template_words))
-                    union = len(doc_words.union(template_words))
-                    word_similarity = intersection / union if union > 0 else 0
-                else:
-                    word_similarity = 0
-                
-                # Calculate overall similarity with more emphasis on word matching
-                scores['text_similarity'] = word_similarity
-            else:
-                scores['text_similarity'] = 0
-                
+            # Jaccard similarity of the word sets, from the token sets stored
+            # with the features (tokenized here only for features without them)
+            scores['text_similarity'] = text_jaccard(doc_features, template_features)
             debug_print(f"Text similarity score: {scores['text_similarity']}")
         except Exception as e:
             debug_print(f"Text comparison error: {str(e)}")
@@ -268,12 +248,16 @@ def compare_features(doc_features, template_features):
             'overall': 0
         }
 
-def analyze_document(doc_path, template_path, features_path, scores):
-    """Create visual analysis of verification results."""
+def analyze_document(doc_path, template_path, features_path, scores, doc_features=None, doc_img=None):
+    """
+    Create visual analysis of verification results.
+    doc_features and doc_img are reused when the caller already has them.
+    """
     try:
         debug_print("Creating visual analysis")
-        # Read images
-        doc_img = cv2.imread(doc_path)
+        # Read images (the document at the canonical level its features use)
+        if doc_img is None:
+            doc_img = preprocess_image(doc_path)['original']
         template_img = cv2.imread(template_path)
         
         if doc_img is None:
@@ -332,7 +316,8 @@ def analyze_document(doc_path, template_path, features_path, scores):
         # Draw comparison if we have template features
         if template_features and 'rois' in template_features:
             # Get document features
-            doc_features = extract_features(doc_path)
+            if doc_features is None:
+                doc_features = extract_features(doc_path)
             
             # Highlight ROIs on the document
             for roi in doc_features.get('rois', []):
@@ -412,14 +397,18 @@ def verify_document(doc_path, template_name):
             except Exception as e:
                 debug_print(f"Error saving template features: {str(e)}")
         
-        # Extract features from document
-        doc_features = extract_features(doc_path)
+        # Extract features from document (decoded and preprocessed once)
+        doc_processed = preprocess_image(doc_path)
+        doc_features = extract_features(doc_path, doc_processed)
         
         # Compare features
         scores = compare_features(doc_features, template_features)
         
         # Create visual analysis
-        analysis_path = analyze_document(doc_path, template_path, features_path, scores)
+        analysis_path = analyze_document(
+            doc_path, template_path, features_path, scores,
+            doc_features=doc_features, doc_img=doc_processed['original']
+        )
         
         # Determine if document is verified (threshold can be adjusted)
         verified = scores.get('overall', 0) >= 0.65